@@ -24,6 +24,8 @@ import re
 import subprocess
 from subprocess import Popen, PIPE, CalledProcessError
 
+from Pharlap import kmod
+
 class MultiArchUtils(object):
 
     def __init__(self):
@@ -150,8 +152,27 @@ class Alternatives(object):
 
     def resolve_module_alias(self, alias):
         '''Get the 1st kernel module name matching an alias'''
+        return self.resolve_module_aliases([alias])[alias]
+
+    def resolve_module_aliases(self, aliases):
+        '''Get the 1st kernel module name matching each alias
+
+        Return a dictionary alias -> module name (or None). This reads the
+        module aliases of the running kernel and the modprobe configuration
+        once; modprobe is only called if the kernel's aliases are not
+        available.'''
+        index = kmod.index()
+        if index.has_aliases():
+            result = {}
+            for alias, modules in index.resolve_aliases(aliases).items():
+                result[alias] = modules and modules[0] or None
+            return result
+
+        return dict((alias, self._modprobe_resolve_alias(alias))
+                    for alias in aliases)
+
+    def _modprobe_resolve_alias(self, alias):
         dev_null = open('/dev/null', 'w')
-        current_alternative = None
         p1 = Popen(['modprobe', '--resolve-alias', alias], stdout=PIPE,
                    stderr=dev_null, universal_newlines=True)
         p = p1.communicate()[0]
@@ -160,5 +181,5 @@ class Alternatives(object):
         for line in c:
             if line.strip().startswith('Usage:'):
                 return None
-            return line.strip()
+            return line.strip() or None
         return None
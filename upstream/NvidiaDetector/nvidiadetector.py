@@ -26,6 +26,7 @@ import sys, logging
 import yum
 
 from Pharlap.YumCache import YumCache
+from Pharlap.hardware import HardwareSnapshot
 
 obsoletePackagesPath = '/usr/share/korora-drivers-common/obsolete'
 
@@ -45,7 +46,8 @@ class NvidiaDetection(object):
       * Return the recommended driver version
     '''
 
-    def __init__(self, printonly=None, verbose=None, obsolete=obsoletePackagesPath):
+    def __init__(self, printonly=None, verbose=None, obsolete=obsoletePackagesPath,
+                 snapshot=None):
         '''
         printonly = if set to None will make an instance
                     of this class return the selected
@@ -56,6 +58,9 @@ class NvidiaDetection(object):
 
         verbose   = if set to True will make the methods
                     print what is happening.
+
+        snapshot  = a HardwareSnapshot of the system; if set
+                    to None, a new one is created.
         '''
 
         # A simple look-up table for drivers whose name is not a digit
@@ -65,6 +70,7 @@ class NvidiaDetection(object):
 
         self.printonly = printonly
         self.verbose = verbose
+        self.snapshot = snapshot or HardwareSnapshot()
         self.oldPackages = self.getObsoletePackages(obsolete)
         self.detection()
         self.getData()
@@ -105,25 +111,11 @@ class NvidiaDetection(object):
         and store them in self.cards
         '''
         self.cards = []
-        p1 = Popen(['lspci', '-n'], stdout=PIPE, universal_newlines=True)
-        p = p1.communicate()[0].split('\n')
         # if you don't have an nvidia card, fake one for debugging
-        #p = ['00:02.0 0300: 10DE:03DE (rev 02)']
-        indentifier1 = re.compile('.*0300: *(.+):(.+) \(.+\)')
-        indentifier2 = re.compile('.*0300: *(.+):(.+)')
-        for line in p:
-            m1 = indentifier1.match(line)
-            m2 = indentifier2.match(line)
-            if m1:
-                id1 = m1.group(1).strip().lower()
-                id2 = m1.group(2).strip().lower()
-                id = id1 + ':' + id2
-                self.cards.append(id)
-            elif m2:
-                id1 = m2.group(1).strip().lower()
-                id2 = m2.group(2).strip().lower()
-                id = id1 + ':' + id2
-                self.cards.append(id)
+        #self.cards = ['10de:03de']
+        for (syspath, cls, vendor, device) in self.snapshot.pci_devices:
+            if cls == '0300' and vendor and device:
+                self.cards.append(vendor.lower() + ':' + device.lower())
 
     def getData(self):
         '''
@@ -1,14 +1,33 @@
 import fnmatch
+import hashlib
+import itertools
+import functools
 import json
+import logging
 import yum
 
+from Pharlap.modaliasmap import BinaryModaliasMap
+
+# modalias map locations, in order of preference; binary maps are only used
+# if they were converted from the current JSON map
+BINARY_MODALIAS_MAPS = ['/usr/share/pharlap/pharlap-modalias.bin']
+
+MODALIAS_MAPS = ['/usr/share/pharlap/pharlap-modalias.map',
+                 '/tmp/pharlap-modalias.map',
+                 '/tmp/modaliases.json']
+
 class YumCache(object):
+  _generations = itertools.count(1)
+
   def __init__(self, yb=yum.YumBase()):
     if not isinstance(yb, yum.YumBase):
       raise Exception('Expected YumBase object.')
 
     self._yb = yb
 
+    # unique per cache object, for keying data derived from it
+    self._generation = next(YumCache._generations)
+
     # we're a cache after all
     self._yb.conf.cache = 1
 
@@ -26,15 +45,50 @@ class YumCache(object):
 
       self._c[p.name].installed = p
 
-    maps = ['/usr/share/pharlap/pharlap-modalias.map',
-            '/tmp/pharlap-modalias.map',
-            '/tmp/modaliases.json']
-
     _map_data = None
-    for m in maps:
+    self._modalias_map = None
+    self._modalias_map_path = None
+    self._modalias_map_checksum = None
+
+    # SHA1 of the JSON map which would be used
+    _json_checksum = None
+    for m in MODALIAS_MAPS:
       try:
-        raw_data = open(m)
-        _map_data = json.load(raw_data)
+        with open(m, 'rb') as raw_data:
+          _json_checksum = hashlib.sha1(raw_data.read()).hexdigest()
+        break
+      except IOError:
+        pass
+
+    # prefer the binary map, it is only decoded as far as needed
+    for m in BINARY_MODALIAS_MAPS:
+      try:
+        binary_map = BinaryModaliasMap(m)
+      except Exception:
+        continue
+      if _json_checksum is not None and binary_map.checksum != _json_checksum:
+        logging.warning('Ignoring modalias map %s, it does not match the JSON map.', m)
+        binary_map.close()
+        continue
+      self._modalias_map = binary_map
+      self._modalias_map_path = m
+      self._modalias_map_checksum = binary_map.checksum
+      break
+
+    if self._modalias_map is not None:
+      for p in self._modalias_map.packages():
+        if p in self._c:
+          self._c[p].record_set_lazy('modaliases',
+              functools.partial(self._modalias_map.modaliases, p))
+      return
+
+    for m in MODALIAS_MAPS:
+      try:
+        with open(m, 'rb') as raw_data:
+          raw = raw_data.read()
+        _map_data = json.loads(raw)
+        self._modalias_map_path = m
+        self._modalias_map_checksum = hashlib.sha1(raw).hexdigest()
         break
       except Exception:
         pass
@@ -44,7 +98,24 @@ class YumCache(object):
         if p in self._c:
           self._c[p].record_set('modaliases',  v['modaliases'])
     else:
-      print "No modalias maps available."
+      logging.warning('No modalias maps available.')
+
+  @property
+  def generation(self):
+    return self._generation
+
+  # BinaryModaliasMap if a binary map was loaded, otherwise None
+  @property
+  def modalias_map(self):
+    return self._modalias_map
+
+  @property
+  def modalias_map_path(self):
+    return self._modalias_map_path
+
+  @property
+  def modalias_map_checksum(self):
+    return self._modalias_map_checksum
 
   def total_candidates(self):
     return len(self._candidates)
@@ -113,6 +184,7 @@ class YumCachePackage(object):
     self._candidate = candidate
     self._installed = installed
     self._records = {}
+    self._lazy_records = {}
 
   def __str__(self):
     return self._name
@@ -163,16 +235,25 @@ class YumCachePackage(object):
 
   def record(self, name):
     if not name in self._records:
-      raise KeyError('%s not a valid record' % (name))
+      if not name in self._lazy_records:
+        raise KeyError('%s not a valid record' % (name))
+
+      self._records[name] = self._lazy_records.pop(name)()
 
     return self._records[name]
 
   def has_record(self, name):
-    return name in self._records
+    return name in self._records or name in self._lazy_records
 
   def record_set(self, name, value):
+    self._lazy_records.pop(name, None)
     self._records[name] = value
 
+  # record whose value is computed by loader() on first access
+  def record_set_lazy(self, name, loader):
+    self._records.pop(name, None)
+    self._lazy_records[name] = loader
+
   def is_installed(self):
     return self._installed is not None
 
@@ -0,0 +1,101 @@
+'''Caches for data derived from a YumCache.'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import weakref
+from collections import OrderedDict
+
+
+class GenerationCache(object):
+    '''Bounded cache of data derived from YumCache objects.
+
+    Entries are keyed on the generation token of the YumCache and only hold a
+    weak reference to it. An entry is dropped when its YumCache gets garbage
+    collected, when more than maxsize YumCaches have entries, or on
+    invalidate(), so that long running processes which create a new YumCache
+    after every transaction do not accumulate stale data.
+    '''
+
+    def __init__(self, build, maxsize=2):
+        '''Create a cache.
+
+        build is called with a YumCache object to create the value for it.
+        '''
+        self._build = build
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def _key(klass, yum_cache):
+        return getattr(yum_cache, 'generation', None) or id(yum_cache)
+
+    def get(self, yum_cache):
+        '''Return the value for yum_cache, building it if necessary.'''
+
+        key = self._key(yum_cache)
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0]() is not yum_cache:
+            entry = (weakref.ref(yum_cache, self._reaper(key)),
+                     self._build(yum_cache))
+        self._entries[key] = entry
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+        return entry[1]
+
+    def invalidate(self, yum_cache=None):
+        '''Drop the entry for yum_cache, or all entries if not given.'''
+
+        if yum_cache is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(self._key(yum_cache), None)
+
+    def _reaper(self, key):
+        '''Return a weakref callback which drops the entry for key.'''
+
+        def reap(ref):
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._entries[key]
+        return reap
+
+
+class LRUCache(object):
+    '''Mapping which keeps the maxsize most recently used items.
+
+    A maxsize of 0 disables caching.
+    '''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
@@ -9,121 +9,228 @@
 # (at your option) any later version.
 
 import os
+import re
+import ast
+import mmap
 import logging
 import fnmatch
-import subprocess
+import hashlib
 import functools
 
-import rpm
 import yum
 
 from Pharlap import kerneldetection
-from Pharlap.YumCache import YumCache
+from Pharlap import hardware
+from Pharlap import resultcache
+from Pharlap import hwdata
+from Pharlap import kmod
+from Pharlap import indexstore
+from Pharlap.YumCache import YumCache, BINARY_MODALIAS_MAPS, MODALIAS_MAPS
+from Pharlap.modalias import ModaliasIndex, parse_modalias
+from Pharlap.cache import GenerationCache, LRUCache
 
 yb = yum.YumBase()
 system_architecture = yb.arch.basearch
 
-def system_modaliases():
+def system_modaliases(snapshot=None):
     '''Get modaliases present in the system.
 
     This ignores devices whose drivers are statically built into the kernel, as
     you cannot replace them with other driver packages anyway.
 
+    If you already have a hardware.HardwareSnapshot object, you can pass it
+    to avoid probing the hardware again.
+
     Return a modalias -> sysfs path map. The keys of the returned map are
-    suitable for a PackageKit WhatProvides(MODALIAS) call.
+    suitable for a PackageKit WhatProvides(MODALIAS) call. If several devices
+    have the same modalias, only one of them is reported; use
+    system_modalias_devices() to get all of them.
     '''
-    aliases = {}
-    # $SYSFS_PATH is compatible with libudev
-    sysfs_dir = os.environ.get('SYSFS_PATH', '/sys')
-    for path, dirs, files in os.walk(os.path.join(sysfs_dir, 'devices')):
-        modalias = None
-
-        # most devices have modalias files
-        if 'modalias' in files:
-            try:
-                with open(os.path.join(path, 'modalias')) as f:
-                    modalias = f.read().strip()
-            except IOError as e:
-                logging.warning('system_modaliases(): Cannot read %s/modalias: %s',
-                        path, e)
-                continue
+    if snapshot is None:
+        return dict((alias, paths[-1])
+                    for alias, paths in system_modalias_devices().items())
+    return snapshot.modaliases
 
-        # devices on SSB bus only mention the modalias in the uevent file (as
-        # of 2.6.24)
-        elif 'ssb' in path and 'uevent' in files:
-            info = {}
-            with open(os.path.join(path, 'uevent')) as f:
-                for l in f:
-                    if l.startswith('MODALIAS='):
-                        modalias = l.split('=', 1)[1].strip()
-                        break
-
-        if not modalias:
-            continue
+def system_modalias_devices(sysfs_dir=None):
+    '''Get modaliases present in the system, with all devices that have them.
+
+    This ignores devices whose drivers are statically built into the kernel,
+    like system_modaliases(). sysfs_dir defaults to $SYSFS_PATH or /sys.
+
+    $PHARLAP_DEVICE_BACKEND can select the udev database instead of sysfs,
+    see hardware.default_modalias_devices().
+
+    Return a modalias -> [sysfs path, ...] map; the paths are sorted.
+    '''
+    return hardware.default_modalias_devices(sysfs_dir)
+
+# packages of the X.org server, which provide its video driver ABI
+XORG_SERVER_PACKAGES = ('xorg-x11-server-Xorg',)
+
+_video_abi_prefix = 'xserver-abi(videodrv-'
+
+def _video_abis(names):
+    '''Return the set of video driver ABIs in a list of provides/requires.'''
+
+    return set(n for n in names or () if n.startswith(_video_abi_prefix))
+
+def _yum_cache_video_abi(yum_cache):
+    '''Determine the X.org video driver ABI of an YumCache object.
 
-        # ignore drivers which are statically built into the kernel
-        driverlink =  os.path.join(path, 'driver')
-        modlink = os.path.join(driverlink, 'module')
-        if os.path.islink(driverlink) and not os.path.islink(modlink):
-            #logging.debug('system_modaliases(): ignoring device %s which has no module (built into kernel)', path)
+    This is the ABI provided by the candidate version of the X.org server
+    (which installing a driver can pull in), or by the installed one if there
+    is no candidate.
+
+    Return a frozenset of xserver-abi(videodrv-N) names, or None if there is no
+    X.org server package and video driver ABIs cannot be checked.
+    '''
+    for name in XORG_SERVER_PACKAGES:
+        try:
+            pkg = yum_cache[name]
+        except KeyError:
             continue
+        version = pkg.candidate or pkg.installed
+        abis = frozenset(_video_abis(getattr(version, 'provides_names', None)))
+        logging.debug('Current X.org video driver ABI: %s', ' '.join(sorted(abis)))
+        return abis
 
-        aliases[modalias] = path
+    logging.debug('X.org server not available, cannot check video driver ABI')
+    return None
 
-    return aliases
+def _video_abi(yum_cache):
+    '''Return the cached _yum_cache_video_abi() result for an YumCache object.'''
 
-def _check_video_abi_compat(yum_cache, record):
-    xorg_video_abi = None
+    return _video_abi.cache_abis.get(yum_cache)
 
-    # determine current X.org video driver ABI
-    try:
-        for p in yum_cache['xserver-xorg-core'].candidate.provides:
-            if p.startswith('xorg-video-abi-'):
-                xorg_video_abi = p
-                #logging.debug('_check_video_abi_compat(): Current X.org video abi: %s', xorg_video_abi)
-                break
-    except (AttributeError, KeyError):
-        logging.debug('_check_video_abi_compat(): xserver-xorg-core not available, cannot check ABI')
+_video_abi.cache_abis = GenerationCache(_yum_cache_video_abi)
+
+def _check_video_abi_compat(yum_cache, package):
+    '''Check if a YumCachePackage works with the current X.org video ABI.
+
+    Packages which do not require a video driver ABI are always compatible.
+    '''
+    abi = _video_abi(yum_cache)
+    if abi is None:
         return True
-    if not xorg_video_abi:
+
+    required = _video_abis(getattr(package.candidate, 'requires_names', None))
+    if required and required.isdisjoint(abi):
+        logging.debug('Driver package %s is incompatible with current X.org server ABI %s',
+                package.name, ' '.join(sorted(abi)))
         return False
 
+    return True
+
+# how much of the X.org log gets searched for the loaded video driver
+XORG_LOG_SEARCH_LIMIT = 1024 * 1024
+
+def _xorg_log_contains(xorg_log, needle):
+    '''Check if the first XORG_LOG_SEARCH_LIMIT bytes of the X.org log contain needle.
+
+    Return None if the log cannot be read.
+    '''
+    try:
+        with open(xorg_log, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        return log.find(needle, 0, XORG_LOG_SEARCH_LIMIT) >= 0
+    finally:
+        log.close()
+
+def _is_hybrid_graphics(snapshot=None):
+    '''Check if this is a hybrid Intel/NVidia graphics system.
+
+    This is the case if there are Intel and NVidia display controllers, and
+    the NVidia one is not the boot VGA device (which hybrid-detect also looks
+    at). If sysfs does not show any display controllers, e. g. in a container,
+    fall back to checking whether the X.org log reports the intel driver.
+
+    The result is determined once per sysfs tree, set of display controllers
+    and X.org log, so that hotplugged ones (e. g. an external GPU) are noticed.
+    Without a snapshot, the PCI device names stand in for the display
+    controllers, and the hardware is only probed if that is not known yet.
+    '''
+    xorg_log = os.environ.get('UBUNTU_DRIVERS_XORG_LOG', '/var/log/Xorg.0.log')
     try:
-        deps = record['Depends']
+        st = os.stat(xorg_log)
+        log_state = (st.st_size, st.st_mtime)
+    except OSError:
+        log_state = None
+    if snapshot is None:
+        sysfs_dir = os.environ.get('SYSFS_PATH', '/sys')
+        try:
+            devices = tuple(sorted(os.listdir(os.path.join(sysfs_dir, 'bus', 'pci', 'devices'))))
+        except OSError:
+            devices = ()
+    else:
+        sysfs_dir = snapshot.sysfs_dir
+        devices = tuple(snapshot.display_devices)
+    key = (snapshot is None, sysfs_dir, devices, xorg_log, log_state)
+    try:
+        return _is_hybrid_graphics.results[key]
     except KeyError:
-        return True
-    if 'xorg-video-abi-' in deps and xorg_video_abi not in deps:
-        logging.debug('Driver package %s is incompatible with current X.org server ABI %s',
-                record['Package'], xorg_video_abi)
-        return False
+        pass
+
+    if snapshot is None:
+        snapshot = hardware.HardwareSnapshot()
+    vendors = set(vendor for (path, vendor, device) in snapshot.display_devices)
+    if vendors:
+        boot_vga = snapshot.boot_vga
+        result = ('8086' in vendors and '10de' in vendors and
+                  (boot_vga is None or snapshot.pci_ids(boot_vga)[0] != '10de'))
+        logging.debug('Display controller vendors: %s, boot VGA %s, hybrid: %s',
+                      ' '.join(sorted(vendors)), boot_vga, result)
+    else:
+        result = _xorg_log_contains(xorg_log, b'drivers/intel_drv.so')
+        if result is None:
+            logging.debug('Cannot open X.org log %s, cannot determine hybrid state', xorg_log)
+            result = False
+        elif result:
+            logging.debug('X.org log reports loaded intel driver, hybrid system')
+
+    _is_hybrid_graphics.results[key] = result
+    return result
+
+_is_hybrid_graphics.results = LRUCache(16)
+
+def _check_hybrid_compat(package, snapshot=None):
+    '''Check if a driver package works on this system's graphics setup.'''
 
     # Current X.org/nvidia proprietary drivers do not work on hybrid
     # Intel/NVidia systems; disable the driver for now
-    if 'nvidia' in record['Package']:
-        xorg_log = os.environ.get('UBUNTU_DRIVERS_XORG_LOG', '/var/log/Xorg.0.log')
-        try:
-            with open(xorg_log, 'rb') as f:
-                if b'drivers/intel_drv.so' in f.read():
-                    logging.debug('X.org log reports loaded intel driver, disabling driver %s for hybrid system',
-                            record['Package'])
-                    return False
-        except IOError:
-            logging.debug('Cannot open X.org log %s, cannot determine hybrid state', xorg_log)
+    if 'nvidia' in package.name and _is_hybrid_graphics(snapshot):
+        logging.debug('Disabling driver %s for hybrid system', package.name)
+        return False
 
     return True
 
-def _yum_cache_modalias_map(yum_cache):
-    '''Build a modalias map from an YumCache object.
+def _matches_package_filter(name, package_filter):
+    '''Check if a package name matches any of the globs in package_filter.'''
 
-    This filters out uninstallable video drivers (i. e. which depend on a video
-    ABI that xserver-xorg-core does not provide).
+    for pattern in package_filter:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
 
-    Return a map bus -> modalias -> [package, ...], where "bus" is the prefix of
-    the modalias up to the first ':' (e. g. "pci" or "usb").
+def _yum_cache_modalias_packages(yum_cache, package_filter=None):
+    '''Get the driver packages of an YumCache object.
+
+    Return a list of all native packages which have a modalias record,
+    except for video drivers which need another X.org video ABI than the
+    available one. If package_filter is given, only packages whose name
+    matches one of its globs are considered.
     '''
-    result = {}
+    result = []
 
     for package in yum_cache.package_list():
+        if (package_filter is not None and
+            not _matches_package_filter(package.name, package_filter)):
+            continue
+
         # skip foreign architectures, we usually only want native
         # driver packages
 
@@ -132,15 +239,39 @@ def _yum_cache_modalias_map(yum_cache):
             continue
 
         # skip packages without a modalias field
+        if not package.has_record('modaliases'):
+            continue
+
+        # skip incompatible video drivers
+        if not _check_video_abi_compat(yum_cache, package):
+            continue
+
+        result.append(package)
+
+    return result
+
+def _yum_cache_modalias_map(yum_cache, packages=None):
+    '''Build a modalias map from an YumCache object.
+
+    This filters out uninstallable video drivers (i. e. which depend on a video
+    ABI that the X.org server does not provide), see
+    _yum_cache_modalias_packages(). If you already called that, pass its
+    result as packages to avoid walking the cache again.
+
+    Return a map bus -> modalias -> [package, ...], where "bus" is the prefix of
+    the modalias up to the first ':' (e. g. "pci" or "usb").
+    '''
+    result = {}
+
+    if packages is None:
+        packages = _yum_cache_modalias_packages(yum_cache)
+
+    for package in packages:
         try:
             m = package.record('modaliases')
         except (KeyError, AttributeError, UnicodeDecodeError):
             continue
 
-        # skip incompatible video drivers
-#        if not _check_video_abi_compat(yum_cache, package.candidate.record):
-#            continue
-
         try:
             for l in m:
                 alias = l['alias']
@@ -152,58 +283,305 @@ def _yum_cache_modalias_map(yum_cache):
 
     return result
 
-def packages_for_modalias(yum_cache, modalias):
-    '''Search packages which match the given modalias.
+def _binary_map_loader(binary_map, packages):
+    '''Get a ModaliasIndex loader for a BinaryModaliasMap.
 
-    Return a list of YumCachePackage objects.
+    The loader returns the modalias -> [package, ...] map of a bus,
+    restricted to the given packages.
     '''
-    pkgs = set()
+    names = set(p.name for p in packages)
 
-    yum_cache_hash = hash(yum_cache)
-    try:
-        cache_map = packages_for_modalias.cache_maps[yum_cache_hash]
-    except KeyError:
-        cache_map = _yum_cache_modalias_map(yum_cache)
-        packages_for_modalias.cache_maps[yum_cache_hash] = cache_map
+    def load(bus):
+        result = {}
+        for alias, pkgs in binary_map.bus_map(bus).items():
+            pkgs = pkgs & names
+            if pkgs:
+                result[alias] = pkgs
+        return result
 
-    bus_map = cache_map.get(modalias.split(':', 1)[0], {})
-    for alias in bus_map:
-        try:
-            if fnmatch.fnmatch(modalias, alias):
-                for p in bus_map[alias]:
-                    pkgs.add(p)
-        except:
-            print modalias
+    return load
 
-    return [yum_cache[p] for p in pkgs]
+def _modalias_index_path(yum_cache):
+    '''Get the location of the on-disk modalias index.
 
-packages_for_modalias.cache_maps = {}
+    The index is stored in the index cache directory (see
+    indexstore.cache_dir()). $PHARLAP_MODALIAS_INDEX overrides this, except
+    for root.
 
-def _is_package_free(pkg):
-    assert pkg.candidate is not None
+    Return None if the modalias map has no path.
+    '''
+    path = os.environ.get('PHARLAP_MODALIAS_INDEX')
+    if path and os.geteuid() != 0:
+        return path
+
+    map_path = getattr(yum_cache, 'modalias_map_path', None)
+    if not map_path:
+        return None
+    return os.path.join(indexstore.cache_dir(), os.path.basename(map_path) + '.idx')
+
+# bump when the structure of the stored modalias index changes
+_modalias_index_format = 2
+
+# files which the available and installed packages depend on
+_package_state_paths = ['/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite',
+                        '/etc/yum.repos.d/*.repo',
+                        '/var/cache/yum/*/*/*/repomd.xml']
 
-    free_licenses = set(('GPL', 'GPL v2', 'GPL and additional rights', 'Dual BSD/GPL', 'Dual MIT/GPL', 'Dual MPL/GPL', 'BSD', 'GPLv2', 'GPLv2+', 'GPLv3', 'GPLv3+'))
+def _modalias_index_key(yum_cache):
+    '''Get the key of the on-disk modalias index.
 
+    This covers the checksum of the modalias map, the architecture, and the
+    state of the rpm database and the repositories, which decide which driver
+    packages are available and which X.org video ABI is installed. It is
+    cheap to compute, without walking the packages.
+    '''
+    key = hashlib.sha1()
+    for s in ([yum_cache.modalias_map_checksum, system_architecture] +
+              resultcache.file_states(_package_state_paths)):
+        key.update(('%r\n' % (s,)).encode('UTF-8'))
+    return key.hexdigest()
+
+def _yum_cache_modalias_index(yum_cache, package_filter=None):
+    '''Build the modalias lookup structures for an YumCache object.
+
+    The buckets of the ModaliasIndex are loaded from disk if a matching index
+    was saved by an earlier run, which avoids walking the packages; they are
+    saved otherwise. If package_filter is given, the index only covers the
+    patterns of the packages which match one of its globs; such indexes are
+    small and do not get stored.
+
+    Return a (ModaliasIndex, LRUCache) pair; the latter caches modalias ->
+    frozenset of package names, including empty results. Its size is taken
+    from $PHARLAP_MODALIAS_CACHE_SIZE (0 disables it).
+    '''
     try:
-      license = set([ p.strip() for p in pkg.installed.returnLocalHeader()[rpm.RPMTAG_LICENSE].split('and') ])
-      return len(license.intersection(free_licenses)) > 0
-    except:
-      pass
+        size = int(os.environ.get('PHARLAP_MODALIAS_CACHE_SIZE', 1024))
+    except ValueError:
+        logging.warning('Invalid $PHARLAP_MODALIAS_CACHE_SIZE, using default')
+        size = 1024
+
+    binary_map = getattr(yum_cache, 'modalias_map', None)
+    path = None
+    if (binary_map is None and package_filter is None and
+        getattr(yum_cache, 'modalias_map_checksum', None)):
+        path = _modalias_index_path(yum_cache)
+    if path:
+        key = _modalias_index_key(yum_cache)
+        data = indexstore.load(path, key, _modalias_index_format)
+        if data is not None:
+            try:
+                index = ModaliasIndex.from_data(data)
+                logging.debug('Loaded modalias index %s', path)
+                return (index, LRUCache(size))
+            except ValueError as e:
+                logging.debug('Ignoring modalias index %s: %s', path, e)
 
-    return False
+    packages = _yum_cache_modalias_packages(yum_cache, package_filter)
+
+    # sections of a binary modalias map are only decoded for the buses which
+    # get queried; that is cheap enough to not need an on-disk index
+    if binary_map is not None:
+        return (ModaliasIndex(loader=_binary_map_loader(binary_map, packages)),
+                LRUCache(size))
+
+    index = ModaliasIndex(_yum_cache_modalias_map(yum_cache, packages))
+    if path and indexstore.save(index.data(), path, key, _modalias_index_format):
+        logging.debug('Saved modalias index %s', path)
+
+    return (index, LRUCache(size))
+
+def prepare_modalias_index(yum_cache):
+    '''Build the modalias index of an YumCache object now.
+
+    packages_for_modalias() builds it on the first lookup otherwise; call this
+    e. g. before forking worker processes, so that they share it.
+    '''
+    packages_for_modalias.cache_maps.get(yum_cache)
+
+def packages_for_modalias(yum_cache, modalias, package_filter=None):
+    '''Search packages which match the given modalias.
+
+    package_filter is an optional list of globs; then only packages whose name
+    matches one of them are looked at.
+
+    Return a list of YumCachePackage objects.
+    '''
+    if package_filter is None:
+        cache_maps = packages_for_modalias.cache_maps
+    else:
+        package_filter = tuple(sorted(package_filter))
+        try:
+            cache_maps = packages_for_modalias.filtered_maps[package_filter]
+        except KeyError:
+            cache_maps = GenerationCache(functools.partial(
+                _yum_cache_modalias_index, package_filter=package_filter))
+            packages_for_modalias.filtered_maps[package_filter] = cache_maps
+
+    (index, results) = cache_maps.get(yum_cache)
+    names = None
+    if package_filter is None:
+        names = packages_for_modalias.batches.get(yum_cache).get(modalias)
+    if names is None:
+        try:
+            names = results[modalias]
+        except KeyError:
+            names = frozenset(index.match(modalias))
+            results[modalias] = names
+
+    return [yum_cache[p] for p in names]
+
+packages_for_modalias.cache_maps = GenerationCache(_yum_cache_modalias_index)
+# package filter -> GenerationCache
+packages_for_modalias.filtered_maps = {}
+# results of the last prefetch_modaliases() call, modalias -> frozenset
+packages_for_modalias.batches = GenerationCache(lambda yum_cache: {})
+
+# minimum number of modaliases for which prefetch_modaliases() uses NumPy
+VECTOR_MATCH_MIN = 512
+
+def prefetch_modaliases(yum_cache, modaliases):
+    '''Look up many modaliases at once for packages_for_modalias().
+
+    This is for large batches, like the devices of many machines. The
+    modaliases which are not cached yet are matched in one go, with a
+    modaliasvector.VectorModaliasMatcher over the patterns of the modalias
+    index if NumPy is available and there are at least VECTOR_MATCH_MIN of
+    them, otherwise with the modalias index itself. The results for all of
+    modaliases are kept in a batch next to the bounded result cache, until
+    the next call.
+
+    Return the number of modaliases which were looked up.
+    '''
+    (index, results) = packages_for_modalias.cache_maps.get(yum_cache)
+    old_batch = packages_for_modalias.batches.get(yum_cache)
+    batch = {}
+    pending = set()
+    for alias in modaliases:
+        if alias in old_batch:
+            batch[alias] = old_batch[alias]
+        elif alias in results:
+            batch[alias] = results[alias]
+        else:
+            pending.add(alias)
+    pending = sorted(pending)
+
+    matches = None
+    if len(pending) >= VECTOR_MATCH_MIN:
+        # NumPy takes a while to import, so only load it for large batches
+        from Pharlap import modaliasvector
+        if modaliasvector.numpy is not None:
+            buses = set(alias.split(':', 1)[0] for alias in pending)
+            matcher = modaliasvector.VectorModaliasMatcher(index.modalias_map(buses), index)
+            matches = matcher.match(pending)
+            logging.debug('prefetch_modaliases(): matched %i modaliases with NumPy', len(pending))
+    if matches is None:
+        matches = [index.match(alias) for alias in pending]
+
+    for (alias, names) in zip(pending, matches):
+        batch[alias] = frozenset(names)
+    old_batch.clear()
+    old_batch.update(batch)
+    return len(pending)
+
+def invalidate_caches(yum_cache=None):
+    '''Drop data cached for the given YumCache object, or for all of them.
+
+    Caches are dropped automatically when their YumCache gets garbage
+    collected; call this to release them earlier, e. g. after a transaction.
+    '''
+    packages_for_modalias.cache_maps.invalidate(yum_cache)
+    for cache_maps in packages_for_modalias.filtered_maps.values():
+        cache_maps.invalidate(yum_cache)
+    packages_for_modalias.batches.invalidate(yum_cache)
+    _package_class.tables.invalidate(yum_cache)
+    _video_abi.cache_abis.invalidate(yum_cache)
+    # module indexes do not depend on the packages, but also go stale
+    kmod.index.indexes.clear()
+
+_string_types = (str, type(u''))
+
+def packages_for_modaliases(yum_cache, aliases, package_filter=None):
+    '''Search packages which match each of the given modaliases.
+
+    aliases is either a list of modaliases, or a map modalias -> sysfs paths,
+    where the value is a list of paths (as returned by
+    system_modalias_devices()) or a single path string. Every distinct
+    modalias is only looked up once, no matter how many devices have it.
+    package_filter works like for packages_for_modalias().
+
+    Return a map modalias -> {'syspaths': [path, ...], 'packages': [...]},
+    where 'packages' is a list of YumCachePackage objects and 'syspaths' is
+    empty if aliases is a plain list.
+    '''
+    result = {}
+    for alias in aliases:
+        if alias in result:
+            continue
+        try:
+            syspaths = aliases[alias]
+        except TypeError:
+            syspaths = []
+        if isinstance(syspaths, _string_types):
+            syspaths = [syspaths]
+        else:
+            syspaths = list(syspaths)
+        result[alias] = {
+                'syspaths': syspaths,
+                'packages': packages_for_modalias(yum_cache, alias, package_filter),
+            }
+
+    return result
+
+# licenses of free driver packages
+_free_licenses = frozenset(('GPL', 'GPL v2', 'GPL and additional rights',
+    'Dual BSD/GPL', 'Dual MIT/GPL', 'Dual MPL/GPL', 'BSD', 'GPLv2', 'GPLv2+',
+    'GPLv3', 'GPLv3+'))
+
+# prefixes of the (lower case) ids of distro repositories
+_distro_repos = ('fedora', 'updates', 'updates-testing', 'korora')
+
+def _is_package_free(pkg):
+    '''Check if the installed or candidate version has a free license.'''
+
+    version = pkg.installed or pkg.candidate
+    license = getattr(version, 'license', None)
+    if not license:
+        return False
 
+    licenses = set(p.strip() for p in re.split(r'\band\b|\bor\b|[()]', license))
+    licenses.add(license.strip())
+    return not licenses.isdisjoint(_free_licenses)
 
 def _is_package_from_distro(pkg):
     if pkg.candidate is None:
         return False
 
-    if pkg.candidate.repoid.lower().startswith('fedora') or \
-       pkg.candidate.repoid.lower().startswith('updates') or \
-       pkg.candidate.repoid.lower().startswith('updates-testing') or \
-       pkg.candidate.repoid.lower().startswith('korora'):
-            return True
+    return pkg.candidate.repoid.lower().startswith(_distro_repos)
 
-    return False
+def _yum_cache_package_classes(yum_cache):
+    '''Classify the driver packages of an YumCache object.
+
+    Return a map package name -> (free, from_distro) for all packages with a
+    modalias record.
+    '''
+    return dict((p.name, (_is_package_free(p), _is_package_from_distro(p)))
+                for p in _yum_cache_modalias_packages(yum_cache))
+
+def _package_class(yum_cache, pkg):
+    '''Return the (free, from_distro) flags of a YumCachePackage.
+
+    These are looked up in a table which is built once per YumCache; packages
+    without modaliases, such as the ones from detect plugins, are added to it
+    on demand.
+    '''
+    table = _package_class.tables.get(yum_cache)
+    try:
+        return table[pkg.name]
+    except KeyError:
+        table[pkg.name] = (_is_package_free(pkg), _is_package_from_distro(pkg))
+        return table[pkg.name]
+
+_package_class.tables = GenerationCache(_yum_cache_package_classes)
 
 def _pkg_get_module(pkg):
     '''Determine module name from apt Package object'''
@@ -243,10 +621,7 @@ def _is_manual_install(pkg):
     if not module:
         return False
 
-    modinfo = subprocess.Popen(['modinfo', module], stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    modinfo.communicate()
-    if modinfo.returncode == 0:
+    if kmod.index().available(module):
         logging.debug('_is_manual_install %s: builds module %s which is available, manual install',
                       pkg.name, module)
         return True
@@ -255,73 +630,205 @@ def _is_manual_install(pkg):
                   pkg.name, module)
     return False
 
-def _get_db_name(syspath, alias):
+def _get_db_name(syspath, alias, snapshot=None):
     '''Return (vendor, model) names for given device.
 
-    Values are None if unknown.
-    '''
+    The device IDs are read through snapshot (a hardware.HardwareSnapshot),
+    if given, or taken from the modalias. Values are None if unknown.
 
-    db = '/usr/share/hwdata/%s.ids' % alias.split(':')[0]
-    if not os.path.exists(db):
-        print 'DB doesn\'t exist'
+    Without a snapshot, sysfs is never looked at, as syspath may belong to
+    another machine (e. g. from a fleet inventory).
+    '''
+    bus = alias.split(':')[0]
+    db = hwdata.database(bus)
+    if db is None:
+        logging.debug('_get_db_name(%s, %s): no ID database for %s', syspath, alias, bus)
         return (None, None)
 
-    vendor = None
-    device = None
-    subsystem_vendor = None
-    subsystem_device = None
-
     vendor_name = "Unknown"
     model_name = "Unknown"
 
-    try:
-        vendor = open('%s/vendor' % syspath).read()[2:6]
-        device = open('%s/device' % syspath).read()[2:6]
-        subsystem_vendor = open('%s/subsystem_vendor' % syspath).read()[2:6]
-        subsystem_device = open('%s/subsystem_device' % syspath).read()[2:6]
-    except:
-        pass
+    if snapshot is None:
+        (vendor, device) = (None, None)
+    elif bus == 'usb':
+        (vendor, device) = snapshot.usb_ids(syspath)
+    else:
+        (vendor, device) = snapshot.pci_ids(syspath)[:2]
 
+    if vendor is None or device is None:
+        fields = parse_modalias(alias)
+        if fields is None:
+            return (vendor_name, model_name)
+        vendor = '%04x' % (fields['vendor'] & 0xffff)
+        device = '%04x' % (fields['device'] & 0xffff)
 
-    f = open(db, 'rb')
-    _f = f.readlines()
-    f.close()
+    vendor_name = db.vendor_name(vendor) or vendor_name
+    if vendor_name != "Unknown":
+        model_name = db.device_name(vendor, device) or model_name
 
-    found_vendor = False
+    logging.debug('_get_db_name(%s, %s): vendor "%s", model "%s"', syspath,
+                  alias, vendor_name, model_name)
+    return (vendor_name, model_name)
 
-#    print "V: %s, D: %s, SV: %s, SD: %s" % (vendor, device, subsystem_vendor, subsystem_device)
+# files which the detection results depend on, besides the hardware
+_result_cache_paths = _package_state_paths + \
+                      [os.path.join(hwdata.HWDATA_DIR, '*.ids')] + \
+                      BINARY_MODALIAS_MAPS + MODALIAS_MAPS
 
-    for l in _f:
+# environment variables which the detection results depend on
+_result_cache_environ = ['SYSFS_PATH', 'PHARLAP_DEVICE_BACKEND', 'PHARLAP_UDEV_DB',
+                         'KORORA_DRIVERS_DETECT_DIR', 'UBUNTU_DRIVERS_XORG_LOG']
 
-        # skip comments and blank lines
-        if l.startswith('#') or len(l) == 0:
-            continue
+def _cached_result(kind, snapshot, build):
+    '''Return a detection result from the result cache.
 
-        # check for vendor
-        if l.startswith( vendor ):
-            found_vendor = True
-            vendor_name = l[4:].strip()
-            continue
+    If the cache has no result of this kind for the current state of the
+    system, call build() and store its result.
+    '''
+    plugindir = os.environ.get('KORORA_DRIVERS_DETECT_DIR',
+            '/usr/share/korora-drivers-common/detect/')
+    xorg_log = os.environ.get('UBUNTU_DRIVERS_XORG_LOG', '/var/log/Xorg.0.log')
+    kernel = os.uname()[2]
+    # the manual_install flags depend on the modules of the running kernel
+    modules = os.path.join(kmod.MODULES_DIR, kernel)
+    modules_paths = [os.path.join(modules, 'modules.dep'),
+                     os.path.join(modules, 'modules.builtin')] + \
+                    [os.path.join(modules, d, '*') for d in kmod.EXTRA_DIRS]
+    key = resultcache.fingerprint(snapshot,
+            _result_cache_paths + [os.path.join(plugindir, '*'), xorg_log] + modules_paths,
+            _result_cache_environ,
+            (kind, system_architecture, kernel))
+
+    result = resultcache.load(kind, key)
+    if result is None:
+        result = build()
+        resultcache.store(kind, key, result)
+    else:
+        logging.debug('Using cached %s result', kind)
+    return result
 
-        # strip first tab
-        if found_vendor:
-            if l[0] == "\t":
-                # strip first tab
-                l = l[1:]
+def _detect_drivers(yum_cache, modaliases, plugins, snapshot, fields,
+                    devices=False, package_filter=None):
+    '''Determine the driver packages of the system in a single pass.
 
-                if l.startswith( device ):
-                    model_name = l[4:].strip()
-                    break
+    This is the common implementation of system_driver_packages() and
+    system_device_drivers(). Every modalias is looked up once, and the package
+    flags (free, from_distro, manual install) are determined once per
+    package. The device structure is only built if devices is True.
+    package_filter restricts the packages like for system_driver_packages().
+
+    Return (packages, devices) in the formats of system_driver_packages() and
+    system_device_drivers(); devices is None if not requested.
+    '''
+    if fields is None:
+        fields = ('free', 'from_distro', 'vendor', 'model')
+
+    # package name -> flags
+    flags = {}
+    def package_flags(name, pkg):
+        try:
+            return flags[name]
+        except KeyError:
+            f = flags[name] = {}
+            if 'free' in fields or 'from_distro' in fields:
+                (free, from_distro) = _package_class(yum_cache, pkg)
+                if 'free' in fields:
+                    f['free'] = free
+                if 'from_distro' in fields:
+                    f['from_distro'] = from_distro
+            return f
+
+    # package name -> YumCachePackage
+    yum_packages = {}
+    packages = {}
+    # ([device name, ...], device info) for every modalias and plugin
+    device_groups = []
 
-            # we're out of options for this vendor
-            else:
+    for alias, info in packages_for_modaliases(yum_cache, modaliases,
+                                               package_filter).items():
+        if not info['packages']:
+            continue
+        syspath = info['syspaths'][-1]
+        device = {'modalias': alias}
+        if 'vendor' in fields or 'model' in fields:
+            (vendor, model) = _get_db_name(syspath, alias, snapshot)
+            if vendor is not None and 'vendor' in fields:
+                device['vendor'] = vendor
+            if model is not None and 'model' in fields:
+                device['model'] = model
+
+        drivers = {}
+        for p in info['packages']:
+            yum_packages[p.name] = p
+            f = package_flags(p.name, p)
+            packages[p.name] = dict(device, syspath=syspath,
+                                    syspaths=list(info['syspaths']), **f)
+            drivers[p.name] = dict(f)
+        device['drivers'] = drivers
+        device_groups.append((info['syspaths'], device))
+
+    # Add "recommended" flags for NVidia and fglrx alternatives
+    for suffix in ('kmod-nvidia', 'kmod-catalyst'):
+        alternatives = [p for p in packages if p.endswith(suffix)]
+        if alternatives:
+            alternatives.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives))
+            recommended = alternatives[-1]
+            for p in alternatives:
+                packages[p]['recommended'] = (p == recommended)
+
+    # add available packages which need custom detection code
+    if plugins:
+        for plugin, pkgs in detect_plugin_packages(yum_cache, package_filter,
+                                                   snapshot).items():
+            drivers = {}
+            for p in pkgs:
+                yum_packages[p] = yum_cache[p]
+                f = package_flags(p, yum_packages[p])
+                packages[p] = dict(f, plugin=plugin)
+                drivers[p] = dict(f)
+            if drivers:
+                device_groups.append(([plugin], {'drivers': drivers}))
+
+    if not devices:
+        return (packages, None)
+
+    result = {}
+    manual = {}
+    for (names, device) in device_groups:
+        # the manual_install device flag is true iff all driver packages are
+        # "manually installed"
+        for pkg in device['drivers']:
+            if pkg not in manual:
+                manual[pkg] = _is_manual_install(yum_packages[pkg])
+            if not manual[pkg]:
                 break
+        else:
+            device['manual_install'] = True
 
-    logging.debug('_get_db_name(%s, %s): vendor "%s", model "%s"', syspath,
-                  alias, vendor_name, model_name)
-    return (vendor_name, model_name)
+        # add OS builtin free alternatives to proprietary drivers
+        _add_builtins(device['drivers'])
+
+        # every device gets its own copy, so that callers can modify them
+        for name in names:
+            result[name] = dict(device, drivers=dict(
+                (k, dict(v)) for (k, v) in device['drivers'].items()))
+
+    return (packages, result)
+
+def _result_kind(kind, plugins, fields, package_filter=None):
+    '''Return the result cache kind for a detection call.'''
 
-def system_driver_packages(yum_cache=None):
+    if not plugins:
+        kind += '-noplugins'
+    if fields is not None:
+        kind += '-' + ('-'.join(sorted(fields)) or 'names')
+    if package_filter is not None:
+        kind += '-' + hashlib.sha1('\0'.join(sorted(package_filter)).encode('UTF-8')).hexdigest()[:12]
+    return kind
+
+def system_driver_packages(yum_cache=None, modaliases=None, plugins=True,
+                           snapshot=None, use_cache=False, fields=None,
+                           package_filter=None):
     '''Get driver packages that are available for the system.
 
     This calls system_modaliases() to determine the system's hardware and then
@@ -332,6 +839,31 @@ def system_driver_packages(yum_cache=None):
     argument for efficiency. If not given, this function creates a temporary
     one by itself.
 
+    If you already have a hardware.HardwareSnapshot object, you should pass it
+    as snapshot, so that the hardware does not get probed again.
+
+    To evaluate other hardware than the running system's, pass a modalias ->
+    [sysfs path, ...] map as modaliases (or a snapshot of it), and
+    plugins=False, as detect plugins always probe the running system. If
+    modaliases is given without a snapshot, vendor and model names are
+    determined from the IDs in the modaliases, not from sysfs.
+
+    With use_cache=True, the result for the running system is taken from the
+    result cache (see the resultcache module) if the hardware, the installed
+    and available packages and the modalias map did not change since it was
+    stored; then no YumCache gets created.
+
+    fields can restrict the information keys which get determined to the ones
+    which the caller needs: 'free', 'from_distro', 'vendor' and 'model' need
+    package headers and ID database lookups, and are only present if they are
+    in fields. The other keys are always present. By default all keys are
+    determined; pass an empty list if you only need the package names.
+
+    package_filter is an optional list of package name globs, such as
+    AUTO_INSTALL_WHITELIST. Then only these packages are looked for: the
+    modalias index only gets built from their patterns, and detect plugins
+    which cannot return any of them are not run.
+
     Return a dictionary which maps package names to information about them:
 
       driver_package -> {'modalias': 'pci:...', ...}
@@ -341,6 +873,8 @@ def system_driver_packages(yum_cache=None):
                      drivers from detect plugins)
       'syspath':     sysfs directory for the device that needs this driver
                      (not for drivers from detect plugins)
+      'syspaths':    List of sysfs directories of all devices which have this
+                     modalias (not for drivers from detect plugins)
       'plugin':      Name of plugin that detected this package (only for
                      drivers from detect plugins)
       'free':        Boolean flag whether driver is free, i. e. in the "main"
@@ -354,55 +888,24 @@ def system_driver_packages(yum_cache=None):
                      versions; these have this flag, where exactly one has
                      recommended == True, and all others False.
     '''
-    modaliases = system_modaliases()
+    if snapshot is None and modaliases is None:
+        snapshot = hardware.HardwareSnapshot()
+    if use_cache and modaliases is None:
+        return _cached_result(_result_kind('packages', plugins, fields, package_filter),
+                snapshot, lambda: system_driver_packages(yum_cache, None, plugins, snapshot,
+                                                         fields=fields,
+                                                         package_filter=package_filter))
+    if modaliases is None:
+        modaliases = snapshot.modalias_devices
 
     if not yum_cache:
         yum_cache = YumCache(yb)
 
-    packages = {}
-    for alias, syspath in modaliases.items():
-        for p in packages_for_modalias(yum_cache, alias):
-            packages[p.name] = {
-                    'modalias': alias,
-                    'syspath': syspath,
-                    'free': _is_package_free(p),
-                    'from_distro': _is_package_from_distro(p),
-                }
-            (vendor, model) = _get_db_name(syspath, alias)
-            if vendor is not None:
-                packages[p.name]['vendor'] = vendor
-            if model is not None:
-                packages[p.name]['model'] = model
-
-    # Add "recommended" flags for NVidia alternatives
-    nvidia_packages = [p for p in packages if p.endswith('kmod-nvidia')]
-    if nvidia_packages:
-        nvidia_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives))
-        recommended = nvidia_packages[-1]
-        for p in nvidia_packages:
-            packages[p]['recommended'] = (p == recommended)
-
-    # Add "recommended" flags for fglrx alternatives
-    fglrx_packages = [p for p in packages if p.endswith('kmod-catalyst')]
-    if fglrx_packages:
-        fglrx_packages.sort(key=functools.cmp_to_key(_cmp_gfx_alternatives))
-        recommended = fglrx_packages[-1]
-        for p in fglrx_packages:
-            packages[p]['recommended'] = (p == recommended)
-
-    # add available packages which need custom detection code
-    for plugin, pkgs in detect_plugin_packages(yum_cache).items():
-        for p in pkgs:
-            yum_p = yum_cache[p]
-            packages[p] = {
-                    'free': _is_package_free(yum_p),
-                    'from_distro': _is_package_from_distro(yum_p),
-                    'plugin': plugin,
-                }
+    return _detect_drivers(yum_cache, modaliases, plugins, snapshot, fields,
+                           package_filter=package_filter)[0]
 
-    return packages
-
-def system_device_drivers(yum_cache=None):
+def system_device_drivers(yum_cache=None, snapshot=None, modaliases=None,
+                          plugins=True, use_cache=False):
     '''Get by-device driver packages that are available for the system.
 
     This calls system_modaliases() to determine the system's hardware and then
@@ -412,7 +915,9 @@ def system_device_drivers(yum_cache=None):
 
     If you already have a YumCache() object, you should pass it as an
     argument for efficiency. If not given, this function creates a temporary
-    one by itself.
+    one by itself. The same applies to a hardware.HardwareSnapshot object.
+
+    modaliases, plugins and use_cache work like for system_driver_packages().
 
     Return a dictionary which maps devices to available drivers:
 
@@ -452,38 +957,24 @@ def system_device_drivers(yum_cache=None):
                      versions; these have this flag, where exactly one has
                      recommended == True, and all others False.
     '''
-    result = {}
+    if use_cache and modaliases is None:
+        if snapshot is None:
+            snapshot = hardware.HardwareSnapshot()
+        return _cached_result(_result_kind('devices', plugins, None), snapshot,
+                lambda: system_device_drivers(yum_cache, snapshot, None, plugins))
+
+    if snapshot is None and modaliases is None:
+        snapshot = hardware.HardwareSnapshot()
+    if modaliases is None:
+        modaliases = snapshot.modalias_devices
+
     if not yum_cache:
         yum_cache = YumCache(yb)
 
-    # copy the system_driver_packages() structure into the by-device structure
-    for pkg, pkginfo in system_driver_packages(yum_cache).items():
-        if 'syspath' in pkginfo:
-            device_name = pkginfo['syspath']
-        else:
-            device_name = pkginfo['plugin']
-        result.setdefault(device_name, {})
-        for opt_key in ('modalias', 'vendor', 'model'):
-            if opt_key in pkginfo:
-                result[device_name][opt_key] = pkginfo[opt_key]
-        drivers = result[device_name].setdefault('drivers', {})
-        drivers[pkg] = {'free': pkginfo['free'], 'from_distro': pkginfo['from_distro']}
-        if 'recommended' in pkginfo:
-            drivers[pkg]['recommended'] = pkginfo['recommended']
-
-    # now determine the manual_install device flag: this is true iff all driver
-    # packages are "manually installed"
-    for driver, info in result.items():
-        for pkg in info['drivers']:
-            if not _is_manual_install(yum_cache[pkg]):
-                break
-        else:
-            info['manual_install'] = True
-
-    # add OS builtin free alternatives to proprietary drivers
-    _add_builtins(result)
+    return _detect_drivers(yum_cache, modaliases, plugins, snapshot, None, True)[1]
 
-    return result
+# packages which are appropriate for automatic installation
+AUTO_INSTALL_WHITELIST = ['bcmwl*', 'pvr-omap*', 'virtualbox-guest*', 'nvidia-*']
 
 def auto_install_filter(packages):
     '''Get packages which are appropriate for automatic installation.
@@ -493,11 +984,13 @@ def auto_install_filter(packages):
     Wifi driver (as there is no alternative), but not to the FGLRX proprietary
     graphics driver (as the free driver works well and FGLRX does not provide
     KMS).
+
+    Pass AUTO_INSTALL_WHITELIST as package_filter to system_driver_packages()
+    to only look for these packages in the first place.
     '''
     # any package which matches any of those globs will be accepted
-    whitelist = ['bcmwl*', 'pvr-omap*', 'virtualbox-guest*', 'nvidia-*']
     allow = []
-    for pattern in whitelist:
+    for pattern in AUTO_INSTALL_WHITELIST:
         allow.extend(fnmatch.filter(packages, pattern))
 
     result = {}
@@ -506,7 +999,23 @@ def auto_install_filter(packages):
             result[p] = packages[p]
     return result
 
-def detect_plugin_packages(yum_cache=None):
+def _plugin_declared_packages(tree):
+    '''Return the "packages" declaration of a parsed detect plugin.
+
+    This is the literal list in the last module-level "packages" assignment;
+    the plugin does not get executed. Return None if there is none.
+    '''
+    declared = None
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+            isinstance(node.targets[0], ast.Name) and node.targets[0].id == 'packages'):
+            try:
+                declared = list(ast.literal_eval(node.value))
+            except (ValueError, TypeError):
+                declared = None
+    return declared
+
+def detect_plugin_packages(yum_cache=None, package_filter=None, snapshot=None):
     '''Get driver packages from custom detection plugins.
 
     Some driver packages cannot be identified by modaliases, but need some
@@ -517,7 +1026,13 @@ def detect_plugin_packages(yum_cache=None):
     return the joined results.
 
     If you already have an existing YumCache() object, you can pass it as an
-    argument for efficiency.
+    argument for efficiency. The same applies to a hardware.HardwareSnapshot
+    object, which is used for checking the graphics setup.
+
+    package_filter is an optional list of package name globs; then only
+    packages which match one of them are returned. Plugins can declare the
+    packages which they can return in a module-level "packages" literal list;
+    then the plugin is not run at all if none of them match package_filter.
 
     Return pluginname -> [package, ...] map.
     '''
@@ -535,12 +1050,21 @@ def detect_plugin_packages(yum_cache=None):
         if not fname.endswith('.py'):
             continue
         plugin = os.path.join(plugindir, fname)
-        logging.debug('Loading custom detection plugin %s', plugin)
 
         symb = {}
         with open(plugin) as f:
+            logging.debug('Loading custom detection plugin %s', plugin)
             try:
-                exec(compile(f.read(), plugin, 'exec'), symb)
+                tree = ast.parse(f.read(), plugin)
+                if package_filter is not None:
+                    declared = _plugin_declared_packages(tree)
+                    if (declared is not None and
+                        not any(_matches_package_filter(p, package_filter) for p in declared)):
+                        logging.debug('Skipping custom detection plugin %s, it cannot return packages matching %s',
+                                      plugin, ' '.join(package_filter))
+                        continue
+
+                exec(compile(tree, plugin, 'exec'), symb)
                 result = symb['detect'](yum_cache)
                 logging.debug('plugin %s return value: %s', plugin, result)
             except Exception as e:
@@ -554,8 +1078,12 @@ def detect_plugin_packages(yum_cache=None):
                 continue
 
             for pkg in result:
+                if (package_filter is not None and
+                    not _matches_package_filter(pkg, package_filter)):
+                    continue
                 if pkg in yum_cache and yum_cache[pkg].candidate:
-                    if _check_video_abi_compat(yum_cache, yum_cache[pkg].candidate.record):
+                    if (_check_video_abi_compat(yum_cache, yum_cache[pkg]) and
+                            _check_hybrid_compat(yum_cache[pkg], snapshot)):
                         packages.setdefault(fname, []).append(pkg)
                 else:
                     logging.debug('Ignoring unavailable package %s from plugin %s', pkg, plugin)
@@ -586,25 +1114,24 @@ def _cmp_gfx_alternatives(x, y):
     return 0
 
 def _add_builtins(drivers):
-    '''Add builtin driver alternatives'''
-
-    for device, info in drivers.items():
-        for pkg in info['drivers']:
-            # nouveau is good enough for recommended
-            if pkg.endswith('kmod-nvidia'):
-                for d in info['drivers']:
-                    info['drivers'][d]['recommended'] = False
-                info['drivers']['xorg-x11-drv-nouveau'] = {
-                    'free': True, 'builtin': True, 'from_distro': True, 'recommended': False}
-                break
-
-            # radeon is working well for recommended
-            if pkg.endswith('kmod-catalyst'):
-                for d in info['drivers']:
-                    info['drivers'][d]['recommended'] = False
-                info['drivers']['xorg-x11-drv-ati'] = {
-                    'free': True, 'builtin': True, 'from_distro': True, 'recommended': True}
-                break
+    '''Add builtin driver alternatives to the driver map of a device'''
+
+    for pkg in drivers:
+        # nouveau is good enough for recommended
+        if pkg.endswith('kmod-nvidia'):
+            for d in drivers:
+                drivers[d]['recommended'] = False
+            drivers['xorg-x11-drv-nouveau'] = {
+                'free': True, 'builtin': True, 'from_distro': True, 'recommended': False}
+            break
+
+        # radeon is working well for recommended
+        if pkg.endswith('kmod-catalyst'):
+            for d in drivers:
+                drivers[d]['recommended'] = False
+            drivers['xorg-x11-drv-ati'] = {
+                'free': True, 'builtin': True, 'from_distro': True, 'recommended': True}
+            break
 
 def get_linux_headers(yum_cache):
     '''Return the linux headers for the system's kernel'''
@@ -0,0 +1,157 @@
+'''Driver package evaluation for hardware inventories of many machines.'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import re
+import logging
+import multiprocessing
+
+from Pharlap import detect
+from Pharlap import hardware
+from Pharlap import sysfsarchive
+
+# YumCache and parsed text inventories (path -> modalias map) for the worker
+# processes; they inherit them when forked
+_yum_cache = None
+_inventories = {}
+
+_modalias_re = re.compile(r'\w+:')
+
+
+def read_inventory(path):
+    '''Read the hardware inventory of one machine.
+
+    path is either a directory with a copy of the machine's sysfs tree, or a
+    text file with one "modalias [sysfs path]" entry per line; empty lines and
+    lines starting with '#' are ignored, and lines which do not start with a
+    modalias ("bus:...") are skipped with a warning. If a line has no sysfs
+    path, the modalias is used as device name. Archives from
+    sysfsarchive.capture() are handled by _evaluate_host().
+
+    Return a modalias -> [sysfs path, ...] map like
+    detect.system_modalias_devices().
+    '''
+    if os.path.isdir(path):
+        return detect.system_modalias_devices(path)
+
+    aliases = {}
+    with open(path) as f:
+        for (lineno, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 1)
+            if not _modalias_re.match(fields[0]):
+                logging.warning('%s:%i: ignoring line without modalias: %s',
+                                path, lineno, line)
+                continue
+            syspath = len(fields) > 1 and fields[1] or fields[0]
+            aliases.setdefault(fields[0], []).append(syspath)
+
+    for paths in aliases.values():
+        paths.sort()
+    return aliases
+
+
+def host_name(path):
+    '''Return the host name for an inventory path.'''
+
+    name = os.path.basename(path.rstrip(os.sep))
+    if name.endswith('.tar.gz'):
+        name = name[:-7]
+    elif not os.path.isdir(path):
+        name = os.path.splitext(name)[0]
+    return name
+
+
+def _archive_packages(path):
+    '''Evaluate a sysfsarchive.capture() archive.
+
+    The sysfs paths in the result are the ones of the captured machine.
+    '''
+    with sysfsarchive.Replay(path) as replay:
+        snapshot = hardware.HardwareSnapshot(replay.sysfs_dir)
+        packages = detect.system_driver_packages(_yum_cache,
+                modaliases=snapshot.modalias_devices, plugins=False,
+                snapshot=snapshot)
+        for info in packages.values():
+            if 'syspath' in info:
+                info['syspath'] = replay.original_path(info['syspath'])
+            if 'syspaths' in info:
+                info['syspaths'] = [replay.original_path(p) for p in info['syspaths']]
+    return packages
+
+
+def _evaluate_host(path):
+    '''Evaluate one inventory in a worker process.'''
+
+    try:
+        if sysfsarchive.is_archive(path):
+            packages = _archive_packages(path)
+        else:
+            modaliases = _inventories.get(path)
+            if modaliases is None:
+                modaliases = read_inventory(path)
+            packages = detect.system_driver_packages(_yum_cache,
+                    modaliases=modaliases, plugins=False)
+    except (IOError, OSError, ValueError) as e:
+        logging.error('Cannot read inventory %s: %s', path, e)
+        return (host_name(path), None)
+    return (host_name(path), packages)
+
+
+def evaluate(yum_cache, inventory_dir, jobs=None):
+    '''Evaluate the driver packages for a directory of inventories.
+
+    Every entry of inventory_dir is one machine, in a format that
+    read_inventory() understands, or an archive from sysfsarchive.capture().
+    The modalias index is built once, and the modaliases of all text
+    inventories are looked up in one batch (see
+    detect.prefetch_modaliases()); both are shared with a pool of jobs worker
+    processes (default: number of CPUs). Detect plugins are not run, as they
+    probe the running system.
+
+    Generate (host, packages) pairs in no particular order, where packages
+    has the format of detect.system_driver_packages(), or is None if the
+    inventory could not be read.
+    '''
+    global _yum_cache
+    _yum_cache = yum_cache
+    _inventories.clear()
+
+    # build the index before forking, so that the workers share it
+    detect.prepare_modalias_index(yum_cache)
+
+    paths = [os.path.join(inventory_dir, f)
+             for f in sorted(os.listdir(inventory_dir))
+             if not f.startswith('.')]
+
+    # read the text inventories up front, to look up all their modaliases
+    # at once; errors get reported by _evaluate_host()
+    aliases = set()
+    for path in paths:
+        if os.path.isfile(path) and not sysfsarchive.is_archive(path):
+            try:
+                _inventories[path] = read_inventory(path)
+            except (IOError, OSError, ValueError):
+                continue
+            aliases.update(_inventories[path])
+    detect.prefetch_modaliases(yum_cache, aliases)
+
+    if jobs == 1:
+        for path in paths:
+            yield _evaluate_host(path)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(_evaluate_host, paths, chunksize=16):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
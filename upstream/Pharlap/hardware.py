@@ -0,0 +1,640 @@
+'''Hardware enumeration through sysfs and the udev database.
+
+HardwareSnapshot collects everything pharlap needs to know about the hardware
+of a system, so that it is read only once.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import errno
+import select
+import socket
+import logging
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2
+    scandir = None
+
+# default location of the udev database; $PHARLAP_UDEV_DB overrides it
+UDEV_DB = '/run/udev/data'
+
+# netlink protocol and multicast group of kernel uevents
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+
+def _device_modalias(path):
+    '''Read the modalias of a sysfs device directory.
+
+    Return None if the device has no modalias, or if it cannot be read.
+    '''
+    try:
+        with open(os.path.join(path, 'modalias')) as f:
+            return f.read().strip()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            logging.warning('system_modaliases(): Cannot read %s/modalias: %s',
+                    path, e)
+            return None
+
+    # devices on SSB bus only mention the modalias in the uevent file (as
+    # of 2.6.24)
+    if 'ssb' in path:
+        try:
+            with open(os.path.join(path, 'uevent')) as f:
+                for l in f:
+                    if l.startswith('MODALIAS='):
+                        return l.split('=', 1)[1].strip()
+        except IOError:
+            pass
+
+    return None
+
+
+def _is_builtin(path):
+    '''Check if a device is bound to a driver which is built into the kernel.'''
+
+    driverlink = os.path.join(path, 'driver')
+    return (os.path.islink(driverlink) and
+            not os.path.islink(os.path.join(driverlink, 'module')))
+
+
+def device_modalias(path):
+    '''Get the modalias of a single device, like sysfs_modalias_devices().
+
+    Return None if the device does not exist (any more), has no modalias, or
+    its driver is built into the kernel.
+    '''
+    modalias = _device_modalias(path)
+    if not modalias or _is_builtin(path):
+        return None
+    return modalias
+
+
+def _links(directory):
+    '''Return (name, target) of the symlinks in a directory.'''
+
+    result = []
+    if scandir is not None:
+        try:
+            for entry in scandir(directory):
+                if entry.is_symlink():
+                    result.append((entry.name, os.readlink(entry.path)))
+        except OSError:
+            pass
+        return result
+
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return result
+    for name in names:
+        try:
+            result.append((name, os.readlink(os.path.join(directory, name))))
+        except OSError:
+            pass
+    return result
+
+
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except OSError:
+        return []
+
+
+def _link_path(sysfs_dir, link_dir, target):
+    '''Resolve a symlink in sysfs_dir/link_dir to a sysfs_dir/devices/ path.
+
+    Return None if it does not point into sysfs_dir/devices/.
+    '''
+    rel = os.path.normpath(os.path.join(link_dir, target))
+    if not rel.startswith('devices' + os.sep):
+        return None
+    return os.path.join(sysfs_dir, rel)
+
+
+def device_links(sysfs_dir):
+    '''Generate the bus and class device links.
+
+    This generates (link, target, device path) for all symlinks in
+    /sys/bus/*/devices/ and /sys/class/*/ which point to a device below
+    sysfs_dir/devices/; link is relative to sysfs_dir.
+    '''
+    link_dirs = [os.path.join('bus', bus, 'devices')
+                 for bus in _listdir(os.path.join(sysfs_dir, 'bus'))]
+    link_dirs += [os.path.join('class', cls)
+                  for cls in _listdir(os.path.join(sysfs_dir, 'class'))]
+
+    for link_dir in link_dirs:
+        for (name, target) in _links(os.path.join(sysfs_dir, link_dir)):
+            path = _link_path(sysfs_dir, link_dir, target)
+            if path:
+                yield (os.path.join(link_dir, name), target, path)
+
+
+def device_paths(sysfs_dir):
+    '''Get the device directories of all bus and class devices.
+
+    This follows the /sys/bus/*/devices/ and /sys/class/*/ symlinks instead of
+    walking the whole /sys/devices/ tree. The root devices of the system
+    buses (like /sys/devices/system/cpu/) are not linked from anywhere, so
+    these get added explicitly. The returned paths are below sysfs_dir/devices/,
+    in the same form as os.walk() would produce them.
+    '''
+    system_dir = os.path.join(sysfs_dir, 'devices', 'system')
+    result = set(os.path.join(system_dir, d) for d in _listdir(system_dir))
+    for (link, target, path) in device_links(sysfs_dir):
+        result.add(path)
+    return result
+
+
+def walk_modalias_devices(sysfs_dir):
+    '''Get modaliases by walking the whole sysfs_dir/devices/ tree.
+
+    This is slow, but does not depend on the bus and class directories.
+
+    Return a modalias -> [sysfs path, ...] map; the paths are sorted.
+    '''
+    aliases = {}
+    for path, dirs, files in os.walk(os.path.join(sysfs_dir, 'devices')):
+        if 'modalias' not in files and 'uevent' not in files:
+            continue
+        modalias = _device_modalias(path)
+        if not modalias:
+            continue
+
+        # ignore drivers which are statically built into the kernel
+        if _is_builtin(path):
+            continue
+
+        aliases.setdefault(modalias, []).append(path)
+
+    for paths in aliases.values():
+        paths.sort()
+
+    return aliases
+
+
+def sysfs_modalias_devices(sysfs_dir):
+    '''Get modaliases of the bus and class devices in sysfs_dir.
+
+    This gives the same result as walk_modalias_devices(), but only reads the
+    devices which are linked from the bus and class directories, which is a
+    fraction of the directory listings and file accesses. Falls back to
+    walk_modalias_devices() if sysfs_dir has neither.
+
+    Return a modalias -> [sysfs path, ...] map; the paths are sorted.
+    '''
+    if (not os.path.isdir(os.path.join(sysfs_dir, 'bus')) and
+        not os.path.isdir(os.path.join(sysfs_dir, 'class'))):
+        return walk_modalias_devices(sysfs_dir)
+
+    aliases = {}
+    for path in device_paths(sysfs_dir):
+        modalias = _device_modalias(path)
+        if not modalias:
+            continue
+
+        # ignore drivers which are statically built into the kernel
+        if _is_builtin(path):
+            #logging.debug('system_modaliases(): ignoring device %s which has no module (built into kernel)', path)
+            continue
+
+        aliases.setdefault(modalias, []).append(path)
+
+    for paths in aliases.values():
+        paths.sort()
+
+    return aliases
+
+
+def _udev_syspath(sysfs_dir, name):
+    '''Get the sysfs path for a udev database file name.
+
+    Database files are named "c<major>:<minor>" or "b<major>:<minor>" for
+    device nodes, and "+<subsystem>:<sysname>" for other devices. Network
+    interfaces ("n<ifindex>") are not supported.
+
+    Return None if the device cannot be found in sysfs_dir.
+    '''
+    if name[0] in 'cb':
+        candidates = [os.path.join('dev', name[0] == 'c' and 'char' or 'block')]
+        link = name[1:]
+    elif name[0] == '+' and ':' in name:
+        (subsystem, link) = name[1:].split(':', 1)
+        candidates = [os.path.join('bus', subsystem, 'devices'),
+                      os.path.join('class', subsystem)]
+    else:
+        return None
+
+    for link_dir in candidates:
+        try:
+            target = os.readlink(os.path.join(sysfs_dir, link_dir, link))
+        except OSError:
+            continue
+        return _link_path(sysfs_dir, link_dir, target)
+    return None
+
+
+def _udev_modalias_paths(sysfs_dir, udev_db):
+    '''Read the MODALIAS properties of the udev database.
+
+    Return a sysfs path -> modalias map of the database entries whose device
+    exists in sysfs_dir, or None if the database cannot be read or has no
+    modaliases.
+    '''
+    try:
+        names = os.listdir(udev_db)
+    except OSError:
+        return None
+
+    result = {}
+    found = False
+    for name in names:
+        modalias = None
+        try:
+            with open(os.path.join(udev_db, name)) as f:
+                for l in f:
+                    if l.startswith('E:MODALIAS='):
+                        modalias = l.split('=', 1)[1].strip()
+                        break
+        except IOError:
+            continue
+        if not modalias:
+            continue
+        found = True
+
+        path = _udev_syspath(sysfs_dir, name)
+        if path is None:
+            logging.debug('udev_modalias_devices(): no sysfs device for %s', name)
+            continue
+        result[path] = modalias
+
+    if not found:
+        return None
+    return result
+
+
+def _udev_covers_sysfs(sysfs_dir, udev_paths):
+    '''Check if the udev database has the modaliases of all sysfs devices.
+
+    udev_paths is the result of _udev_modalias_paths(). A database which only
+    has MODALIAS for some devices (e. g. because of custom rules, or because
+    udev has not processed all devices yet) must not be used. This only checks
+    which bus and class devices have a modalias attribute, which is much
+    cheaper than reading them.
+    '''
+    for path in device_paths(sysfs_dir):
+        if path not in udev_paths and os.path.exists(os.path.join(path, 'modalias')):
+            logging.debug('udev database has no modalias for %s', path)
+            return False
+    return True
+
+
+def _udev_aliases(udev_paths):
+    aliases = {}
+    for (path, modalias) in udev_paths.items():
+        # ignore drivers which are statically built into the kernel
+        if _is_builtin(path):
+            continue
+
+        aliases.setdefault(modalias, []).append(path)
+
+    for paths in aliases.values():
+        paths.sort()
+
+    return aliases
+
+
+def udev_modalias_devices(sysfs_dir, udev_db=UDEV_DB):
+    '''Get modaliases from the udev database.
+
+    This reads the MODALIAS properties of the database files in udev_db
+    instead of the sysfs attributes. udev only stores the properties which
+    rules and builtins set, so this only works if the udev rules keep
+    MODALIAS. Devices with built-in drivers are still ignored, which is
+    checked in sysfs_dir.
+
+    Return a modalias -> [sysfs path, ...] map like sysfs_modalias_devices(),
+    or None if the database cannot be read or has no modaliases.
+    '''
+    udev_paths = _udev_modalias_paths(sysfs_dir, udev_db)
+    if udev_paths is None:
+        return None
+    return _udev_aliases(udev_paths)
+
+
+def modalias_devices(sysfs_dir, backend='sysfs', udev_db=UDEV_DB):
+    '''Get modaliases of all devices with the given backend.
+
+    backend is 'sysfs' (see sysfs_modalias_devices()), 'udev' (see
+    udev_modalias_devices()), or 'auto', which only uses the udev database if
+    it has the modaliases of all devices which have one in sysfs. The udev
+    backends fall back to sysfs.
+
+    Return a modalias -> [sysfs path, ...] map; the paths are sorted.
+    '''
+    if backend in ('udev', 'auto'):
+        udev_paths = _udev_modalias_paths(sysfs_dir, udev_db)
+        if udev_paths is None:
+            if backend == 'udev':
+                logging.warning('udev database %s has no modaliases, reading sysfs', udev_db)
+        elif backend == 'udev' or _udev_covers_sysfs(sysfs_dir, udev_paths):
+            return _udev_aliases(udev_paths)
+        else:
+            logging.debug('udev database %s is incomplete, reading sysfs', udev_db)
+    elif backend != 'sysfs':
+        logging.warning('Unknown device backend %s, reading sysfs', backend)
+
+    return sysfs_modalias_devices(sysfs_dir)
+
+
+def parse_uevent(data):
+    '''Parse a kernel uevent netlink message.
+
+    Return a key -> value dictionary with the uevent properties (ACTION,
+    DEVPATH, SUBSYSTEM, MODALIAS, etc.), or None if data is not a kernel
+    uevent (e. g. a message from udev).
+    '''
+    if not isinstance(data, str):
+        data = data.decode('UTF-8', 'replace')
+    fields = data.split('\0')
+    if '@' not in fields[0]:
+        return None
+
+    event = {}
+    for field in fields[1:]:
+        if '=' in field:
+            (key, value) = field.split('=', 1)
+            event[key] = value
+    if 'ACTION' not in event or 'DEVPATH' not in event:
+        return None
+    return event
+
+
+class UeventMonitor(object):
+    '''Receive kernel uevents from a netlink socket.
+
+    Raise socket.error if the socket cannot be opened, e. g. if netlink is not
+    available in a container.
+    '''
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                     NETLINK_KOBJECT_UEVENT)
+        try:
+            self._socket.bind((0, UEVENT_KERNEL_GROUP))
+        except socket.error:
+            self._socket.close()
+            raise
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def close(self):
+        self._socket.close()
+
+    def receive(self, timeout=None, settle=0.2):
+        '''Wait for uevents.
+
+        Wait up to timeout seconds (default: forever) for an event, and then
+        collect further events until there are none for settle seconds, so
+        that bursts (like plugging in a docking station) get handled at once.
+
+        Return the list of parsed events; this is empty on timeout.
+        '''
+        events = []
+        wait = timeout
+        while True:
+            (readable, w, x) = select.select([self._socket], [], [], wait)
+            if not readable:
+                return events
+            event = parse_uevent(self._socket.recv(65536))
+            if event is not None:
+                events.append(event)
+            wait = settle
+
+
+def default_modalias_devices(sysfs_dir=None):
+    '''Get modaliases with the backend configured in the environment.
+
+    sysfs_dir defaults to $SYSFS_PATH or /sys. Devices are read from sysfs,
+    unless no sysfs_dir is given and $PHARLAP_DEVICE_BACKEND requests 'udev'
+    or 'auto' (see modalias_devices()); then the udev database
+    $PHARLAP_UDEV_DB (default /run/udev/data) gets read. This is only useful
+    if the udev rules keep MODALIAS, which stock rules do not.
+
+    Return a modalias -> [sysfs path, ...] map; the paths are sorted.
+    '''
+    backend = 'sysfs'
+    if sysfs_dir is None:
+        # $SYSFS_PATH is compatible with libudev
+        sysfs_dir = os.environ.get('SYSFS_PATH', '/sys')
+        backend = os.environ.get('PHARLAP_DEVICE_BACKEND', backend)
+    return modalias_devices(sysfs_dir, backend,
+            os.environ.get('PHARLAP_UDEV_DB', UDEV_DB))
+
+
+def _snapshot_field(func):
+    '''Decorator for a HardwareSnapshot property which is read only once.'''
+
+    name = func.__name__
+
+    def get(self):
+        try:
+            return self._values[name]
+        except KeyError:
+            value = self._values[name] = func(self)
+            return value
+
+    get.__doc__ = func.__doc__
+    return property(get)
+
+
+class HardwareSnapshot(object):
+    '''Read-only view of the hardware of a system.
+
+    All information is read from sysfs on first access and then kept for the
+    lifetime of the object, so that all code which looks at the hardware
+    during one operation shares the same state and does not probe it again.
+    Create a new snapshot to see hardware changes. The returned values must not
+    be modified.
+    '''
+    __slots__ = ('_sysfs_dir', '_sysfs_dir_arg', '_values')
+
+    def __init__(self, sysfs_dir=None, modalias_devices=None):
+        '''Create a snapshot.
+
+        sysfs_dir defaults to $SYSFS_PATH or /sys. modalias_devices can give a
+        modalias -> [sysfs path, ...] map which was determined otherwise, e.
+        g. from an inventory; by default, default_modalias_devices() gets
+        called on first access.
+        '''
+        self._values = {}
+        if modalias_devices is not None:
+            self._values['modalias_devices'] = modalias_devices
+        self._sysfs_dir_arg = sysfs_dir
+        if sysfs_dir is None:
+            sysfs_dir = os.environ.get('SYSFS_PATH', '/sys')
+        self._sysfs_dir = sysfs_dir
+
+    @property
+    def sysfs_dir(self):
+        return self._sysfs_dir
+
+    @_snapshot_field
+    def modalias_devices(self):
+        '''modalias -> [sysfs path, ...] map of the devices which need drivers.
+
+        This ignores devices whose drivers are statically built into the
+        kernel; the paths are sorted.
+        '''
+        return default_modalias_devices(self._sysfs_dir_arg)
+
+    @_snapshot_field
+    def modaliases(self):
+        '''modalias -> sysfs path map, with one device per modalias.'''
+
+        return dict((alias, paths[-1])
+                    for alias, paths in self.modalias_devices.items())
+
+    @_snapshot_field
+    def syspaths(self):
+        '''Sorted list of the sysfs paths of all devices with modaliases.'''
+
+        return sorted(path for paths in self.modalias_devices.values()
+                      for path in paths)
+
+    def attribute(self, syspath, name):
+        '''Return a sysfs attribute of a device, or None if it does not exist.'''
+
+        attributes = self._values.setdefault('_attributes', {})
+        key = (syspath, name)
+        try:
+            return attributes[key]
+        except KeyError:
+            pass
+        try:
+            with open(os.path.join(syspath, name)) as f:
+                value = f.read().strip()
+        except (IOError, OSError):
+            value = None
+        attributes[key] = value
+        return value
+
+    def pci_ids(self, syspath):
+        '''Return the (vendor, device, subsystem vendor, subsystem device) IDs.
+
+        The IDs are four digit hexadecimal strings like in pci.ids, or None if
+        the device does not have them.
+        '''
+        return tuple(v and v[2:6] or None for v in
+                     [self.attribute(syspath, a) for a in
+                      ('vendor', 'device', 'subsystem_vendor', 'subsystem_device')])
+
+    def usb_ids(self, syspath):
+        '''Return the (vendor, product) IDs of a USB device.
+
+        For USB interfaces, these are the IDs of the device which they belong
+        to. The IDs are four digit hexadecimal strings like in usb.ids, or
+        None if the device does not have them.
+        '''
+        for path in (syspath, os.path.dirname(syspath)):
+            vendor = self.attribute(path, 'idVendor')
+            if vendor is not None:
+                return (vendor, self.attribute(path, 'idProduct'))
+        return (None, None)
+
+    @_snapshot_field
+    def pci_devices(self):
+        '''Sorted list of (sysfs path, class, vendor, device) of all PCI devices.
+
+        class is the four digit hexadecimal base class and subclass (like
+        "0300" for VGA controllers), vendor and device are four digit
+        hexadecimal IDs, like in "lspci -n".
+        '''
+        link_dir = os.path.join('bus', 'pci', 'devices')
+        result = []
+        for (name, target) in _links(os.path.join(self._sysfs_dir, link_dir)):
+            path = _link_path(self._sysfs_dir, link_dir, target)
+            if not path:
+                continue
+            cls = self.attribute(path, 'class')
+            (vendor, device) = self.pci_ids(path)[:2]
+            result.append((path, cls and cls[2:6] or None, vendor, device))
+        result.sort()
+        return result
+
+    @_snapshot_field
+    def display_devices(self):
+        '''Sorted list of (sysfs path, vendor, device) of PCI display controllers.'''
+
+        return [(path, vendor, device) for (path, cls, vendor, device)
+                in self.pci_devices if cls and cls.startswith('03')]
+
+    @_snapshot_field
+    def boot_vga(self):
+        '''sysfs path of the display controller which the firmware set up.
+
+        This is None if no display controller has the boot_vga flag.
+        '''
+        for (path, vendor, device) in self.display_devices:
+            if self.attribute(path, 'boot_vga') == '1':
+                return path
+        return None
+
+    def _link_name(self, syspath, link):
+        links = self._values.setdefault('_links', {})
+        key = (syspath, link)
+        try:
+            return links[key]
+        except KeyError:
+            pass
+        try:
+            value = os.path.basename(os.readlink(os.path.join(syspath, link)))
+        except OSError:
+            value = None
+        links[key] = value
+        return value
+
+    def driver(self, syspath):
+        '''Return the name of the driver which is bound to a device, or None.'''
+
+        return self._link_name(syspath, 'driver')
+
+    def module(self, syspath):
+        '''Return the kernel module of the device's driver, or None.
+
+        This is None for unbound devices and drivers which are built into the
+        kernel.
+        '''
+        return self._link_name(syspath, os.path.join('driver', 'module'))
+
+    @_snapshot_field
+    def dmi(self):
+        '''DMI attribute -> value map (product_name, sys_vendor, etc.).
+
+        Attributes which are not available or not readable (some are only
+        readable by root) are missing.
+        '''
+        result = {}
+        dmi_dir = os.path.join(self._sysfs_dir, 'class', 'dmi', 'id')
+        for name in _listdir(dmi_dir):
+            if name in ('uevent', 'modalias'):
+                continue
+            path = os.path.join(dmi_dir, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path) as f:
+                    result[name] = f.read().strip()
+            except (IOError, OSError):
+                pass
+        return result
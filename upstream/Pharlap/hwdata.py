@@ -0,0 +1,170 @@
+'''Vendor and product names from the hwdata ID databases (pci.ids, usb.ids).
+
+The databases are read through mmap. Only an index of the vendor entries'
+offsets gets built (and stored in the index cache directory, keyed on the
+file's modification time and size); the device and subsystem entries of a
+vendor are parsed when it is first looked up.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import re
+import mmap
+import logging
+
+from Pharlap import indexstore
+
+HWDATA_DIR = '/usr/share/hwdata'
+
+# bump when the structure of the stored vendor index changes
+_index_format = 1
+
+_vendor_re = re.compile(br'^([0-9a-fA-F]{4})  ', re.M)
+
+
+def _cache_path(path):
+    return os.path.join(indexstore.cache_dir(), os.path.basename(path) + '.idx')
+
+
+def _decode(s):
+    return s.decode('UTF-8', 'replace').strip()
+
+
+class IdDatabase(object):
+    '''Read-only view of a pci.ids or usb.ids file.
+
+    IDs are four digit hexadecimal strings, in any case. Raise IOError/OSError
+    if the file cannot be read.
+    '''
+
+    def __init__(self, path, cache_path=None):
+        '''Open an ID database.
+
+        cache_path is the location of the persistent vendor index; it
+        defaults to the user's cache directory, and False disables it.
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size > 0:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = b''
+
+        if cache_path is None:
+            cache_path = _cache_path(path)
+        key = (os.path.abspath(path), st.st_mtime, st.st_size)
+
+        self._vendors = None
+        if cache_path:
+            self._vendors = indexstore.load(cache_path, key, _index_format)
+        if not isinstance(self._vendors, dict):
+            self._vendors = {}
+            for m in _vendor_re.finditer(self._map):
+                self._vendors.setdefault(m.group(1).decode('ASCII').lower(), m.start())
+            if cache_path:
+                indexstore.save(self._vendors, cache_path, key, _index_format)
+
+        # vendor -> (name, {device: (name, {(subvendor, subdevice): name})}),
+        # or None for unknown vendors
+        self._entries = {}
+
+    def _line(self, pos):
+        '''Return (line, position of next line) at pos.'''
+
+        end = self._map.find(b'\n', pos)
+        if end < 0:
+            end = len(self._map)
+        return (self._map[pos:end], end + 1)
+
+    def _vendor(self, vendor):
+        vendor = vendor.lower()
+        try:
+            return self._entries[vendor]
+        except KeyError:
+            pass
+
+        offset = self._vendors.get(vendor)
+        if offset is None:
+            self._entries[vendor] = None
+            return None
+
+        (line, pos) = self._line(offset)
+        name = _decode(line[4:])
+        devices = {}
+        subsystems = None
+        while pos < len(self._map):
+            (line, pos) = self._line(pos)
+            if line.startswith(b'\t\t'):
+                # subsystems in pci.ids; usb.ids has interfaces here, which
+                # only have one ID
+                fields = line[2:].split(None, 2)
+                if subsystems is not None and len(fields) == 3:
+                    subsystems[(fields[0].decode('ASCII').lower(),
+                                fields[1].decode('ASCII').lower())] = _decode(fields[2])
+            elif line.startswith(b'\t'):
+                fields = line[1:].split(None, 1)
+                if len(fields) == 2:
+                    subsystems = {}
+                    devices[fields[0].decode('ASCII').lower()] = (_decode(fields[1]), subsystems)
+            elif line.strip() and not line.startswith(b'#'):
+                # next vendor or section
+                break
+
+        self._entries[vendor] = (name, devices)
+        return self._entries[vendor]
+
+    def vendor_name(self, vendor):
+        '''Return the name of a vendor, or None if it is unknown.'''
+
+        entry = self._vendor(vendor)
+        return entry and entry[0]
+
+    def device_name(self, vendor, device):
+        '''Return the name of a device, or None if it is unknown.'''
+
+        entry = self._vendor(vendor)
+        if entry is None:
+            return None
+        try:
+            return entry[1][device.lower()][0]
+        except KeyError:
+            return None
+
+    def subsystem_name(self, vendor, device, subvendor, subdevice):
+        '''Return the name of a PCI subsystem, or None if it is unknown.'''
+
+        entry = self._vendor(vendor)
+        if entry is None:
+            return None
+        try:
+            return entry[1][device.lower()][1][(subvendor.lower(), subdevice.lower())]
+        except KeyError:
+            return None
+
+
+def database(bus):
+    '''Return the IdDatabase for a bus ('pci' or 'usb').
+
+    Databases are opened once. Return None if there is none for that bus.
+    '''
+    try:
+        return database.databases[bus]
+    except KeyError:
+        pass
+
+    db = None
+    path = os.path.join(HWDATA_DIR, '%s.ids' % bus)
+    if os.path.exists(path):
+        try:
+            db = IdDatabase(path)
+        except (IOError, OSError) as e:
+            logging.warning('Cannot read %s: %s', path, e)
+    database.databases[bus] = db
+    return db
+
+database.databases = {}
@@ -0,0 +1,107 @@
+'''On-disk storage of lookup indexes.
+
+Indexes which are expensive to build (like the modalias map of the driver
+packages, or the vendor offsets of an ID database) are stored as JSON data
+together with a format version and a key which describes their source, so
+that they can be reused as long as neither changes. Every kind of index has
+its own format version.
+
+Stored indexes are only data, and they are only read if they can not have
+been planted by another user.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import json
+import logging
+import tempfile
+
+
+def cache_dir():
+    '''Return the directory for indexes which cannot be stored elsewhere.
+
+    This is pharlap/ in the user's cache directory, or /var/cache/pharlap for
+    root, where $XDG_CACHE_HOME and $HOME may still point to the invoking
+    user's directories (e. g. with sudo).
+    '''
+    if os.geteuid() == 0:
+        return '/var/cache/pharlap'
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                        'pharlap')
+
+
+def _shared_dir(path):
+    '''Check if the directory of path is writable by other users (e. g. /tmp).'''
+
+    try:
+        return bool(os.stat(os.path.dirname(os.path.abspath(path))).st_mode & 0o002)
+    except OSError:
+        return False
+
+
+def load(path, key, format):
+    '''Load index data which was stored with save().
+
+    Indexes are only read if they are owned by root or the current user, are
+    not writable by others, and are not in a directory which others can write
+    to (like /tmp).
+
+    Return None if path does not exist, is invalid or untrusted, or was saved
+    with a different key or format version.
+    '''
+    if _shared_dir(path):
+        logging.debug('indexstore.load(): ignoring index %s in shared directory', path)
+        return None
+    try:
+        with open(path) as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid not in (0, os.geteuid()) or st.st_mode & 0o022:
+                logging.warning('Ignoring index %s with unsafe owner or permissions', path)
+                return None
+            (stored_format, stored_key, index) = json.load(f)
+    except (IOError, OSError):
+        return None
+    except (ValueError, TypeError) as e:
+        logging.debug('indexstore.load(): ignoring invalid index %s: %s', path, e)
+        return None
+
+    # keys are compared in their JSON form, where tuples become lists
+    if stored_format != format or stored_key != json.loads(json.dumps(key)):
+        logging.debug('indexstore.load(): index %s is outdated', path)
+        return None
+    return index
+
+
+def save(index, path, key, format):
+    '''Store JSON serializable index data for the given key and format version.
+
+    The file is replaced atomically. Directories which others can write to are
+    refused, see load(). Return True on success, False if it could not be
+    written.
+    '''
+    directory = os.path.dirname(path) or '.'
+    if _shared_dir(path):
+        logging.debug('indexstore.save(): not writing %s into shared directory', path)
+        return False
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        f = tempfile.NamedTemporaryFile(mode='w', dir=directory, prefix='.index',
+                                        delete=False)
+        try:
+            json.dump([format, key, index], f)
+            f.close()
+            os.chmod(f.name, 0o644)
+            os.rename(f.name, path)
+        except:
+            f.close()
+            os.unlink(f.name)
+            raise
+    except (IOError, OSError, TypeError, ValueError) as e:
+        logging.debug('indexstore.save(): cannot write %s: %s', path, e)
+        return False
+    return True
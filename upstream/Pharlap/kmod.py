@@ -0,0 +1,284 @@
+'''Kernel modules of an installed kernel.
+
+This answers whether a kernel module is available or built into a kernel from
+the depmod files in /lib/modules/<version>/ (modules.dep, modules.builtin),
+plus the module files in its extra/ and updates/ directories which depmod has
+not seen yet, instead of running modinfo for every module. Module aliases are
+resolved from the alias directives in the modprobe.d configuration, then
+modules.alias and modules.builtin.alias, like modprobe --resolve-alias does.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import fnmatch
+import logging
+
+from Pharlap.modalias import ModaliasIndex
+
+MODULES_DIR = '/lib/modules'
+
+# directories of out-of-tree modules, relative to the kernel's module directory
+EXTRA_DIRS = ('extra', 'updates')
+
+# modprobe configuration directories; a file overrides files with the same
+# name in the directories after it
+MODPROBE_DIRS = ('/etc/modprobe.d', '/run/modprobe.d', '/usr/local/lib/modprobe.d',
+                 '/lib/modprobe.d')
+
+_suffixes = ('.ko', '.ko.gz', '.ko.xz', '.ko.zst')
+
+
+def module_name(path):
+    '''Return the module name of a module file path.
+
+    The kernel does not distinguish between '-' and '_' in module names; this
+    returns names with '_'. Return None if path is not a module file.
+    '''
+    name = os.path.basename(path)
+    for suffix in _suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)].replace('-', '_')
+    return None
+
+
+def _read_lines(path):
+    try:
+        with open(path) as f:
+            return f.read().splitlines()
+    except (IOError, OSError):
+        return []
+
+
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except OSError:
+        return []
+
+
+def _config_lines(path):
+    '''Read the lines of a modprobe configuration file.
+
+    This joins continued lines and drops comments and empty lines.
+    '''
+    result = []
+    line = ''
+    for l in _read_lines(path):
+        if l.endswith('\\'):
+            line += l[:-1]
+            continue
+        line += l
+        if line.strip() and not line.lstrip().startswith('#'):
+            result.append(line)
+        line = ''
+    return result
+
+
+def config_aliases(config_dirs=None):
+    '''Read the alias directives of the modprobe configuration.
+
+    config_dirs defaults to MODPROBE_DIRS. Like modprobe, this reads the *.conf
+    files of all directories in the order of their names.
+
+    Return a list of (pattern, module) in file order.
+    '''
+    files = {}
+    for directory in reversed(config_dirs or MODPROBE_DIRS):
+        for name in _listdir(directory):
+            if name.endswith('.conf'):
+                files[name] = os.path.join(directory, name)
+
+    result = []
+    for name in sorted(files):
+        for line in _config_lines(files[name]):
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == 'alias':
+                result.append((fields[1].replace('-', '_'), fields[2].replace('-', '_')))
+    return result
+
+
+class ModuleIndex(object):
+    '''Available and built-in modules of a kernel.'''
+
+    def __init__(self, kernel=None, modules_dir=None, config_dirs=None):
+        '''Read the module index of a kernel.
+
+        kernel defaults to the running kernel, modules_dir to MODULES_DIR,
+        and config_dirs (the modprobe configuration) to MODPROBE_DIRS. Missing
+        files are treated as empty.
+        '''
+        self.kernel = kernel or os.uname()[2]
+        self.directory = os.path.join(modules_dir or MODULES_DIR, self.kernel)
+        self.config_dirs = config_dirs or MODPROBE_DIRS
+
+        # module name -> path relative to self.directory
+        self._modules = {}
+        for line in _read_lines(os.path.join(self.directory, 'modules.dep')):
+            path = line.split(':', 1)[0]
+            name = module_name(path)
+            if name:
+                self._modules.setdefault(name, path)
+
+        for extra in EXTRA_DIRS:
+            top = os.path.join(self.directory, extra)
+            for (root, dirs, files) in os.walk(top):
+                for f in files:
+                    name = module_name(f)
+                    if name and name not in self._modules:
+                        self._modules[name] = os.path.relpath(os.path.join(root, f),
+                                                              self.directory)
+
+        self._builtin = set()
+        for line in _read_lines(os.path.join(self.directory, 'modules.builtin')):
+            name = module_name(line.strip())
+            if name:
+                self._builtin.add(name)
+
+        logging.debug('ModuleIndex: %i modules, %i built-in modules in %s',
+                      len(self._modules), len(self._builtin), self.directory)
+
+        # built on the first alias lookup
+        self._aliases = None
+        self._has_aliases = False
+
+    def _read_aliases(self):
+        '''Build the alias index.
+
+        Bus patterns (e. g. "pci:v000010DEd*") go into a ModaliasIndex,
+        literal aliases (e. g. "fs-ext4") into a dictionary, and the few other
+        patterns into a list. The results are (line number, module) pairs, so
+        that matches can be returned in file order.
+        '''
+        self._literal_aliases = {}
+        self._other_patterns = []
+        patterns = {}
+        lineno = 0
+        for name in ('modules.alias', 'modules.builtin.alias'):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                self._has_aliases = True
+            for line in _read_lines(path):
+                lineno += 1
+                fields = line.split()
+                if len(fields) != 3 or fields[0] != 'alias':
+                    continue
+                (alias, result) = (fields[1], (lineno, fields[2].replace('-', '_')))
+                if not any(c in alias for c in '*?['):
+                    self._literal_aliases.setdefault(alias, []).append(result)
+                elif ':' in alias:
+                    bus = alias.split(':', 1)[0]
+                    patterns.setdefault(bus, {}).setdefault(alias, []).append(result)
+                else:
+                    self._other_patterns.append((alias, result))
+
+        self._aliases = ModaliasIndex(patterns)
+        self._config_aliases = config_aliases(self.config_dirs)
+        logging.debug('ModuleIndex: read %i aliases from %s', lineno, self.directory)
+
+    def path(self, module):
+        '''Return the path of a module file, or None if there is none.'''
+
+        path = self._modules.get(module.replace('-', '_'))
+        return path and os.path.join(self.directory, path)
+
+    def builtin(self, module):
+        '''Check if a module is built into the kernel.'''
+
+        return module.replace('-', '_') in self._builtin
+
+    def available(self, module):
+        '''Check if a module is available, as a file or built in.'''
+
+        module = module.replace('-', '_')
+        return module in self._modules or module in self._builtin
+
+    def has_aliases(self):
+        '''Check if the kernel has a module alias file.'''
+
+        if self._aliases is None:
+            self._read_aliases()
+        return self._has_aliases
+
+    def resolve_alias(self, alias):
+        '''Return the modules which match an alias or module name.
+
+        Like for modprobe, aliases in the modprobe configuration (e. g.
+        "alias nvidia nvidia_current") take precedence, then a module name
+        resolves to itself. Otherwise the modules are in the order of
+        modules.alias, so that the first one is what modprobe would load.
+        '''
+        if self._aliases is None:
+            self._read_aliases()
+
+        name = alias.replace('-', '_')
+        result = []
+        for (pattern, module) in self._config_aliases:
+            if fnmatch.fnmatchcase(name, pattern) and module not in result:
+                result.append(module)
+        if result:
+            return result
+
+        if self.available(alias):
+            return [name]
+
+        matches = set(self._literal_aliases.get(alias, ()))
+        if ':' in alias:
+            matches.update(self._aliases.match(alias))
+        for (pattern, match) in self._other_patterns:
+            if fnmatch.fnmatchcase(alias, pattern):
+                matches.add(match)
+
+        result = []
+        for (lineno, module) in sorted(matches):
+            if module not in result:
+                result.append(module)
+        return result
+
+    def resolve_aliases(self, aliases):
+        '''Resolve a list of aliases at once.
+
+        Return a map alias -> [module, ...], see resolve_alias().
+        '''
+        return dict((alias, self.resolve_alias(alias)) for alias in aliases)
+
+
+def _state(kernel):
+    '''Return the size and modification time of the files a ModuleIndex reads.
+
+    This covers modules.dep and modules.builtin, and the extra/updates
+    directories, which change when modules get installed before depmod runs.
+    '''
+    directory = os.path.join(MODULES_DIR, kernel)
+    result = []
+    for name in ('modules.dep', 'modules.builtin') + EXTRA_DIRS:
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            result.append(None)
+            continue
+        result.append((st.st_size, st.st_mtime))
+    return result
+
+
+def index(kernel=None):
+    '''Return the ModuleIndex of a kernel (default: the running kernel).
+
+    Indexes are read once per kernel, and again when its modules change.
+    '''
+    kernel = kernel or os.uname()[2]
+    state = _state(kernel)
+    try:
+        (indexed_state, idx) = index.indexes[kernel]
+        if indexed_state == state:
+            return idx
+    except KeyError:
+        pass
+    idx = ModuleIndex(kernel)
+    index.indexes[kernel] = (state, idx)
+    return idx
+
+index.indexes = {}
@@ -0,0 +1,360 @@
+'''Compiled modalias pattern matching.
+
+Driver packages declare the hardware they support with modalias globs such as
+"pci:v000010DEd*sv*sd*bc03sc*i*". Matching a device modalias against every
+pattern of a bus with fnmatch scales with the number of patterns; the classes
+in this module compile the patterns once so that a lookup costs about the
+length of the modalias instead, and ModaliasIndex only looks at the patterns
+which share the literal vendor/device prefix of the device.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import re
+import fnmatch
+
+
+class _Node(object):
+    '''State of the pattern trie.'''
+
+    __slots__ = ('literals', 'classes', 'any', 'star', 'loop', 'packages')
+
+    def __init__(self, loop=False):
+        self.literals = {}
+        self.classes = {}
+        self.any = None
+        self.star = None
+        self.loop = loop
+        self.packages = None
+
+
+def _tokenize(pattern):
+    '''Split a glob into literal characters and wildcard tokens.
+
+    This follows the rules of fnmatch.translate(), so that a compiled pattern
+    accepts exactly the strings that fnmatch.fnmatch() accepts. Yield '*',
+    '?', ('[', class) or single literal characters.
+    '''
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            yield '*'
+        elif c == '?':
+            yield '?'
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                # unterminated class, fnmatch treats '[' as a literal
+                yield c
+            else:
+                yield ('[', pattern[i - 1:j + 1])
+                i = j + 1
+        else:
+            yield c
+
+
+class ModaliasMatcher(object):
+    '''Match modaliases against a compiled set of glob patterns.
+
+    The patterns are stored in a trie over their tokens; '*' becomes a looping
+    state. match() runs the resulting automaton over the modalias, so the
+    cost does not grow with the number of patterns which share a prefix.
+    Results are identical to calling fnmatch.fnmatch() on every pattern.
+    '''
+
+    def __init__(self, patterns=None):
+        '''Create a matcher.
+
+        patterns is an optional map pattern -> [package, ...] to add.
+        '''
+        self._root = _Node()
+        self._count = 0
+        if patterns:
+            for pattern, packages in patterns.items():
+                self.add(pattern, packages)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, pattern, packages):
+        '''Add a glob pattern which maps to the given package names.'''
+
+        node = self._root
+        for token in _tokenize(pattern):
+            if token == '*':
+                # consecutive stars are equivalent to a single one
+                if node.loop:
+                    continue
+                if node.star is None:
+                    node.star = _Node(loop=True)
+                node = node.star
+            elif token == '?':
+                if node.any is None:
+                    node.any = _Node()
+                node = node.any
+            elif isinstance(token, tuple):
+                try:
+                    node = node.classes[token[1]][1]
+                except KeyError:
+                    regex = re.compile(fnmatch.translate(token[1]))
+                    child = _Node()
+                    node.classes[token[1]] = (regex, child)
+                    node = child
+            else:
+                try:
+                    node = node.literals[token]
+                except KeyError:
+                    child = _Node()
+                    node.literals[token] = child
+                    node = child
+
+        if node.packages is None:
+            node.packages = set()
+            self._count += 1
+        node.packages.update(packages)
+
+    def match(self, modalias):
+        '''Return the set of package names whose patterns match modalias.'''
+
+        states = set()
+        self._enter(self._root, states)
+        for c in modalias:
+            if not states:
+                return set()
+            next_states = set()
+            for node in states:
+                if node.loop:
+                    next_states.add(node)
+                child = node.literals.get(c)
+                if child is not None:
+                    self._enter(child, next_states)
+                if node.any is not None:
+                    self._enter(node.any, next_states)
+                for regex, child in node.classes.values():
+                    if regex.match(c):
+                        self._enter(child, next_states)
+            states = next_states
+
+        result = set()
+        for node in states:
+            if node.packages:
+                result.update(node.packages)
+        return result
+
+    @classmethod
+    def _enter(klass, node, states):
+        '''Add node and the states reachable without consuming input.'''
+
+        states.add(node)
+        if node.star is not None:
+            states.add(node.star)
+
+
+# Fields of the device modaliases which the kernel exports for the pci and usb
+# buses, as (name, marker, number of hex digits). The trailing "in" field of
+# USB interfaces is missing on older kernels.
+MODALIAS_FIELDS = {
+    'pci': (('vendor', 'v', 8), ('device', 'd', 8), ('subvendor', 'sv', 8),
+            ('subdevice', 'sd', 8), ('class', 'bc', 2), ('subclass', 'sc', 2),
+            ('interface', 'i', 2)),
+    'usb': (('vendor', 'v', 4), ('device', 'p', 4), ('release', 'd', 4),
+            ('device_class', 'dc', 2), ('device_subclass', 'dsc', 2),
+            ('device_protocol', 'dp', 2), ('class', 'ic', 2),
+            ('subclass', 'isc', 2), ('interface', 'ip', 2),
+            ('number', 'in', 2)),
+}
+
+_optional_fields = set(['number'])
+
+
+def _fields_re(bus, fields):
+    regex = '^%s:' % bus
+    for (name, marker, width) in fields:
+        field = '%s([0-9A-F]{%i})' % (marker, width)
+        if name in _optional_fields:
+            field = '(?:%s)?' % field
+        regex += field
+    return re.compile(regex + '$')
+
+_modalias_res = dict((bus, _fields_re(bus, fields))
+                     for bus, fields in MODALIAS_FIELDS.items())
+
+# literal vendor and (optional) device prefix of a modalias or pattern
+_key_res = {
+    'pci': re.compile('pci:v([0-9A-F]{8})(?:d([0-9A-F]{8}))?'),
+    'usb': re.compile('usb:v([0-9A-F]{4})(?:p([0-9A-F]{4}))?'),
+}
+
+
+def parse_modalias(modalias):
+    '''Split a pci or usb device modalias into its fields.
+
+    Return a map field name -> integer value, with the field names from
+    MODALIAS_FIELDS. Return None for other buses and for modaliases which do
+    not have the canonical kernel format.
+    '''
+    bus = modalias.split(':', 1)[0]
+    try:
+        m = _modalias_res[bus].match(modalias)
+    except KeyError:
+        return None
+    if not m:
+        return None
+
+    result = {}
+    for (name, marker, width), value in zip(MODALIAS_FIELDS[bus], m.groups()):
+        if value is not None:
+            result[name] = int(value, 16)
+    return result
+
+
+def _bucket_key(bus, modalias):
+    '''Return the (vendor, device) bucket key of a modalias or pattern.
+
+    device is None if only the vendor is a literal. Return None if the vendor
+    is not a literal either.
+    '''
+    try:
+        m = _key_res[bus].match(modalias)
+    except KeyError:
+        return None
+    if not m:
+        return None
+    return m.groups()
+
+
+class ModaliasIndex(object):
+    '''Index of the modalias patterns of all buses.
+
+    Most pci and usb patterns start with a literal vendor and device ID. These
+    are put into hash buckets keyed on that prefix, so that a lookup only runs
+    the few patterns which can possibly match the device. Patterns without a
+    literal vendor, and those of other buses, go into a per-bus fallback
+    bucket. The patterns of a bucket are only compiled into a ModaliasMatcher
+    on its first lookup.
+    '''
+
+    def __init__(self, modalias_map=None, loader=None):
+        '''Build an index from a bus -> modalias -> [package, ...] map.
+
+        Buses which are not in modalias_map can be indexed on demand: loader
+        is then called with the bus name on its first lookup, and returns the
+        modalias -> [package, ...] map for it.
+        '''
+        # bus -> bucket key -> modalias -> set(package, ...); the fallback
+        # bucket has the key None
+        self._buckets = {}
+        # (bus, bucket key) -> ModaliasMatcher
+        self._matchers = {}
+        self._loader = loader
+        if modalias_map:
+            for bus, aliases in modalias_map.items():
+                self._add_bus(bus, aliases)
+
+    def _add_bus(self, bus, aliases):
+        buckets = self._buckets.setdefault(bus, {None: {}})
+        for alias, packages in aliases.items():
+            key = _bucket_key(bus, alias)
+            buckets.setdefault(key, {}).setdefault(alias, set()).update(packages)
+
+    def _load_bus(self, bus):
+        '''Index bus with the loader if necessary; return whether it is indexed.'''
+
+        if bus not in self._buckets:
+            if self._loader is None:
+                return False
+            self._add_bus(bus, self._loader(bus) or {})
+        return True
+
+    def buses(self):
+        '''Return the buses which have been indexed.'''
+
+        return list(self._buckets)
+
+    def modalias_map(self, buses=None):
+        '''Return the patterns as a bus -> modalias -> set(package, ...) map.
+
+        buses restricts this to the given buses; the ones which have not been
+        indexed yet get loaded like for match().
+        '''
+        result = {}
+        for bus in (buses is None and list(self._buckets) or buses):
+            if not self._load_bus(bus):
+                continue
+            aliases = result[bus] = {}
+            for bucket in self._buckets[bus].values():
+                aliases.update(bucket)
+        return result
+
+    def data(self):
+        '''Return the buckets as JSON serializable data, see from_data().'''
+
+        result = {}
+        for bus, buckets in self._buckets.items():
+            result[bus] = [[key and key[0], key and key[1],
+                            dict((alias, sorted(packages))
+                                 for alias, packages in aliases.items())]
+                           for key, aliases in buckets.items()]
+        return result
+
+    @classmethod
+    def from_data(klass, data):
+        '''Create an index from the result of data().
+
+        Raise ValueError if data does not have the right structure.
+        '''
+        index = klass()
+        try:
+            for bus, buckets in data.items():
+                index._buckets[bus] = {None: {}}
+                for (vendor, device, aliases) in buckets:
+                    if not isinstance(aliases, dict):
+                        raise TypeError('bucket is not a map')
+                    key = vendor is not None and (vendor, device) or None
+                    index._buckets[bus][key] = aliases
+        except (AttributeError, TypeError) as e:
+            raise ValueError('invalid modalias index data: %s' % e)
+        return index
+
+    def _matcher(self, bus, key):
+        '''Return the ModaliasMatcher of a bucket, or None if it is empty.'''
+
+        try:
+            return self._matchers[(bus, key)]
+        except KeyError:
+            aliases = self._buckets[bus].get(key)
+            matcher = aliases and ModaliasMatcher(aliases) or None
+            self._matchers[(bus, key)] = matcher
+            return matcher
+
+    def match(self, modalias):
+        '''Return the set of package names whose patterns match modalias.'''
+
+        bus = modalias.split(':', 1)[0]
+        if not self._load_bus(bus):
+            return set()
+
+        keys = [None]
+        key = _bucket_key(bus, modalias)
+        if key is not None:
+            keys.append((key[0], None))
+            if key[1] is not None:
+                keys.append(key)
+
+        result = set()
+        for key in keys:
+            matcher = self._matcher(bus, key)
+            if matcher is not None:
+                result.update(matcher.match(modalias))
+        return result
@@ -0,0 +1,255 @@
+'''Compact binary format for the pharlap modalias map.
+
+pharlap-modalias.map is a JSON document package -> {'modaliases': [{'alias':
+..., 'module': ...}, ...]}. Loading it means parsing and copying every record,
+although a machine usually only looks at the pci and usb patterns. The binary
+format stores the same data with interned strings and one section per bus, and
+is read through mmap, so that only the sections and strings which are actually
+used get decoded.
+
+Layout (all integers are little endian unsigned 32 bit):
+
+  header:    magic, SHA1 of the JSON source (40 hex digits), string count,
+             string table offset, string data offset, bus count, bus table
+             offset, record count, record table offset, package count,
+             package table offset, package reference table offset
+  strings:   (offset, length) into the UTF-8 string data, per string
+  buses:     (name, first record, record count), per bus
+  records:   (alias, module, package) string indexes, grouped by bus
+  packages:  (name, first reference, reference count), per package
+  refs:      record indexes, grouped by package
+
+Use convert() or "python -m Pharlap.modaliasmap <json> <binary>" to create a
+binary map from the JSON one.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+
+MAGIC = b'PHLMAP01'
+
+_header = struct.Struct('<8s40s10I')
+_pair = struct.Struct('<2I')
+_triple = struct.Struct('<3I')
+_index = struct.Struct('<I')
+
+
+class BinaryModaliasMap(object):
+    '''Read-only view of a binary modalias map.'''
+
+    def __init__(self, path):
+        '''Open a binary modalias map.
+
+        Raise ValueError if path is not a binary modalias map, or IOError/OSError
+        if it cannot be read.
+        '''
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _header.size:
+            raise ValueError('%s is not a binary modalias map' % path)
+        fields = _header.unpack_from(self._map, 0)
+        if fields[0] != MAGIC:
+            raise ValueError('%s is not a binary modalias map' % path)
+
+        self.path = path
+        self.checksum = fields[1].decode('ASCII')
+        (self._n_strings, self._strings_offset, self._data_offset,
+         self._n_buses, self._buses_offset, self._n_records,
+         self._records_offset, self._n_packages, self._packages_offset,
+         self._refs_offset) = fields[2:]
+
+        self._strings = {}
+        self._buses = None
+        self._bus_maps = {}
+        self._packages = None
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, i):
+        '''Return string number i of the string table.'''
+
+        try:
+            return self._strings[i]
+        except KeyError:
+            (offset, length) = _pair.unpack_from(self._map,
+                    self._strings_offset + i * _pair.size)
+            offset += self._data_offset
+            s = self._map[offset:offset + length].decode('UTF-8')
+            self._strings[i] = s
+            return s
+
+    def _record(self, i):
+        return _triple.unpack_from(self._map, self._records_offset + i * _triple.size)
+
+    def _bus_table(self):
+        if self._buses is None:
+            self._buses = {}
+            for i in range(self._n_buses):
+                (name, first, count) = _triple.unpack_from(self._map,
+                        self._buses_offset + i * _triple.size)
+                self._buses[self._string(name)] = (first, count)
+        return self._buses
+
+    def _package_table(self):
+        if self._packages is None:
+            self._packages = {}
+            for i in range(self._n_packages):
+                (name, first, count) = _triple.unpack_from(self._map,
+                        self._packages_offset + i * _triple.size)
+                self._packages[self._string(name)] = (first, count)
+        return self._packages
+
+    def buses(self):
+        '''Return the list of buses which have modaliases.'''
+
+        return list(self._bus_table())
+
+    def bus_map(self, bus):
+        '''Return the modalias -> set(package, ...) map of one bus.
+
+        The section is decoded on first access.
+        '''
+        try:
+            return self._bus_maps[bus]
+        except KeyError:
+            pass
+
+        result = {}
+        (first, count) = self._bus_table().get(bus, (0, 0))
+        for i in range(first, first + count):
+            (alias, module, package) = self._record(i)
+            result.setdefault(self._string(alias), set()).add(self._string(package))
+        self._bus_maps[bus] = result
+        return result
+
+    def packages(self):
+        '''Return the list of package names which have modaliases.'''
+
+        return list(self._package_table())
+
+    def __contains__(self, package):
+        return package in self._package_table()
+
+    def modaliases(self, package):
+        '''Return the modalias records of a package.
+
+        This has the same format as the JSON map: a list of {'alias': ...,
+        'module': ...} dictionaries. Raise KeyError for unknown packages.
+        '''
+        (first, count) = self._package_table()[package]
+        result = []
+        for i in range(first, first + count):
+            (record,) = _index.unpack_from(self._map, self._refs_offset + i * _index.size)
+            (alias, module, pkg) = self._record(record)
+            result.append({'alias': self._string(alias),
+                           'module': self._string(module)})
+        return result
+
+
+def write_map(data, path, checksum=''):
+    '''Write a binary modalias map.
+
+    data is the decoded JSON map: package -> {'modaliases': [{'alias': ...,
+    'module': ...}, ...]}. checksum is the SHA1 of the JSON source, which
+    readers can use to key data derived from the map.
+    '''
+    strings = []
+    string_ids = {}
+
+    def intern(s):
+        try:
+            return string_ids[s]
+        except KeyError:
+            string_ids[s] = len(strings)
+            strings.append(s)
+            return string_ids[s]
+
+    # (bus, package, alias, module) string ids
+    records = []
+    for package in sorted(data):
+        package_id = intern(package)
+        for record in data[package].get('modaliases', []):
+            alias = record['alias']
+            records.append((intern(alias.split(':', 1)[0]), package_id,
+                            intern(alias), intern(record.get('module', ''))))
+    records.sort(key=lambda r: (strings[r[0]], strings[r[1]]))
+
+    buses = []
+    package_refs = {}
+    for i, (bus, package, alias, module) in enumerate(records):
+        if not buses or buses[-1][0] != bus:
+            buses.append([bus, i, 0])
+        buses[-1][2] += 1
+        package_refs.setdefault(package, []).append(i)
+
+    string_data = []
+    string_table = []
+    offset = 0
+    for s in strings:
+        b = s.encode('UTF-8')
+        string_table.append(_pair.pack(offset, len(b)))
+        string_data.append(b)
+        offset += len(b)
+
+    packages = []
+    refs = []
+    for package in sorted(package_refs, key=lambda p: strings[p]):
+        packages.append(_triple.pack(package, len(refs), len(package_refs[package])))
+        refs.extend(_index.pack(i) for i in package_refs[package])
+
+    sections = [b''.join(string_table),
+                b''.join(_triple.pack(*b) for b in buses),
+                b''.join(_triple.pack(alias, module, package)
+                         for (bus, package, alias, module) in records),
+                b''.join(packages),
+                b''.join(refs),
+                b''.join(string_data)]
+    offsets = []
+    offset = _header.size
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    (strings_offset, buses_offset, records_offset, packages_offset,
+     refs_offset, data_offset) = offsets
+
+    header = _header.pack(MAGIC, checksum.encode('ASCII').ljust(40, b'0'),
+                          len(strings), strings_offset, data_offset,
+                          len(buses), buses_offset, len(records), records_offset,
+                          len(packages), packages_offset, refs_offset)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+    os.rename(tmp, path)
+
+
+def convert(json_path, path):
+    '''Convert a JSON modalias map into a binary one.'''
+
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    write_map(json.loads(raw.decode('UTF-8')), path, hashlib.sha1(raw).hexdigest())
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write('Usage: %s <JSON map> <binary map>\n' % sys.argv[0])
+        return 1
+    convert(sys.argv[1], sys.argv[2])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
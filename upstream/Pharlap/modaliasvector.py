@@ -0,0 +1,158 @@
+'''Vectorized modalias matching for large batches of devices.
+
+This needs NumPy, which is optional; VectorModaliasMatcher raises ImportError
+if it is not available.
+
+Canonical pci and usb modaliases are encoded as rows of integer fields (see
+Pharlap.modalias.MODALIAS_FIELDS), and patterns whose fields are each either a
+literal or '*' as (value, mask) rows, so that all devices can be compared to
+all patterns with a few array operations. Everything else goes through a
+ModaliasIndex, so the results are the same as for packages_for_modalias().
+detect.prefetch_modaliases() uses this for large batches, e. g. for fleet
+evaluation.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from Pharlap.modalias import MODALIAS_FIELDS, ModaliasIndex, parse_modalias
+
+
+def _pattern_re(bus, fields):
+    regex = '^%s:' % bus
+    for (name, marker, width) in fields:
+        regex += '%s(?:([0-9A-F]{%i})|\\*)' % (marker, width)
+    return re.compile(regex + '\\*?$')
+
+_pattern_res = dict((bus, _pattern_re(bus, fields))
+                    for bus, fields in MODALIAS_FIELDS.items())
+
+
+def decompose_pattern(pattern):
+    '''Split a modalias pattern into per-field (value, mask) pairs.
+
+    This only succeeds for pci and usb patterns which have all fields in
+    canonical order, each either a literal or '*', optionally followed by a
+    trailing '*'. Such a pattern matches a canonical modalias exactly if
+    (field & mask) == value for all fields.
+
+    Return a list of (value, mask) pairs in MODALIAS_FIELDS order, or None.
+    '''
+    bus = pattern.split(':', 1)[0]
+    try:
+        m = _pattern_res[bus].match(pattern)
+    except KeyError:
+        return None
+    if not m:
+        return None
+
+    result = []
+    for (name, marker, width), value in zip(MODALIAS_FIELDS[bus], m.groups()):
+        if value is None:
+            result.append((0, 0))
+        else:
+            result.append((int(value, 16), (1 << (4 * width)) - 1))
+    return result
+
+
+def _encode_modalias(modalias):
+    '''Return the field values of a canonical modalias, or None.
+
+    Modaliases which lack optional fields are not encoded, as patterns
+    which mention these fields must not match them.
+    '''
+    fields = parse_modalias(modalias)
+    if fields is None:
+        return None
+    bus = modalias.split(':', 1)[0]
+    try:
+        return [fields[name] for (name, marker, width) in MODALIAS_FIELDS[bus]]
+    except KeyError:
+        return None
+
+
+class VectorModaliasMatcher(object):
+    '''Match many modaliases against a modalias map at once.'''
+
+    def __init__(self, modalias_map, index=None):
+        '''Build a matcher from a bus -> modalias -> [package, ...] map.
+
+        index can be an existing ModaliasIndex of the same patterns, which is
+        then used for modaliases that cannot be encoded.
+        '''
+
+        if numpy is None:
+            raise ImportError('VectorModaliasMatcher needs NumPy')
+
+        # bus -> (values, masks, [set(package, ...), ...])
+        self._arrays = {}
+        rest = {}
+        for bus, aliases in modalias_map.items():
+            values = []
+            masks = []
+            packages = []
+            for alias, pkgs in aliases.items():
+                fields = decompose_pattern(alias)
+                if fields is None:
+                    rest.setdefault(bus, {})[alias] = pkgs
+                    continue
+                values.append([v for (v, m) in fields])
+                masks.append([m for (v, m) in fields])
+                packages.append(set(pkgs))
+            if packages:
+                self._arrays[bus] = (numpy.array(values, dtype=numpy.uint32),
+                                     numpy.array(masks, dtype=numpy.uint32),
+                                     packages)
+
+        # patterns which do not decompose into fields
+        self._rest = ModaliasIndex(rest)
+        # all patterns, for modaliases which cannot be encoded
+        if index is None:
+            index = ModaliasIndex(modalias_map)
+        self._all = index
+
+    def match(self, modaliases, chunk_size=256):
+        '''Match a list of modaliases.
+
+        chunk_size is the number of devices which get compared to all
+        patterns of a bus in one step; memory usage grows with it.
+
+        Return a list with the set of matching package names for each
+        modalias.
+        '''
+        result = [None] * len(modaliases)
+
+        # bus -> ([position, ...], [encoded fields, ...])
+        encoded = {}
+        for i, alias in enumerate(modaliases):
+            bus = alias.split(':', 1)[0]
+            fields = None
+            if bus in self._arrays:
+                fields = _encode_modalias(alias)
+            if fields is None:
+                result[i] = self._all.match(alias)
+                continue
+            (positions, rows) = encoded.setdefault(bus, ([], []))
+            positions.append(i)
+            rows.append(fields)
+            result[i] = self._rest.match(alias)
+
+        for bus, (positions, rows) in encoded.items():
+            (values, masks, packages) = self._arrays[bus]
+            devices = numpy.array(rows, dtype=numpy.uint32)
+            for start in range(0, len(devices), chunk_size):
+                chunk = devices[start:start + chunk_size]
+                hits = ((chunk[:, numpy.newaxis, :] & masks) == values).all(axis=2)
+                for row, pattern in zip(*numpy.nonzero(hits)):
+                    result[positions[start + row]].update(packages[pattern])
+
+        return result
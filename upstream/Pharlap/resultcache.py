@@ -0,0 +1,105 @@
+'''On-disk cache of driver detection results.
+
+Results are stored under a fingerprint of everything they depend on: the
+hardware (modaliases and driver links), and the state of files like the rpm
+database, the modalias map and the detect plugins. As long as none of these
+change, a result can be answered from the cache without creating a YumCache.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import glob
+import hashlib
+
+from Pharlap import indexstore
+
+_cache_format = 1
+
+
+def cache_dir():
+    '''Return the directory of the result cache.
+
+    This is results/ in the index cache directory (see indexstore.cache_dir()).
+    $PHARLAP_RESULT_CACHE overrides this, except for root.
+    '''
+    directory = os.environ.get('PHARLAP_RESULT_CACHE')
+    if directory and os.geteuid() != 0:
+        return directory
+    return os.path.join(indexstore.cache_dir(), 'results')
+
+
+def _update(hash, *values):
+    for v in values:
+        hash.update(repr(v).encode('UTF-8'))
+        hash.update(b'\0')
+
+
+def file_states(paths):
+    '''Return [path, size, modification time] of all files matching the globs in paths.'''
+
+    result = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append([path, st.st_size, st.st_mtime])
+    return result
+
+
+def fingerprint(snapshot, paths=(), environ=(), extra=()):
+    '''Compute the fingerprint of a system state.
+
+    This covers the modalias devices of snapshot (a hardware.HardwareSnapshot)
+    with their driver and module links, size and modification time of all
+    files which match the glob patterns in paths, the values of the
+    environment variables in environ, and the values in extra.
+
+    Return a hex digest.
+    '''
+    h = hashlib.sha1()
+    _update(h, _cache_format)
+
+    for alias, syspaths in sorted(snapshot.modalias_devices.items()):
+        for path in syspaths:
+            _update(h, alias, path, snapshot.driver(path), snapshot.module(path))
+
+    for pattern in paths:
+        _update(h, pattern)
+        for (path, size, mtime) in file_states([pattern]):
+            _update(h, path, size, mtime)
+
+    for var in environ:
+        _update(h, var, os.environ.get(var))
+
+    _update(h, *extra)
+    return h.hexdigest()
+
+
+def _path(kind):
+    return os.path.join(cache_dir(), kind + '.json')
+
+
+def load(kind, key):
+    '''Load the cached result of given kind.
+
+    This goes through indexstore.load(), so that results which other users
+    could have planted are not trusted.
+
+    Return None if there is none, or if it was stored under another key.
+    '''
+    return indexstore.load(_path(kind), key, _cache_format)
+
+
+def store(kind, key, result):
+    '''Store a JSON serializable result of given kind under key.
+
+    The file is replaced atomically. Return True on success, False if it could
+    not be written.
+    '''
+    return indexstore.save(result, _path(kind), key, _cache_format)
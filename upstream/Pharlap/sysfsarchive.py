@@ -0,0 +1,207 @@
+'''Capture and replay the hardware information of a system.
+
+An archive is a gzip compressed tar file with the part of a sysfs tree which
+driver detection reads: the attributes of all devices which have a modalias
+and of all PCI devices, their driver and module links, the bus and class links
+which point to them, and the DMI attributes which quirks match on (but no
+serial numbers or UUIDs). Replaying it extracts the tree
+into memory (/dev/shm if available), so that it can be used as $SYSFS_PATH.
+'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import io
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+
+from Pharlap import hardware
+from Quirks import quirkinfo
+
+# device attributes which get captured
+ATTRIBUTES = ('modalias', 'uevent', 'vendor', 'device', 'subsystem_vendor',
+              'subsystem_device', 'class', 'boot_vga', 'dev', 'idVendor',
+              'idProduct')
+
+# DMI attributes which get captured; the modalias has the DMI strings for
+# driver matching
+DMI_ATTRIBUTES = quirkinfo.dmi_keys + ('modalias', 'uevent')
+
+# directory for replayed trees, if it exists
+REPLAY_DIR = '/dev/shm'
+
+
+class _Writer(object):
+    '''Add files, directories and symlinks to a tar file, once each.'''
+
+    def __init__(self, tar):
+        self._tar = tar
+        self._added = set()
+        self._mtime = time.time()
+
+    def _info(self, name, type):
+        if name in self._added:
+            return None
+        self._added.add(name)
+        info = tarfile.TarInfo(name)
+        info.type = type
+        info.mtime = self._mtime
+        return info
+
+    def directory(self, name):
+        if name.startswith('..'):
+            return
+        info = self._info(name, tarfile.DIRTYPE)
+        if info:
+            info.mode = 0o755
+            self._tar.addfile(info)
+
+    def file(self, name, data):
+        info = self._info(name, tarfile.REGTYPE)
+        if info:
+            info.mode = 0o644
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def link(self, name, target):
+        info = self._info(name, tarfile.SYMTYPE)
+        if info:
+            info.mode = 0o777
+            info.linkname = target
+            self._tar.addfile(info)
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def capture(path, sysfs_dir='/sys'):
+    '''Write the hardware information of sysfs_dir into an archive.'''
+
+    tar = tarfile.open(path, 'w:gz')
+    try:
+        writer = _Writer(tar)
+        dmi = os.path.realpath(os.path.join(sysfs_dir, 'class', 'dmi', 'id'))
+
+        devices = set()
+        for device in sorted(hardware.device_paths(sysfs_dir)):
+            if os.path.realpath(device) == dmi:
+                names = DMI_ATTRIBUTES
+            elif (os.path.exists(os.path.join(device, 'modalias')) or
+                  os.path.exists(os.path.join(device, 'vendor')) or
+                  ('ssb' in device and hardware.device_modalias(device))):
+                names = ATTRIBUTES
+            else:
+                continue
+
+            devices.add(device)
+            rel = os.path.relpath(device, sysfs_dir)
+            writer.directory(rel)
+            for name in names:
+                data = _read(os.path.join(device, name))
+                if data is not None:
+                    writer.file(os.path.join(rel, name), data)
+
+            # driver link, and module link of the driver
+            try:
+                target = os.readlink(os.path.join(device, 'driver'))
+            except OSError:
+                continue
+            writer.link(os.path.join(rel, 'driver'), target)
+            driver = os.path.normpath(os.path.join(rel, target))
+            writer.directory(driver)
+            try:
+                target = os.readlink(os.path.join(sysfs_dir, driver, 'module'))
+            except OSError:
+                continue
+            writer.link(os.path.join(driver, 'module'), target)
+            writer.directory(os.path.normpath(os.path.join(driver, target)))
+
+        for (link, target, device) in hardware.device_links(sysfs_dir):
+            if device in devices:
+                writer.link(link, target)
+    finally:
+        tar.close()
+
+
+def _check_member(member, root):
+    '''Raise ValueError if an archive member would end up outside of root.'''
+
+    path = os.path.normpath(os.path.join(root, member.name))
+    if os.path.isabs(member.name) or not path.startswith(root + os.sep):
+        raise ValueError('invalid archive member %s' % member.name)
+    if member.issym():
+        target = os.path.normpath(os.path.join(os.path.dirname(path), member.linkname))
+        if os.path.isabs(member.linkname) or not target.startswith(root + os.sep):
+            raise ValueError('invalid symlink %s -> %s' % (member.name, member.linkname))
+    elif not (member.isfile() or member.isdir()):
+        raise ValueError('invalid archive member %s' % member.name)
+
+
+def is_archive(path):
+    '''Check if path is a hardware archive (a tar file).'''
+
+    return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+
+class Replay(object):
+    '''Replay an archive as a sysfs tree.
+
+    The tree is extracted into a temporary directory; sysfs_dir is its path,
+    suitable for $SYSFS_PATH. It is removed again by close(), or at the end of
+    a with statement.
+    '''
+
+    def __init__(self, path, directory=None):
+        '''Extract an archive.
+
+        directory defaults to /dev/shm if it is writable, so that the tree
+        is kept in memory, and the default temporary directory otherwise.
+        Raise ValueError if the archive contains anything else than files,
+        directories, and symlinks within the tree.
+        '''
+        if directory is None and os.access(REPLAY_DIR, os.W_OK):
+            directory = REPLAY_DIR
+        self.sysfs_dir = tempfile.mkdtemp(prefix='pharlap-sysfs.', dir=directory)
+        try:
+            tar = tarfile.open(path)
+            try:
+                members = tar.getmembers()
+                for member in members:
+                    _check_member(member, self.sysfs_dir)
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(self.sysfs_dir, members, filter='data')
+                else:
+                    tar.extractall(self.sysfs_dir, members)
+            finally:
+                tar.close()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sysfs_dir:
+            shutil.rmtree(self.sysfs_dir, ignore_errors=True)
+            self.sysfs_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def original_path(self, path, sysfs_dir='/sys'):
+        '''Map a path in the replayed tree to the captured system's path.'''
+
+        if path.startswith(self.sysfs_dir + os.sep):
+            return sysfs_dir + path[len(self.sysfs_dir):]
+        return path
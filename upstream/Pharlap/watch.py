@@ -0,0 +1,145 @@
+'''Follow hardware changes and update the driver recommendations.'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import time
+import socket
+import logging
+
+from Pharlap import detect
+from Pharlap import hardware
+
+
+def diff_devices(old, new):
+    '''Compare two detect.system_device_drivers() results.
+
+    Return a list of (action, device name, info) tuples, sorted by device
+    name, where action is 'added', 'removed', or 'changed'. info is the new
+    device info, or the old one for removed devices.
+    '''
+    changes = []
+    for device in sorted(set(old) | set(new)):
+        if device not in new:
+            changes.append(('removed', device, old[device]))
+        elif device not in old:
+            changes.append(('added', device, new[device]))
+        elif old[device] != new[device]:
+            changes.append(('changed', device, new[device]))
+    return changes
+
+
+class DeviceWatcher(object):
+    '''Keep the system_device_drivers() result of a system up to date.
+
+    On hardware changes, only the modaliases of the devices which were added,
+    removed, or changed get looked up again. Devices from detect plugins are
+    only determined initially.
+    '''
+
+    def __init__(self, yum_cache, sysfs_dir=None, plugins=True):
+        '''Detect the current devices.
+
+        sysfs_dir defaults to $SYSFS_PATH or /sys.
+        '''
+        self.yum_cache = yum_cache
+        self.sysfs_dir = sysfs_dir
+        self.modalias_devices = hardware.default_modalias_devices(sysfs_dir)
+        snapshot = hardware.HardwareSnapshot(sysfs_dir, self.modalias_devices)
+        self.devices = detect.system_device_drivers(yum_cache, snapshot,
+                                                    plugins=plugins)
+
+    @property
+    def live(self):
+        '''Whether the watcher looks at the running system's /sys.'''
+
+        return self.sysfs_dir is None and 'SYSFS_PATH' not in os.environ
+
+    def _updated_devices(self, syspaths):
+        '''Return the modalias map with the given devices read again.'''
+
+        syspaths = set(syspaths)
+        result = {}
+        for alias, paths in self.modalias_devices.items():
+            paths = [p for p in paths if p not in syspaths]
+            if paths:
+                result[alias] = paths
+
+        for path in syspaths:
+            alias = hardware.device_modalias(path)
+            if alias:
+                result.setdefault(alias, []).append(path)
+
+        for paths in result.values():
+            paths.sort()
+        return result
+
+    def update(self, syspaths=None):
+        '''Detect the drivers of changed devices.
+
+        syspaths is the list of sysfs paths of the devices which changed, e. g.
+        from uevents. If not given, all devices get enumerated again.
+
+        Return the list of changes, see diff_devices().
+        '''
+        if syspaths is None:
+            modalias_devices = hardware.default_modalias_devices(self.sysfs_dir)
+        else:
+            modalias_devices = self._updated_devices(syspaths)
+
+        affected = set(alias for alias in
+                       set(self.modalias_devices) | set(modalias_devices)
+                       if self.modalias_devices.get(alias) != modalias_devices.get(alias))
+        self.modalias_devices = modalias_devices
+        if not affected:
+            return []
+
+        devices = dict((name, info) for (name, info) in self.devices.items()
+                       if info.get('modalias') not in affected)
+        present = dict((alias, modalias_devices[alias]) for alias in affected
+                       if alias in modalias_devices)
+        if present:
+            logging.debug('DeviceWatcher: detecting drivers for %s', ' '.join(sorted(present)))
+            snapshot = hardware.HardwareSnapshot(self.sysfs_dir, present)
+            devices.update(detect.system_device_drivers(self.yum_cache, snapshot,
+                                                        present, plugins=False))
+
+        changes = diff_devices(self.devices, devices)
+        self.devices = devices
+        return changes
+
+
+def watch(watcher, interval=2.0, uevents=True):
+    '''Follow the hardware changes of a DeviceWatcher.
+
+    For the running system this listens to kernel uevents, and only reads the
+    devices which they mention. If netlink is not available, uevents is False,
+    or the watcher looks at another sysfs tree, this polls all devices every
+    interval seconds instead.
+
+    Generate the non-empty change lists of DeviceWatcher.update().
+    '''
+    monitor = None
+    if uevents and watcher.live:
+        try:
+            monitor = hardware.UeventMonitor()
+        except socket.error as e:
+            logging.warning('Cannot listen to kernel uevents, polling sysfs: %s', e)
+
+    try:
+        while True:
+            if monitor:
+                events = monitor.receive()
+                changes = watcher.update([os.path.join('/sys', e['DEVPATH'].lstrip('/'))
+                                          for e in events])
+            else:
+                time.sleep(interval)
+                changes = watcher.update()
+            if changes:
+                yield changes
+    finally:
+        if monitor:
+            monitor.close()
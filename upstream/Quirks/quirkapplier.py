@@ -30,8 +30,9 @@ import Quirks.quirkreader
 import Quirks.quirkinfo
 
 class QuirkChecker:
-    def __init__(self, handler, path='/usr/share/jockey/quirks'):
+    def __init__(self, handler, path='/usr/share/jockey/quirks', snapshot=None):
         self._handler = handler
+        self._snapshot = snapshot
         self.quirks_path = path
         self._quirks = []
         self.get_quirks_from_path()
@@ -60,7 +61,7 @@ class QuirkChecker:
 
     def get_system_info(self):
         '''Get system info for the quirk'''
-        quirk_info = Quirks.quirkinfo.QuirkInfo()
+        quirk_info = Quirks.quirkinfo.QuirkInfo(self._snapshot)
         return quirk_info.get_dmi_info()
 
     def matches_tags(self, quirk):
@@ -28,8 +28,15 @@ dmi_keys = ('product_name', 'product_version',
              'board_name', 'board_vendor')
 
 class QuirkInfo:
-    def __init__(self):
+    def __init__(self, snapshot=None):
+        '''Create a QuirkInfo object.
+
+        snapshot is an optional object whose dmi attribute is a
+        DMI attribute -> value map, like a
+        Pharlap.hardware.HardwareSnapshot.
+        '''
         self.sys_dir = '/sys'
+        self.snapshot = snapshot
         self._quirk_info = {}.fromkeys(dmi_keys, '')
 
     def get_dmi_info(self):
@@ -38,8 +45,14 @@ class QuirkInfo:
         Some or the whole Dmi info may not be available on
         some systems.
 
-        The default implementation queries sysfs.
+        The default implementation queries sysfs, or uses the
+        snapshot if one was given.
         '''
+        if self.snapshot is not None:
+            for item in self._quirk_info.keys():
+                self._quirk_info[item] = self.snapshot.dmi.get(item, '')
+            return self._quirk_info
+
         for item in self._quirk_info.keys():
             try:
                 value = open(os.path.join(self.sys_dir,
@@ -22,6 +22,10 @@ db = {'OMAP4 Panda board': 'pvr-omap4',
       'Toshiba AC100 / Dynabook AZ': 'nvidia-tegra',
      }
 
+# all packages in db; this is read without running the plugin, so it must be
+# a literal list
+packages = ['nvidia-tegra', 'pvr-omap4']
+
 def detect(apt_cache):
     board = ''
     pkg = None
@@ -6,6 +6,8 @@
 import os.path
 import os
 
+packages = ['open-vm-dkms']
+
 def detect(yum_cache):
     if os.path.exists(os.environ.get('SYSFS_PATH', '/sys') + '/module/vmxnet'):
         return ['open-vm-dkms']
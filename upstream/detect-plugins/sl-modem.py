@@ -11,6 +11,7 @@ modem_re = re.compile('^\s*\d+\s*\[Modem\s*\]')
 modem_as_subdevice_re = re.compile('^card [0-9].*[mM]odem')
 
 pkg = 'sl-modem-daemon'
+packages = ['sl-modem-daemon']
 
 def detect(apt_cache):
     # Check in /proc/asound/cards
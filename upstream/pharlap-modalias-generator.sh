@@ -143,6 +143,9 @@ echo "}"     >> $JSON
 
 popd
 
+echo "Generating binary modalias map..."
+python -m Pharlap.modaliasmap "${JSON}" "${JSON_DIR}/pharlap-modalias.bin"
+
 # clean up files
 rm -rf $OUTPUT_DIR
 
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import gc
+import itertools
+import unittest
+
+from Pharlap import cache
+
+
+class FakeYumCache(object):
+    _generations = itertools.count(1)
+
+    def __init__(self):
+        self.generation = next(FakeYumCache._generations)
+
+
+class GenerationCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.built = []
+        self.cache = cache.GenerationCache(self._build, maxsize=2)
+
+    def _build(self, yum_cache):
+        self.built.append(yum_cache.generation)
+        return 'value%i' % yum_cache.generation
+
+    def test_get(self):
+        '''GenerationCache builds values once per YumCache'''
+
+        c = FakeYumCache()
+        self.assertEqual(self.cache.get(c), 'value%i' % c.generation)
+        self.assertEqual(self.cache.get(c), 'value%i' % c.generation)
+        self.assertEqual(self.built, [c.generation])
+
+    def test_bounded(self):
+        '''GenerationCache evicts the least recently used YumCache'''
+
+        caches = [FakeYumCache() for i in range(3)]
+        self.cache.get(caches[0])
+        self.cache.get(caches[1])
+        self.cache.get(caches[0])
+        self.cache.get(caches[2])
+        self.assertEqual(len(self.cache), 2)
+        self.cache.get(caches[0])
+        self.cache.get(caches[1])
+        self.assertEqual(self.built, [c.generation for c in caches] +
+                         [caches[1].generation])
+
+    def test_weak(self):
+        '''GenerationCache drops entries of collected YumCaches'''
+
+        c = FakeYumCache()
+        self.cache.get(c)
+        self.assertEqual(len(self.cache), 1)
+        del c
+        gc.collect()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        '''GenerationCache.invalidate()'''
+
+        c1 = FakeYumCache()
+        c2 = FakeYumCache()
+        self.cache.get(c1)
+        self.cache.get(c2)
+        self.cache.invalidate(c1)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.get(c1)
+        self.assertEqual(self.built, [c1.generation, c2.generation, c1.generation])
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        '''LRUCache evicts the least recently used item'''
+
+        c = cache.LRUCache(2)
+        c['a'] = frozenset()
+        c['b'] = frozenset(['pkg'])
+        self.assertEqual(c['a'], frozenset())
+        c['c'] = frozenset()
+        self.assertTrue('a' in c)
+        self.assertFalse('b' in c)
+        self.assertRaises(KeyError, c.__getitem__, 'b')
+        self.assertEqual(len(c), 2)
+
+    def test_disabled(self):
+        '''LRUCache with size 0 does not store anything'''
+
+        c = cache.LRUCache(0)
+        c['a'] = 1
+        self.assertEqual(len(c), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
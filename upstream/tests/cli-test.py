@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import io
+import os
+import sys
+import json
+import runpy
+import unittest
+
+import fakeyum
+
+import Pharlap.YumCache
+from Pharlap import detect
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NVIDIA = 'pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'
+BROADCOM = 'pci:v000014E4d00004727sv0000103Csd00001483bc02sc80i00'
+
+
+class QueryInput(object):
+    '''stdin which checks that every modalias gets answered before the next read.'''
+
+    def __init__(self, lines, output):
+        self.lines = list(lines)
+        self.output = output
+        self.queried = 0
+
+    def readline(self):
+        if self.output.getvalue().count('\n') != self.queried:
+            raise AssertionError('modalias was not answered before reading the next line')
+        if not self.lines:
+            return ''
+        line = self.lines.pop(0)
+        if line.strip():
+            self.queried += 1
+        return line
+
+
+class CliTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.yum_cache = fakeyum.YumCache()
+        self.yum_cache.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'], module='nvidia')
+        self.yum_cache.add('kmod-nvidia-340xx', ['pci:v000010DEd00000DE1sv*sd*bc03sc*i*'],
+                           module='nvidia')
+        self.yum_cache.add('wl-kmod', ['pci:v000014E4d*sv*sd*bc02sc80i*'], module='wl')
+
+        self.orig_yum_cache = Pharlap.YumCache.YumCache
+        Pharlap.YumCache.YumCache = lambda: self.yum_cache
+
+    def tearDown(self):
+        Pharlap.YumCache.YumCache = self.orig_yum_cache
+        detect.invalidate_caches()
+
+    def _run(self, argv, stdin_lines=()):
+        '''Run pharlap-cli in this process.
+
+        Return (exit code, stdout lines).
+        '''
+        output = io.StringIO()
+        if sys.version_info[0] < 3:
+            output = io.BytesIO()
+        orig = (sys.argv, sys.stdin, sys.stdout)
+        sys.argv = ['pharlap-cli'] + argv
+        sys.stdin = QueryInput(stdin_lines, output)
+        sys.stdout = output
+        try:
+            runpy.run_path(os.path.join(ROOT_DIR, 'pharlap-cli'), run_name='__main__')
+        except SystemExit as e:
+            code = e.code
+        finally:
+            (sys.argv, sys.stdin, sys.stdout) = orig
+        return (code, output.getvalue().splitlines())
+
+    def test_query_stdin(self):
+        '''query --stdin answers each line as it arrives'''
+
+        usb = 'usb:v1234p5678d0100dc00dsc00dp00ic03isc01ip01in00'
+        (code, lines) = self._run(['query', '--stdin'],
+                                  [NVIDIA + '\n', '\n', BROADCOM + '\n', usb + '\n'])
+        self.assertEqual(code, 0)
+        self.assertEqual([json.loads(l) for l in lines], [
+            {'modalias': NVIDIA, 'packages': ['kmod-nvidia-340xx', 'nvidia-kmod']},
+            {'modalias': BROADCOM, 'packages': ['wl-kmod']},
+            {'modalias': usb, 'packages': []},
+        ])
+
+    def test_query_arguments(self):
+        '''query with modaliases as arguments'''
+
+        (code, lines) = self._run(['query', BROADCOM, NVIDIA])
+        self.assertEqual(code, 0)
+        self.assertEqual([json.loads(l)['modalias'] for l in lines], [BROADCOM, NVIDIA])
+        self.assertEqual(json.loads(lines[0])['packages'], ['wl-kmod'])
+
+
+if __name__ == '__main__':
+    unittest.main()
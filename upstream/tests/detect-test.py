@@ -0,0 +1,512 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakesysfs
+import fakeyum
+
+from Pharlap import detect
+from Pharlap import hardware
+
+NVIDIA = 'pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'
+VIRTIO = 'pci:v00001AF4d00001001sv00001AF4sd00000002bc01sc00i00'
+
+
+class DetectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.yum_cache = fakeyum.YumCache()
+        self.yum_cache.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'],
+                           module='nvidia', license='Redistributable, no modification permitted',
+                           repoid='korora')
+
+    def tearDown(self):
+        detect.invalidate_caches()
+
+    def test_packages_for_modaliases_list(self):
+        '''packages_for_modaliases() with a list of modaliases'''
+
+        result = detect.packages_for_modaliases(self.yum_cache, [NVIDIA, VIRTIO, NVIDIA])
+        self.assertEqual(sorted(result), sorted([NVIDIA, VIRTIO]))
+        self.assertEqual([p.name for p in result[NVIDIA]['packages']], ['nvidia-kmod'])
+        self.assertEqual(result[NVIDIA]['syspaths'], [])
+        self.assertEqual(result[VIRTIO]['packages'], [])
+
+    def test_packages_for_modaliases_syspaths(self):
+        '''packages_for_modaliases() with path lists and single path strings'''
+
+        result = detect.packages_for_modaliases(self.yum_cache, {
+            NVIDIA: ['/sys/devices/pci0000:00/0000:01:00.0', '/sys/devices/pci0000:00/0000:02:00.0'],
+            VIRTIO: '/sys/devices/pci0000:00/0000:00:04.0',
+        })
+        self.assertEqual(result[NVIDIA]['syspaths'],
+                         ['/sys/devices/pci0000:00/0000:01:00.0', '/sys/devices/pci0000:00/0000:02:00.0'])
+        self.assertEqual(result[VIRTIO]['syspaths'], ['/sys/devices/pci0000:00/0000:00:04.0'])
+        self.assertEqual([p.name for p in result[NVIDIA]['packages']], ['nvidia-kmod'])
+
+    def test_prefetch_modaliases(self):
+        '''prefetch_modaliases() gives the same results as single lookups'''
+
+        self.yum_cache.add('wl-kmod', ['pci:v000014E4d*sv*sd*bc02sc80i*', 'pci:v000014E4d00004727*'],
+                           module='wl')
+        broadcom = 'pci:v000014E4d00004727sv0000103Csd00001483bc02sc80i00'
+        usb = 'usb:v046Dp082Dd0011dcEFdsc02dp01ic0Eisc01ip00in00'
+        aliases = [NVIDIA, VIRTIO, broadcom, usb, 'acpi:PNP0A08:']
+
+        orig_min = detect.VECTOR_MATCH_MIN
+        for vector_min in (1, len(aliases) + 1):
+            detect.invalidate_caches()
+            (index, results) = detect.packages_for_modalias.cache_maps.get(self.yum_cache)
+            maxsize = results.maxsize
+            detect.VECTOR_MATCH_MIN = vector_min
+            try:
+                self.assertEqual(detect.prefetch_modaliases(self.yum_cache, aliases + [NVIDIA]),
+                                 len(aliases))
+            finally:
+                detect.VECTOR_MATCH_MIN = orig_min
+            batch = detect.packages_for_modalias.batches.get(self.yum_cache)
+            self.assertEqual(batch[broadcom], frozenset(['wl-kmod']))
+            self.assertEqual(batch[NVIDIA], frozenset(['nvidia-kmod']))
+            self.assertEqual(batch[usb], frozenset())
+            for alias in aliases:
+                self.assertEqual(batch[alias], frozenset(index.match(alias)))
+
+            # the result cache keeps its size, lookups are answered from the batch
+            self.assertEqual(results.maxsize, maxsize)
+            self.assertEqual(len(results), 0)
+            self.assertEqual([p.name for p in detect.packages_for_modalias(self.yum_cache, broadcom)],
+                             ['wl-kmod'])
+            self.assertEqual(len(results), 0)
+
+            # known ones are not looked up again, and the batch gets replaced
+            self.assertEqual(detect.prefetch_modaliases(self.yum_cache, [NVIDIA]), 0)
+            self.assertEqual(sorted(batch), [NVIDIA])
+
+    def test_stored_modalias_index(self):
+        '''the modalias index is loaded from disk without walking the packages'''
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        rpmdb = os.path.join(workdir, 'Packages')
+        with open(rpmdb, 'w') as f:
+            f.write('1')
+
+        def cache(checksum='abc'):
+            c = fakeyum.YumCache()
+            c.modalias_map_path = '/usr/share/pharlap/pharlap-modalias.map'
+            c.modalias_map_checksum = checksum
+            return c
+
+        def no_walk():
+            raise AssertionError('packages were walked')
+
+        orig = (detect.indexstore.cache_dir, detect._package_state_paths)
+        detect.indexstore.cache_dir = lambda: os.path.join(workdir, 'cache')
+        detect._package_state_paths = [rpmdb]
+        try:
+            built = cache()
+            built.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'], module='nvidia')
+            self.assertEqual(list(detect.packages_for_modaliases(built, [NVIDIA])[NVIDIA]['packages']),
+                             [built['nvidia-kmod']])
+            self.assertEqual(os.listdir(os.path.join(workdir, 'cache')),
+                             ['pharlap-modalias.map.idx'])
+
+            loaded = cache()
+            loaded.add('nvidia-kmod')
+            loaded.package_list = no_walk
+            self.assertEqual(list(detect.packages_for_modaliases(loaded, [NVIDIA])[NVIDIA]['packages']),
+                             [loaded['nvidia-kmod']])
+
+            # another map or rpm database invalidates the stored index
+            for (checksum, state) in (('def', '1'), ('abc', '12')):
+                with open(rpmdb, 'w') as f:
+                    f.write(state)
+                changed = cache(checksum)
+                changed.add('nvidia-kmod')
+                self.assertEqual(detect.packages_for_modaliases(changed, [NVIDIA])[NVIDIA]['packages'], [])
+        finally:
+            (detect.indexstore.cache_dir, detect._package_state_paths) = orig
+
+    def test_video_abi(self):
+        '''video drivers are checked against the X.org video ABI'''
+
+        nvidia = self.yum_cache['nvidia-kmod']
+        nvidia.candidate.requires_names = ['xserver-abi(videodrv-23)', 'libc.so.6']
+        free = self.yum_cache.add('wl-kmod', requires=['kernel'])
+
+        # no X.org server, ABIs cannot be checked
+        self.assertEqual(detect._yum_cache_video_abi(self.yum_cache), None)
+        self.assertTrue(detect._check_video_abi_compat(self.yum_cache, nvidia))
+        detect.invalidate_caches()
+
+        # matching ABI
+        xorg = self.yum_cache.add('xorg-x11-server-Xorg',
+                                  provides=['Xorg', 'xserver-abi(videodrv-23)', 'xserver-abi(xinput-24)'])
+        self.assertEqual(detect._yum_cache_video_abi(self.yum_cache),
+                         frozenset(['xserver-abi(videodrv-23)']))
+        self.assertTrue(detect._check_video_abi_compat(self.yum_cache, nvidia))
+        self.assertTrue(detect._check_video_abi_compat(self.yum_cache, free))
+        self.assertEqual([p.name for p in detect.packages_for_modaliases(
+            self.yum_cache, [NVIDIA])[NVIDIA]['packages']], ['nvidia-kmod'])
+        detect.invalidate_caches()
+
+        # other ABI
+        xorg.candidate.provides_names = ['Xorg', 'xserver-abi(videodrv-24)']
+        self.assertEqual(detect._yum_cache_video_abi(self.yum_cache),
+                         frozenset(['xserver-abi(videodrv-24)']))
+        self.assertFalse(detect._check_video_abi_compat(self.yum_cache, nvidia))
+        self.assertTrue(detect._check_video_abi_compat(self.yum_cache, free))
+        self.assertEqual(detect.packages_for_modaliases(self.yum_cache, [NVIDIA])[NVIDIA]['packages'],
+                         [])
+
+    def test_is_package_free(self):
+        '''_is_package_free() with simple and compound licenses'''
+
+        # not installed, so the license of the candidate counts
+        for (license, free) in (('GPLv2+', True),
+                                ('Redistributable, no modification permitted', False),
+                                ('GPLv2 and Redistributable, no modification permitted', True),
+                                ('(GPLv2+ or MIT) and Proprietary', True),
+                                ('BSD or Proprietary', True),
+                                ('Proprietary and Freeware', False),
+                                ('', False)):
+            pkg = fakeyum.Package('foo', fakeyum.Version('foo', license=license))
+            self.assertEqual(detect._is_package_free(pkg), free, license)
+
+        # the installed version wins over the candidate
+        pkg = fakeyum.Package('foo', fakeyum.Version('foo', license='Proprietary'),
+                              fakeyum.Version('foo', license='GPLv2'))
+        self.assertTrue(detect._is_package_free(pkg))
+        self.assertFalse(detect._is_package_free(fakeyum.Package('foo')))
+
+    def test_package_class(self):
+        '''_package_class() of modalias and plugin packages'''
+
+        self.yum_cache.add('wl-kmod', ['pci:v000014E4d*sv*sd*bc02sc80i*'],
+                           license='GPLv2 and Redistributable, no modification permitted',
+                           repoid='rpmfusion-nonfree')
+        plugin = self.yum_cache.add('sl-modem-daemon', license='Proprietary', repoid='updates')
+
+        self.assertEqual(detect._package_class(self.yum_cache, self.yum_cache['nvidia-kmod']),
+                         (False, True))
+        self.assertEqual(detect._package_class(self.yum_cache, self.yum_cache['wl-kmod']),
+                         (True, False))
+        # packages without modaliases get added on demand
+        self.assertNotIn('sl-modem-daemon', detect._package_class.tables.get(self.yum_cache))
+        self.assertEqual(detect._package_class(self.yum_cache, plugin), (False, True))
+        self.assertIn('sl-modem-daemon', detect._package_class.tables.get(self.yum_cache))
+
+    def test_fields(self):
+        '''system_driver_packages() with a subset of the fields'''
+
+        for name in ('kmod-nvidia', 'akmod-nvidia'):
+            self.yum_cache.add(name, ['pci:v000010DEd*sv*sd*bc03sc*i*'], module='nvidia',
+                               license='Redistributable, no modification permitted')
+        modaliases = {NVIDIA: ['/sys/devices/pci0000:00/0000:01:00.0']}
+
+        full = detect.system_driver_packages(self.yum_cache, modaliases, plugins=False)
+        self.assertTrue(full['kmod-nvidia']['recommended'])
+        self.assertFalse(full['akmod-nvidia']['recommended'])
+        self.assertNotIn('recommended', full['nvidia-kmod'])
+
+        always = set(['modalias', 'syspath', 'syspaths'])
+        for fields in (['free'], ['from_distro', 'vendor'], []):
+            result = detect.system_driver_packages(self.yum_cache, modaliases, plugins=False,
+                                                   fields=fields)
+            self.assertEqual(sorted(result), sorted(full))
+            for (name, info) in result.items():
+                keys = always | set(fields) & set(full[name])
+                if 'recommended' in full[name]:
+                    keys.add('recommended')
+                self.assertEqual(set(info), keys, (fields, name))
+                self.assertEqual(info, dict((k, full[name][k]) for k in keys))
+
+    def test_device_drivers_not_shared(self):
+        '''devices with the same modalias get separate driver maps'''
+
+        first = '/sys/devices/pci0000:00/0000:01:00.0'
+        second = '/sys/devices/pci0000:00/0000:02:00.0'
+        result = detect.system_device_drivers(self.yum_cache, modaliases={NVIDIA: [first, second]},
+                                              plugins=False)
+        self.assertEqual(sorted(result), [first, second])
+        self.assertEqual(result[first], result[second])
+
+        result[first]['drivers']['nvidia-kmod']['recommended'] = True
+        result[first]['drivers']['other-kmod'] = {}
+        self.assertEqual(sorted(result[second]['drivers']), ['nvidia-kmod'])
+        self.assertNotIn('recommended', result[second]['drivers']['nvidia-kmod'])
+
+    def test_plugin_packages_filter(self):
+        '''detect_plugin_packages() with a package filter'''
+
+        plugindir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, plugindir)
+        calls = os.path.join(plugindir, 'calls')
+        plugin = '''
+import os
+%s
+with open(%r, 'a') as f:
+    f.write('load-' + %r + '\\n')
+
+def detect(yum_cache):
+    with open(%r, 'a') as f:
+        f.write(%r + '\\n')
+    return %r
+'''
+        with open(os.path.join(plugindir, 'modem.py'), 'w') as f:
+            f.write(plugin % ("packages = ['sl-modem-daemon']", calls, 'modem', calls, 'modem',
+                              ['sl-modem-daemon']))
+        # no declaration, its results get filtered
+        with open(os.path.join(plugindir, 'gles.py'), 'w') as f:
+            f.write(plugin % ('', calls, 'gles', calls, 'gles', ['nvidia-tegra', 'pvr-omap4']))
+        self.yum_cache.add('sl-modem-daemon')
+        self.yum_cache.add('nvidia-tegra')
+        self.yum_cache.add('pvr-omap4')
+
+        orig_dir = os.environ.get('KORORA_DRIVERS_DETECT_DIR')
+        os.environ['KORORA_DRIVERS_DETECT_DIR'] = plugindir
+        try:
+            self.assertEqual(detect.detect_plugin_packages(self.yum_cache, ['nvidia-*']),
+                             {'gles.py': ['nvidia-tegra']})
+            # the modem plugin does not even get loaded
+            with open(calls) as f:
+                self.assertEqual(f.read().split(), ['load-gles', 'gles'])
+
+            self.assertEqual(detect.detect_plugin_packages(self.yum_cache),
+                             {'gles.py': ['nvidia-tegra', 'pvr-omap4'],
+                              'modem.py': ['sl-modem-daemon']})
+        finally:
+            if orig_dir is None:
+                del os.environ['KORORA_DRIVERS_DETECT_DIR']
+            else:
+                os.environ['KORORA_DRIVERS_DETECT_DIR'] = orig_dir
+
+    def test_package_filter(self):
+        '''system_driver_packages() and the modalias index with a package filter'''
+
+        self.yum_cache.add('wl-kmod', ['pci:v000014E4d*sv*sd*bc02sc80i*'], module='wl')
+        broadcom = 'pci:v000014E4d00004727sv0000103Csd00001483bc02sc80i00'
+        modaliases = {NVIDIA: ['/sys/devices/pci0000:00/0000:01:00.0'],
+                      broadcom: ['/sys/devices/pci0000:00/0000:02:00.0']}
+
+        self.assertEqual(sorted(detect.system_driver_packages(self.yum_cache, modaliases,
+                                                              plugins=False)),
+                         ['nvidia-kmod', 'wl-kmod'])
+        self.assertEqual(sorted(detect.system_driver_packages(self.yum_cache, modaliases, plugins=False,
+                                                              package_filter=['wl-*', 'bcm*'])),
+                         ['wl-kmod'])
+        self.assertEqual(detect.system_driver_packages(self.yum_cache, modaliases, plugins=False,
+                                                       package_filter=[]), {})
+
+        (index, cache) = detect._yum_cache_modalias_index(self.yum_cache, ['nvidia-*'])
+        self.assertEqual(index.match(NVIDIA), set(['nvidia-kmod']))
+        self.assertEqual(index.match(broadcom), set())
+        self.assertEqual(detect.packages_for_modalias(self.yum_cache, broadcom, ['nvidia-*']), [])
+        self.assertEqual([p.name for p in detect.packages_for_modalias(self.yum_cache, broadcom)],
+                         ['wl-kmod'])
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.nvidia = self.sys.add('pci', '0000:01:00.0', {'modalias': NVIDIA})
+        self.workdir = tempfile.mkdtemp()
+        self.rpmdb = os.path.join(self.workdir, 'Packages')
+        with open(self.rpmdb, 'w') as f:
+            f.write('1')
+        self.orig = (detect.indexstore.cache_dir, detect._result_cache_paths)
+        detect.indexstore.cache_dir = lambda: os.path.join(self.workdir, 'cache')
+        detect._result_cache_paths = [self.rpmdb]
+
+    def tearDown(self):
+        (detect.indexstore.cache_dir, detect._result_cache_paths) = self.orig
+        detect.invalidate_caches()
+        shutil.rmtree(self.workdir)
+        del self.sys
+
+    def _yum_cache(self, *virtio_packages):
+        yum_cache = fakeyum.YumCache()
+        yum_cache.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'], module='nvidia')
+        for name in virtio_packages:
+            yum_cache.add(name, ['pci:v00001AF4d*sv*sd*bc*sc*i*'])
+        return yum_cache
+
+    def _check(self, detect_fn, names):
+        '''Check hits and misses of the result cache for detect_fn.
+
+        names(result) gives the package names in a result.
+        '''
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        result = detect_fn(self._yum_cache(), snapshot=snapshot, plugins=False, use_cache=True)
+        self.assertEqual(names(result), ['nvidia-kmod'])
+
+        # a hit does not look at the packages
+        yum_cache = self._yum_cache()
+        yum_cache.package_list = None
+        self.assertEqual(detect_fn(yum_cache, snapshot=hardware.HardwareSnapshot(self.sys.sysfs),
+                                   plugins=False, use_cache=True), result)
+
+        # new hardware
+        self.sys.add('pci', '0000:00:04.0', {'modalias': VIRTIO})
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        result = detect_fn(self._yum_cache('virtio-kmod'), snapshot=snapshot, plugins=False,
+                           use_cache=True)
+        self.assertEqual(names(result), ['nvidia-kmod', 'virtio-kmod'])
+        self.assertEqual(detect_fn(self._yum_cache('virtio-kmod', 'virtio-extra-kmod'),
+                                   snapshot=snapshot, plugins=False, use_cache=True), result)
+
+        # changed rpm database
+        with open(self.rpmdb, 'w') as f:
+            f.write('12')
+        result = detect_fn(self._yum_cache('virtio-kmod', 'virtio-extra-kmod'),
+                           snapshot=snapshot, plugins=False, use_cache=True)
+        self.assertEqual(names(result), ['nvidia-kmod', 'virtio-extra-kmod', 'virtio-kmod'])
+
+    def test_driver_packages(self):
+        '''system_driver_packages() with the result cache'''
+
+        self._check(detect.system_driver_packages, sorted)
+
+    def test_device_drivers(self):
+        '''system_device_drivers() with the result cache'''
+
+        self._check(detect.system_device_drivers,
+                    lambda result: sorted(p for d in result.values() for p in d['drivers']))
+
+
+class HybridTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.workdir = tempfile.mkdtemp()
+        self.xorg_log = os.path.join(self.workdir, 'Xorg.0.log')
+        self.orig_xorg_log = os.environ.get('UBUNTU_DRIVERS_XORG_LOG')
+        os.environ['UBUNTU_DRIVERS_XORG_LOG'] = self.xorg_log
+        detect._is_hybrid_graphics.results.clear()
+
+    def tearDown(self):
+        if self.orig_xorg_log is None:
+            del os.environ['UBUNTU_DRIVERS_XORG_LOG']
+        else:
+            os.environ['UBUNTU_DRIVERS_XORG_LOG'] = self.orig_xorg_log
+        detect._is_hybrid_graphics.results.clear()
+        shutil.rmtree(self.workdir)
+        del self.sys
+
+    def _add_display(self, name, vendor, device, boot_vga):
+        path = self.sys.add('pci', name, {
+            'modalias': 'pci:v0000%sd0000%ssv00001043sd00008234bc03sc00i00' % (vendor.upper(), device.upper()),
+            'class': '0x030000', 'vendor': '0x' + vendor, 'device': '0x' + device,
+            'boot_vga': boot_vga})
+        bus_dir = os.path.join(self.sys.sysfs, 'bus', 'pci', 'devices')
+        if not os.path.isdir(bus_dir):
+            os.makedirs(bus_dir)
+        os.symlink(os.path.join('..', '..', '..', 'devices', name), os.path.join(bus_dir, name))
+        return path
+
+    def _write_log(self, data):
+        with open(self.xorg_log, 'wb') as f:
+            f.write(data)
+
+    def test_xorg_log_contains(self):
+        '''_xorg_log_contains()'''
+
+        needle = b'drivers/intel_drv.so'
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, needle), None)
+
+        self._write_log(b'')
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, needle), False)
+
+        self._write_log(b'[    21.113] (II) Loading /usr/lib64/xorg/modules/drivers/intel_drv.so\n')
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, needle), True)
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, b'nvidia_drv.so'), False)
+
+        # only the beginning of the log is searched
+        padding = b'x' * detect.XORG_LOG_SEARCH_LIMIT
+        self._write_log(padding[:-len(needle)] + needle)
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, needle), True)
+        self._write_log(padding + needle)
+        self.assertEqual(detect._xorg_log_contains(self.xorg_log, needle), False)
+
+    def test_hybrid(self):
+        '''_is_hybrid_graphics() with Intel and NVidia display controllers'''
+
+        self._add_display('0000:00:02.0', '8086', '0166', '1')
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        self.assertFalse(detect._is_hybrid_graphics(snapshot))
+
+        # hotplugged external GPU
+        self._add_display('0000:01:00.0', '10de', '0de1', '0')
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        self.assertTrue(detect._is_hybrid_graphics(snapshot))
+        self.assertFalse(detect._check_hybrid_compat(fakeyum.Package('nvidia-kmod'), snapshot))
+        self.assertTrue(detect._check_hybrid_compat(fakeyum.Package('wl-kmod'), snapshot))
+
+    def test_no_snapshot(self):
+        '''_is_hybrid_graphics() without a snapshot'''
+
+        orig_sysfs = os.environ.get('SYSFS_PATH')
+        os.environ['SYSFS_PATH'] = self.sys.sysfs
+        try:
+            self._add_display('0000:00:02.0', '8086', '0166', '1')
+            self.assertFalse(detect._is_hybrid_graphics())
+            self.assertEqual(len(detect._is_hybrid_graphics.results), 1)
+            self.assertFalse(detect._is_hybrid_graphics())
+            self.assertEqual(len(detect._is_hybrid_graphics.results), 1)
+
+            # hotplugged external GPU
+            self._add_display('0000:01:00.0', '10de', '0de1', '0')
+            self.assertTrue(detect._is_hybrid_graphics())
+        finally:
+            if orig_sysfs is None:
+                del os.environ['SYSFS_PATH']
+            else:
+                os.environ['SYSFS_PATH'] = orig_sysfs
+
+        # results are bounded
+        for i in range(detect._is_hybrid_graphics.results.maxsize + 5):
+            self._write_log(b'x' * i)
+            detect._is_hybrid_graphics(hardware.HardwareSnapshot(self.sys.sysfs))
+        self.assertEqual(len(detect._is_hybrid_graphics.results),
+                         detect._is_hybrid_graphics.results.maxsize)
+
+    def test_nvidia_boot_vga(self):
+        '''_is_hybrid_graphics() with NVidia as boot VGA device'''
+
+        self._add_display('0000:00:02.0', '8086', '0166', '0')
+        self._add_display('0000:01:00.0', '10de', '0de1', '1')
+        self.assertFalse(detect._is_hybrid_graphics(hardware.HardwareSnapshot(self.sys.sysfs)))
+
+    def test_xorg_log_fallback(self):
+        '''_is_hybrid_graphics() without display controllers in sysfs'''
+
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        # missing log
+        self.assertFalse(detect._is_hybrid_graphics(snapshot))
+
+        detect._is_hybrid_graphics.results.clear()
+        self._write_log(b'[    21.113] (II) Loading /usr/lib64/xorg/modules/drivers/intel_drv.so\n')
+        self.assertTrue(detect._is_hybrid_graphics(snapshot))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+'''Provide a fake YumCache for testing.'''
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import itertools
+
+
+class Version(object):
+    '''Candidate or installed version of a package.'''
+
+    def __init__(self, name, arch='noarch', repoid='fedora', license='GPLv2+',
+                 requires=(), provides=()):
+        self.name = name
+        self.arch = arch
+        self.repoid = repoid
+        self.license = license
+        self.requires_names = list(requires)
+        self.provides_names = list(provides)
+
+
+class Package(object):
+    '''Package with the interface of Pharlap.YumCache.YumCachePackage.'''
+
+    def __init__(self, name, candidate=None, installed=None):
+        self.name = name
+        self.candidate = candidate
+        self.installed = installed
+        self._records = {}
+
+    def record(self, name):
+        return self._records[name]
+
+    def has_record(self, name):
+        return name in self._records
+
+    def record_set(self, name, value):
+        self._records[name] = value
+
+    def is_installed(self):
+        return self.installed is not None
+
+
+class YumCache(object):
+    '''In-memory package set with the interface of Pharlap.YumCache.YumCache.
+
+    There is no modalias map file, so the modalias records of the packages are
+    used for the lookups.
+    '''
+    _generations = itertools.count(1)
+
+    modalias_map = None
+    modalias_map_path = None
+    modalias_map_checksum = None
+
+    def __init__(self):
+        self.generation = next(YumCache._generations)
+        self._c = {}
+
+    def add(self, name, modaliases=(), module=None, installed=False, **version):
+        '''Add an available package.
+
+        modaliases is a list of modalias patterns which the package provides a
+        driver for, in kernel module module (default: the package name).
+        version gives the attributes of the candidate, see Version. Return the
+        package.
+        '''
+        candidate = Version(name, **version)
+        pkg = Package(name, candidate, installed and candidate or None)
+        if modaliases:
+            pkg.record_set('modaliases', [{'alias': a, 'module': module or name}
+                                          for a in modaliases])
+        self._c[name] = pkg
+        return pkg
+
+    def package_list(self):
+        return list(self._c.values())
+
+    def package(self, name):
+        return self._c.get(name)
+
+    def is_installed(self, name):
+        return name in self._c and self._c[name].installed is not None
+
+    def __len__(self):
+        return len(self._c)
+
+    def __contains__(self, name):
+        return name in self._c
+
+    def __getitem__(self, name):
+        if name not in self._c:
+            raise KeyError('Package %s not found in cache.' % name)
+        return self._c[name]
+
+    def __iter__(self):
+        return iter(self._c)
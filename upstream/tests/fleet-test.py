@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakesysfs
+import fakeyum
+
+from Pharlap import detect
+from Pharlap import fleet
+from Pharlap import hwdata
+from Pharlap import indexstore
+
+PCI_IDS = b'''10de  NVIDIA Corporation
+\t0de1  GF108 [GeForce GT 430]
+1af4  Red Hat, Inc.
+\t1001  Virtio block device
+'''
+
+NVIDIA = 'pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'
+
+
+class FleetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.inventories = os.path.join(self.workdir, 'inventories')
+        os.mkdir(self.inventories)
+
+        with open(os.path.join(self.workdir, 'pci.ids'), 'wb') as f:
+            f.write(PCI_IDS)
+        self.orig_hwdata_dir = hwdata.HWDATA_DIR
+        self.orig_cache_dir = indexstore.cache_dir
+        hwdata.HWDATA_DIR = self.workdir
+        indexstore.cache_dir = lambda: os.path.join(self.workdir, 'cache')
+        hwdata.database.databases.clear()
+
+        self.yum_cache = fakeyum.YumCache()
+        self.yum_cache.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'],
+                           module='nvidia', license='Redistributable, no modification permitted',
+                           repoid='korora')
+
+    def tearDown(self):
+        hwdata.HWDATA_DIR = self.orig_hwdata_dir
+        indexstore.cache_dir = self.orig_cache_dir
+        hwdata.database.databases.clear()
+        detect.invalidate_caches()
+        shutil.rmtree(self.workdir)
+
+    def _write_inventory(self, name, contents):
+        path = os.path.join(self.inventories, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_inventory_names_from_modalias(self):
+        '''vendor and model of inventory devices come from the modalias'''
+
+        # a local device with different IDs at the inventory's sysfs path
+        sysfs = fakesysfs.SysFS()
+        local = sysfs.add('pci', '0000:00:02.0', {
+            'modalias': 'pci:v00001AF4d00001001sv00001AF4sd00000002bc01sc00i00',
+            'vendor': '0x1af4', 'device': '0x1001'})
+        self._write_inventory('local.txt', '%s %s\n' % (NVIDIA, local))
+        self._write_inventory('missing.txt', '%s /nonexisting/0000:01:00.0\n' % NVIDIA)
+
+        result = dict(fleet.evaluate(self.yum_cache, self.inventories, jobs=1))
+        self.assertEqual(sorted(result), ['local', 'missing'])
+        for host in result:
+            info = result[host]['nvidia-kmod']
+            self.assertEqual(info['vendor'], 'NVIDIA Corporation')
+            self.assertEqual(info['model'], 'GF108 [GeForce GT 430]')
+            self.assertEqual(info['modalias'], NVIDIA)
+        self.assertEqual(result['local']['nvidia-kmod']['syspath'], local)
+        del sysfs
+
+    def test_read_inventory(self):
+        '''read_inventory() of a text inventory'''
+
+        path = self._write_inventory('host.txt', '''# hardware of host
+%s /sys/devices/pci0000:00/0000:02:00.0
+
+%s /sys/devices/pci0000:00/0000:01:00.0
+  usb:v046Dp082Dd0011dcEFdsc02dp01ic0Eisc01ip00in00
+/sys/devices/pci0000:00/0000:03:00.0
+not a modalias
+''' % (NVIDIA, NVIDIA))
+        self.assertEqual(fleet.read_inventory(path), {
+            NVIDIA: ['/sys/devices/pci0000:00/0000:01:00.0', '/sys/devices/pci0000:00/0000:02:00.0'],
+            'usb:v046Dp082Dd0011dcEFdsc02dp01ic0Eisc01ip00in00':
+                ['usb:v046Dp082Dd0011dcEFdsc02dp01ic0Eisc01ip00in00'],
+        })
+
+        self.assertEqual(fleet.read_inventory(self._write_inventory('empty.txt', '')), {})
+
+    def test_read_inventory_sysfs(self):
+        '''read_inventory() of a sysfs tree copy'''
+
+        sysfs = fakesysfs.SysFS()
+        device = sysfs.add('pci', '0000:01:00.0', {'modalias': NVIDIA})
+        self.assertEqual(fleet.read_inventory(sysfs.sysfs), {NVIDIA: [device]})
+        del sysfs
+
+    def test_host_name(self):
+        '''host_name()'''
+
+        self.assertEqual(fleet.host_name(self._write_inventory('web01.txt', '')), 'web01')
+        self.assertEqual(fleet.host_name(self._write_inventory('db01.example.com.tar.gz', '')),
+                         'db01.example.com')
+        self.assertEqual(fleet.host_name(self._write_inventory('mail01', '')), 'mail01')
+        os.mkdir(os.path.join(self.inventories, 'build.example.com'))
+        self.assertEqual(fleet.host_name(os.path.join(self.inventories, 'build.example.com') + os.sep),
+                         'build.example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import hardware
+from Quirks import quirkinfo
+
+import fakesysfs
+
+
+class HardwareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.white = self.sys.add('pci', 'white', {'modalias': 'pci:white'})
+        self.white2 = self.sys.add('pci', 'white2', {'modalias': 'pci:white'})
+        self.black = self.sys.add('usb', 'black', {'modalias': 'usb:black'})
+        self.ssb = self.sys.add('ssb', 'ssb0:0', {},
+                {'MODALIAS': 'ssb:v4243id0812rev05'})
+        self.nomodalias = self.sys.add('pci', 'grey', {'vendor': '0x1234'})
+
+        # built into the kernel
+        builtin = self.sys.add('pci', 'blue', {'modalias': 'pci:blue'})
+        os.makedirs(os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'blue'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'blue'),
+                   os.path.join(builtin, 'driver'))
+
+        # bound to a module
+        os.makedirs(os.path.join(self.sys.sysfs, 'module', 'black'))
+        drv = os.path.join(self.sys.sysfs, 'bus', 'usb', 'drivers', 'black')
+        os.makedirs(drv)
+        os.symlink(os.path.join('..', '..', '..', '..', 'module', 'black'),
+                   os.path.join(drv, 'module'))
+        os.symlink(os.path.join('..', '..', 'bus', 'usb', 'drivers', 'black'),
+                   os.path.join(self.black, 'driver'))
+
+        # bus links
+        bus_dir = os.path.join(self.sys.sysfs, 'bus', 'pci', 'devices')
+        os.makedirs(bus_dir)
+        os.symlink(os.path.join('..', '..', '..', 'devices', 'white'),
+                   os.path.join(bus_dir, 'white'))
+
+        # bus root device, which is not linked from anywhere
+        self.cpu = os.path.join(self.sys.sysfs, 'devices', 'system', 'cpu')
+        os.makedirs(self.cpu)
+        self.sys.set_attribute(self.cpu, 'modalias', 'cpu:type:x86')
+
+    def tearDown(self):
+        del self.sys
+
+    def test_sysfs_modalias_devices(self):
+        '''sysfs_modalias_devices()'''
+
+        self.assertEqual(hardware.sysfs_modalias_devices(self.sys.sysfs), {
+            'pci:white': sorted([self.white, self.white2]),
+            'usb:black': [self.black],
+            'ssb:v4243id0812rev05': [self.ssb],
+            'cpu:type:x86': [self.cpu]})
+
+    def test_same_as_walker(self):
+        '''sysfs_modalias_devices() agrees with walk_modalias_devices()'''
+
+        self.assertEqual(hardware.sysfs_modalias_devices(self.sys.sysfs),
+                         hardware.walk_modalias_devices(self.sys.sysfs))
+
+    def test_no_bus_dirs(self):
+        '''sysfs_modalias_devices() without bus and class directories'''
+
+        sysfs = fakesysfs.SysFS()
+        dev = os.path.join(sysfs.sysfs, 'devices', 'pci0000:00', '0000:00:01.0')
+        os.makedirs(dev)
+        sysfs.set_attribute(dev, 'modalias', 'pci:v00001234d00005678')
+        self.assertEqual(hardware.sysfs_modalias_devices(sysfs.sysfs),
+                         {'pci:v00001234d00005678': [dev]})
+
+    def test_device_paths(self):
+        '''device_paths() resolves links to unique device directories'''
+
+        paths = hardware.device_paths(self.sys.sysfs)
+        self.assertTrue(self.white in paths)
+        self.assertTrue(self.cpu in paths)
+        self.assertEqual(len(paths), 7)
+
+    def test_device_modalias(self):
+        '''device_modalias()'''
+
+        self.assertEqual(hardware.device_modalias(self.white), 'pci:white')
+        self.assertEqual(hardware.device_modalias(self.ssb), 'ssb:v4243id0812rev05')
+        self.assertEqual(hardware.device_modalias(self.nomodalias), None)
+        self.assertEqual(hardware.device_modalias(os.path.join(
+            self.sys.sysfs, 'devices', 'blue')), None)
+        self.assertEqual(hardware.device_modalias(os.path.join(
+            self.sys.sysfs, 'devices', 'gone')), None)
+
+    def test_parse_uevent(self):
+        '''parse_uevent()'''
+
+        self.assertEqual(hardware.parse_uevent(
+            b'add@/devices/pci0000:00/0000:00:14.0/usb1/1-1\0ACTION=add\0'
+            b'DEVPATH=/devices/pci0000:00/0000:00:14.0/usb1/1-1\0SUBSYSTEM=usb\0'
+            b'MODALIAS=usb:v046Dp082D\0SEQNUM=1234\0'),
+            {'ACTION': 'add', 'DEVPATH': '/devices/pci0000:00/0000:00:14.0/usb1/1-1',
+             'SUBSYSTEM': 'usb', 'MODALIAS': 'usb:v046Dp082D', 'SEQNUM': '1234'})
+
+        # udev messages and garbage
+        self.assertEqual(hardware.parse_uevent(b'libudev\0\xfe\xed\xca\xfe'), None)
+        self.assertEqual(hardware.parse_uevent(b'add@/devices/foo\0SEQNUM=1\0'), None)
+
+    def test_empty(self):
+        '''sysfs_modalias_devices() on an empty tree'''
+
+        sysfs = fakesysfs.SysFS()
+        self.assertEqual(hardware.sysfs_modalias_devices(sysfs.sysfs), {})
+
+
+class UdevTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.udev_db = tempfile.mkdtemp()
+
+        self.white = self.sys.add('pci', 'white', {'modalias': 'pci:white'})
+        self._add_db('+pci:white', {'MODALIAS': 'pci:white'})
+
+        # device node, found through /sys/dev
+        self.black = self.sys.add('usb', 'black', {'modalias': 'usb:black', 'dev': '189:1'})
+        dev_dir = os.path.join(self.sys.sysfs, 'dev', 'char')
+        os.makedirs(dev_dir)
+        os.symlink(os.path.join('..', '..', 'devices', 'black'),
+                   os.path.join(dev_dir, '189:1'))
+        self._add_db('c189:1', {'MODALIAS': 'usb:black', 'ID_VENDOR': 'Black'})
+
+        # built into the kernel
+        builtin = self.sys.add('pci', 'blue', {'modalias': 'pci:blue'})
+        os.makedirs(os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'blue'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'blue'),
+                   os.path.join(builtin, 'driver'))
+        self._add_db('+pci:blue', {'MODALIAS': 'pci:blue'})
+
+        # no modalias, unknown device, network interface
+        self._add_db('+input:input3', {'ID_INPUT': '1'})
+        self._add_db('+pci:gone', {'MODALIAS': 'pci:gone'})
+        self._add_db('n2', {'MODALIAS': 'pci:net'})
+
+    def tearDown(self):
+        del self.sys
+        shutil.rmtree(self.udev_db)
+
+    def _add_db(self, name, properties):
+        with open(os.path.join(self.udev_db, name), 'w') as f:
+            f.write('I:123456\n')
+            for k, v in properties.items():
+                f.write('E:%s=%s\n' % (k, v))
+            f.write('G:systemd\n')
+
+    def test_udev_modalias_devices(self):
+        '''udev_modalias_devices()'''
+
+        self.assertEqual(hardware.udev_modalias_devices(self.sys.sysfs, self.udev_db),
+                         {'pci:white': [self.white], 'usb:black': [self.black]})
+
+    def test_same_as_sysfs(self):
+        '''udev and sysfs backends agree'''
+
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'udev', self.udev_db),
+                         hardware.modalias_devices(self.sys.sysfs, 'sysfs', self.udev_db))
+
+    def test_no_modaliases(self):
+        '''udev database without modaliases falls back to sysfs'''
+
+        for f in os.listdir(self.udev_db):
+            os.unlink(os.path.join(self.udev_db, f))
+        self._add_db('+input:input3', {'ID_INPUT': '1'})
+
+        self.assertEqual(hardware.udev_modalias_devices(self.sys.sysfs, self.udev_db), None)
+        expected = hardware.sysfs_modalias_devices(self.sys.sysfs)
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'auto', self.udev_db), expected)
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'udev', self.udev_db), expected)
+
+    def test_partial_database(self):
+        '''udev database which lacks some modaliases'''
+
+        green = self.sys.add('pci', 'green', {'modalias': 'pci:green'})
+        self._add_db('+pci:green', {'ID_PATH': 'pci-green'})
+
+        expected = hardware.sysfs_modalias_devices(self.sys.sysfs)
+        self.assertEqual(expected['pci:green'], [green])
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'auto', self.udev_db), expected)
+
+        # forcing udev uses what it has
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'udev', self.udev_db),
+                         {'pci:white': [self.white], 'usb:black': [self.black]})
+
+        # devices without a udev entry are missing as well
+        os.unlink(os.path.join(self.udev_db, '+pci:green'))
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'auto', self.udev_db), expected)
+
+        self._add_db('+pci:green', {'MODALIAS': 'pci:green'})
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'auto', self.udev_db),
+                         {'pci:white': [self.white], 'usb:black': [self.black],
+                          'pci:green': [green]})
+
+    def test_default_backend(self):
+        '''default_modalias_devices() only reads udev if requested'''
+
+        green = self.sys.add('pci', 'green', {'modalias': 'pci:green'})
+        orig_env = dict(os.environ)
+        try:
+            os.environ['SYSFS_PATH'] = self.sys.sysfs
+            os.environ['PHARLAP_UDEV_DB'] = self.udev_db
+            os.environ.pop('PHARLAP_DEVICE_BACKEND', None)
+            self.assertEqual(hardware.default_modalias_devices(),
+                             hardware.sysfs_modalias_devices(self.sys.sysfs))
+            self.assertEqual(hardware.default_modalias_devices()['pci:green'], [green])
+
+            os.environ['PHARLAP_DEVICE_BACKEND'] = 'udev'
+            self.assertEqual(hardware.default_modalias_devices(),
+                             {'pci:white': [self.white], 'usb:black': [self.black]})
+        finally:
+            os.environ.clear()
+            os.environ.update(orig_env)
+
+    def test_no_database(self):
+        '''missing udev database falls back to sysfs'''
+
+        missing = os.path.join(self.udev_db, 'nonexisting')
+        self.assertEqual(hardware.udev_modalias_devices(self.sys.sysfs, missing), None)
+        self.assertEqual(hardware.modalias_devices(self.sys.sysfs, 'auto', missing),
+                         hardware.sysfs_modalias_devices(self.sys.sysfs))
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.vga = self.sys.add('pci', '0000:01:00.0', {
+            'modalias': 'pci:v000010DEd000003DEsv00001043sd00008234bc03sc00i00',
+            'class': '0x030000', 'vendor': '0x10de', 'device': '0x03de',
+            'subsystem_vendor': '0x1043', 'subsystem_device': '0x8234'})
+        self.net = self.sys.add('pci', '0000:02:00.0', {
+            'modalias': 'pci:v00008086d000010D3sv00008086sd0000A01Fbc02sc00i00',
+            'class': '0x020000', 'vendor': '0x8086', 'device': '0x10d3'})
+        bus_dir = os.path.join(self.sys.sysfs, 'bus', 'pci', 'devices')
+        os.makedirs(bus_dir)
+        for name in ('0000:01:00.0', '0000:02:00.0'):
+            os.symlink(os.path.join('..', '..', '..', 'devices', name),
+                       os.path.join(bus_dir, name))
+
+        # bound to a module
+        os.makedirs(os.path.join(self.sys.sysfs, 'module', 'e1000e'))
+        drv = os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'e1000e')
+        os.makedirs(drv)
+        os.symlink(os.path.join('..', '..', '..', '..', 'module', 'e1000e'),
+                   os.path.join(drv, 'module'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'e1000e'),
+                   os.path.join(self.net, 'driver'))
+
+        self.dmi = self.sys.add('dmi', 'id', {'sys_vendor': 'Dell Inc.',
+                                              'product_name': 'XPS 13\n'})
+
+        self.snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+
+    def tearDown(self):
+        del self.sys
+
+    def test_modaliases(self):
+        '''modalias fields'''
+
+        self.assertEqual(self.snapshot.modalias_devices,
+                         hardware.sysfs_modalias_devices(self.sys.sysfs))
+        self.assertEqual(self.snapshot.modaliases[
+            'pci:v000010DEd000003DEsv00001043sd00008234bc03sc00i00'], self.vga)
+        self.assertEqual(self.snapshot.syspaths, [self.vga, self.net])
+
+    def test_given_modaliases(self):
+        '''modalias map from elsewhere'''
+
+        snapshot = hardware.HardwareSnapshot(modalias_devices={'pci:x': ['/a', '/b']})
+        self.assertEqual(snapshot.modaliases, {'pci:x': '/b'})
+        self.assertEqual(snapshot.syspaths, ['/a', '/b'])
+
+    def test_pci(self):
+        '''PCI IDs and devices'''
+
+        self.assertEqual(self.snapshot.pci_ids(self.vga), ('10de', '03de', '1043', '8234'))
+        self.assertEqual(self.snapshot.pci_ids(self.net), ('8086', '10d3', None, None))
+        self.assertEqual(self.snapshot.pci_devices,
+                         [(self.vga, '0300', '10de', '03de'),
+                          (self.net, '0200', '8086', '10d3')])
+
+    def test_display(self):
+        '''display controllers and boot VGA device'''
+
+        self.assertEqual(self.snapshot.display_devices, [(self.vga, '10de', '03de')])
+        self.assertEqual(self.snapshot.boot_vga, None)
+
+        igd = self.sys.add('pci', '0000:00:02.0', {
+            'modalias': 'pci:v00008086d00000166sv00001043sd00008234bc03sc00i00',
+            'class': '0x030000', 'vendor': '0x8086', 'device': '0x0166',
+            'boot_vga': '1'})
+        self.sys.set_attribute(self.vga, 'boot_vga', '0')
+        os.symlink(os.path.join('..', '..', '..', 'devices', '0000:00:02.0'),
+                   os.path.join(self.sys.sysfs, 'bus', 'pci', 'devices', '0000:00:02.0'))
+
+        snapshot = hardware.HardwareSnapshot(self.sys.sysfs)
+        self.assertEqual(snapshot.display_devices,
+                         [(igd, '8086', '0166'), (self.vga, '10de', '03de')])
+        self.assertEqual(snapshot.boot_vga, igd)
+
+    def test_usb(self):
+        '''USB IDs of devices and interfaces'''
+
+        dev = self.sys.add('usb', '1-1', {'idVendor': '046d', 'idProduct': '082d'})
+        iface = os.path.join(dev, '1-1:1.0')
+        os.mkdir(iface)
+        self.sys.set_attribute(iface, 'modalias', 'usb:v046Dp082Dd0011dcEFdsc02dp01ic0Eisc01ip00in00')
+
+        self.assertEqual(self.snapshot.usb_ids(dev), ('046d', '082d'))
+        self.assertEqual(self.snapshot.usb_ids(iface), ('046d', '082d'))
+        self.assertEqual(self.snapshot.usb_ids(self.vga), (None, None))
+
+    def test_driver(self):
+        '''driver and module links'''
+
+        self.assertEqual(self.snapshot.driver(self.net), 'e1000e')
+        self.assertEqual(self.snapshot.module(self.net), 'e1000e')
+        self.assertEqual(self.snapshot.driver(self.vga), None)
+        self.assertEqual(self.snapshot.module(self.vga), None)
+
+    def test_read_once(self):
+        '''values are read only once'''
+
+        self.assertEqual(self.snapshot.attribute(self.vga, 'device'), '0x03de')
+        self.sys.set_attribute(self.vga, 'device', '0x1234')
+        self.assertEqual(self.snapshot.attribute(self.vga, 'device'), '0x03de')
+        self.assertEqual(self.snapshot.pci_ids(self.vga)[1], '03de')
+
+        dmi = self.snapshot.dmi
+        self.sys.set_attribute(self.dmi, 'sys_vendor', 'Other')
+        self.assertTrue(self.snapshot.dmi is dmi)
+
+    def test_read_only(self):
+        '''snapshots cannot be modified'''
+
+        self.assertRaises(AttributeError, setattr, self.snapshot, 'modaliases', {})
+        self.assertRaises(AttributeError, setattr, self.snapshot, 'foo', 1)
+
+    def test_dmi(self):
+        '''DMI information'''
+
+        self.assertEqual(self.snapshot.dmi, {'sys_vendor': 'Dell Inc.',
+                                             'product_name': 'XPS 13'})
+
+        info = quirkinfo.QuirkInfo(self.snapshot).get_dmi_info()
+        self.assertEqual(info['sys_vendor'], 'Dell Inc.')
+        self.assertEqual(info['product_name'], 'XPS 13')
+        self.assertEqual(info['bios_version'], '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import hwdata
+from Pharlap import indexstore
+
+PCI_IDS = b'''#
+#\tList of PCI ID's
+#
+# Syntax:
+# vendor  vendor_name
+#\tdevice  device_name\t\t\t\t<-- single tab
+#\t\tsubvendor subdevice  subsystem_name\t<-- two tabs
+
+0001  SafeNet (wrong ID)
+10de  NVIDIA Corporation
+\t0020  NV4 [Riva TNT]
+\t\t1043 0200  V3400 TNT
+\t03de  C61 [GeForce 7025 / nForce 630a]
+# comment within vendor
+\t10c3  GT218 [GeForce 8400 GS Rev. 3]
+\t\t1043 8234  EN8400GS
+8086  Intel Corporation
+\t10d3  82574L Gigabit Network Connection
+
+# List of known device classes, subclasses and programming interfaces
+
+C 03  Display controller
+\t00  VGA compatible controller
+\t\t00  VGA controller
+'''
+
+USB_IDS = b'''# usb.ids
+046d  Logitech, Inc.
+\t082d  HD Pro Webcam C920
+\t\t00  Video Control
+\tc52b  Unifying Receiver
+C 00  (Defined at Interface level)
+\t01  Audio
+HUT 01  Generic Desktop Controls
+\t000  Undefined
+'''
+
+
+class HwdataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.pci_ids = os.path.join(self.workdir, 'pci.ids')
+        with open(self.pci_ids, 'wb') as f:
+            f.write(PCI_IDS)
+        self.usb_ids = os.path.join(self.workdir, 'usb.ids')
+        with open(self.usb_ids, 'wb') as f:
+            f.write(USB_IDS)
+        self.cache = os.path.join(self.workdir, 'cache', 'pci.ids.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_pci(self):
+        '''pci.ids lookups'''
+
+        db = hwdata.IdDatabase(self.pci_ids, False)
+        self.assertEqual(db.vendor_name('10de'), 'NVIDIA Corporation')
+        self.assertEqual(db.vendor_name('10DE'), 'NVIDIA Corporation')
+        self.assertEqual(db.device_name('10de', '03DE'), 'C61 [GeForce 7025 / nForce 630a]')
+        self.assertEqual(db.device_name('10de', '10c3'), 'GT218 [GeForce 8400 GS Rev. 3]')
+        self.assertEqual(db.device_name('8086', '10d3'), '82574L Gigabit Network Connection')
+        self.assertEqual(db.subsystem_name('10de', '10c3', '1043', '8234'), 'EN8400GS')
+        self.assertEqual(db.subsystem_name('10de', '0020', '1043', '0200'), 'V3400 TNT')
+
+        self.assertEqual(db.vendor_name('1234'), None)
+        self.assertEqual(db.device_name('1234', '0001'), None)
+        self.assertEqual(db.device_name('10de', '1234'), None)
+        self.assertEqual(db.subsystem_name('10de', '03de', '1043', '8234'), None)
+        # class entries do not belong to the last vendor
+        self.assertEqual(db.device_name('8086', '00'), None)
+
+    def test_usb(self):
+        '''usb.ids lookups'''
+
+        db = hwdata.IdDatabase(self.usb_ids, False)
+        self.assertEqual(db.vendor_name('046D'), 'Logitech, Inc.')
+        self.assertEqual(db.device_name('046d', '082D'), 'HD Pro Webcam C920')
+        self.assertEqual(db.device_name('046d', 'c52b'), 'Unifying Receiver')
+        self.assertEqual(db.device_name('046d', '01'), None)
+
+    def test_cache(self):
+        '''persistent vendor index'''
+
+        db = hwdata.IdDatabase(self.pci_ids, self.cache)
+        self.assertTrue(os.path.exists(self.cache))
+        self.assertEqual(db.vendor_name('8086'), 'Intel Corporation')
+
+        db = hwdata.IdDatabase(self.pci_ids, self.cache)
+        self.assertEqual(db.vendor_name('8086'), 'Intel Corporation')
+
+        # changed file invalidates the index
+        with open(self.pci_ids, 'wb') as f:
+            f.write(b'8086  Intel Corp.\n')
+        db = hwdata.IdDatabase(self.pci_ids, self.cache)
+        self.assertEqual(db.vendor_name('8086'), 'Intel Corp.')
+        self.assertEqual(db.vendor_name('10de'), None)
+
+    def test_empty(self):
+        '''empty database'''
+
+        with open(self.pci_ids, 'wb') as f:
+            pass
+        db = hwdata.IdDatabase(self.pci_ids, False)
+        self.assertEqual(db.vendor_name('10de'), None)
+
+    def test_database(self):
+        '''database() opens databases once'''
+
+        orig_dir = hwdata.HWDATA_DIR
+        orig_cache_dir = indexstore.cache_dir
+        hwdata.HWDATA_DIR = self.workdir
+        indexstore.cache_dir = lambda: os.path.join(self.workdir, 'cache')
+        hwdata.database.databases.clear()
+        try:
+            db = hwdata.database('pci')
+            self.assertEqual(db.vendor_name('10de'), 'NVIDIA Corporation')
+            self.assertTrue(hwdata.database('pci') is db)
+            self.assertEqual(hwdata.database('ssb'), None)
+            self.assertTrue(os.path.exists(os.path.join(self.workdir, 'cache', 'pci.ids.idx')))
+        finally:
+            hwdata.HWDATA_DIR = orig_dir
+            indexstore.cache_dir = orig_cache_dir
+            hwdata.database.databases.clear()
+
+if __name__ == '__main__':
+    unittest.main()
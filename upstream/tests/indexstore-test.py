@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import indexstore
+
+
+class IndexStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        os.chmod(self.workdir, 0o700)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_roundtrip(self):
+        '''save() and load()'''
+
+        path = os.path.join(self.workdir, 'sub', 'map.idx')
+        data = {'pci': {'pci:v000010DEd*': ['nvidia']}, 'usb': {}}
+        self.assertTrue(indexstore.save(data, path, ('key1', 2), 1))
+        self.assertEqual(indexstore.load(path, ('key1', 2), 1), data)
+
+        # different key or format version
+        self.assertEqual(indexstore.load(path, 'key2', 1), None)
+        self.assertEqual(indexstore.load(path, ('key1', 2), 2), None)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['map.idx'])
+
+    def test_data_only(self):
+        '''indexes are stored as data, not as objects'''
+
+        path = os.path.join(self.workdir, 'map.idx')
+        self.assertFalse(indexstore.save(object(), path, 'k', 1))
+        with open(path, 'wb') as f:
+            pickle.dump((1, 'k', {}), f, 2)
+        self.assertEqual(indexstore.load(path, 'k', 1), None)
+
+    def test_untrusted(self):
+        '''indexes which others can write are not used'''
+
+        path = os.path.join(self.workdir, 'map.idx')
+        self.assertTrue(indexstore.save({}, path, 'k', 1))
+        self.assertEqual(indexstore.load(path, 'k', 1), {})
+
+        os.chmod(path, 0o666)
+        self.assertEqual(indexstore.load(path, 'k', 1), None)
+        os.chmod(path, 0o644)
+
+        # world-writable directory like /tmp
+        os.chmod(self.workdir, 0o1777)
+        try:
+            self.assertEqual(indexstore.load(path, 'k', 1), None)
+            self.assertFalse(indexstore.save({}, path, 'k', 1))
+        finally:
+            os.chmod(self.workdir, 0o700)
+
+    def test_invalid(self):
+        '''load() with missing or broken files'''
+
+        path = os.path.join(self.workdir, 'map.idx')
+        self.assertEqual(indexstore.load(path, 'k', 1), None)
+        with open(path, 'w') as f:
+            f.write('garbage')
+        self.assertEqual(indexstore.load(path, 'k', 1), None)
+
+    def test_unwritable(self):
+        '''save() into an unwritable location'''
+
+        path = os.path.join(self.workdir, 'file', 'map.idx')
+        open(os.path.join(self.workdir, 'file'), 'w').close()
+        self.assertFalse(indexstore.save({}, path, 'k', 1))
+
+    def test_cache_dir(self):
+        '''cache_dir() ignores the environment for root'''
+
+        orig_env = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.workdir
+        try:
+            if os.geteuid() == 0:
+                self.assertEqual(indexstore.cache_dir(), '/var/cache/pharlap')
+            else:
+                self.assertEqual(indexstore.cache_dir(), os.path.join(self.workdir, 'pharlap'))
+        finally:
+            if orig_env is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = orig_env
+
+
+if __name__ == '__main__':
+    unittest.main()
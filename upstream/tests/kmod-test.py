@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import kmod
+
+
+class KmodTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.kernel = '3.10.0-test'
+        self.directory = os.path.join(self.workdir, self.kernel)
+        os.makedirs(os.path.join(self.directory, 'kernel', 'drivers'))
+        with open(os.path.join(self.directory, 'modules.dep'), 'w') as f:
+            f.write('kernel/drivers/net/e1000e.ko.xz: kernel/drivers/ptp/ptp.ko.xz\n'
+                    'kernel/drivers/ptp/ptp.ko.xz:\n'
+                    'kernel/drivers/hid/hid-logitech-dj.ko:\n')
+        with open(os.path.join(self.directory, 'modules.builtin'), 'w') as f:
+            f.write('kernel/drivers/usb/host/ehci-hcd.ko\n')
+        self.config_dirs = (os.path.join(self.workdir, 'etc', 'modprobe.d'),
+                            os.path.join(self.workdir, 'lib', 'modprobe.d'))
+        for d in self.config_dirs:
+            os.makedirs(d)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_module_name(self):
+        '''module_name()'''
+
+        self.assertEqual(kmod.module_name('kernel/drivers/hid/hid-logitech-dj.ko'),
+                         'hid_logitech_dj')
+        self.assertEqual(kmod.module_name('nvidia.ko.xz'), 'nvidia')
+        self.assertEqual(kmod.module_name('modules.dep'), None)
+
+    def test_index(self):
+        '''ModuleIndex lookups'''
+
+        idx = kmod.ModuleIndex(self.kernel, self.workdir)
+        self.assertTrue(idx.available('e1000e'))
+        self.assertTrue(idx.available('ptp'))
+        self.assertTrue(idx.available('hid-logitech-dj'))
+        self.assertTrue(idx.available('hid_logitech_dj'))
+        self.assertEqual(idx.path('e1000e'),
+                         os.path.join(self.directory, 'kernel/drivers/net/e1000e.ko.xz'))
+        self.assertFalse(idx.builtin('e1000e'))
+
+        self.assertTrue(idx.available('ehci_hcd'))
+        self.assertTrue(idx.builtin('ehci-hcd'))
+        self.assertEqual(idx.path('ehci_hcd'), None)
+
+        self.assertFalse(idx.available('nvidia'))
+        self.assertFalse(idx.builtin('nvidia'))
+        self.assertEqual(idx.path('nvidia'), None)
+
+    def test_extra(self):
+        '''modules in extra/ and updates/ without depmod'''
+
+        os.makedirs(os.path.join(self.directory, 'extra', 'nvidia'))
+        open(os.path.join(self.directory, 'extra', 'nvidia', 'nvidia.ko'), 'w').close()
+        os.makedirs(os.path.join(self.directory, 'updates', 'dkms'))
+        open(os.path.join(self.directory, 'updates', 'dkms', 'wl.ko.xz'), 'w').close()
+
+        idx = kmod.ModuleIndex(self.kernel, self.workdir)
+        self.assertEqual(idx.path('nvidia'),
+                         os.path.join(self.directory, 'extra', 'nvidia', 'nvidia.ko'))
+        self.assertTrue(idx.available('wl'))
+        self.assertFalse(idx.builtin('wl'))
+
+    def test_aliases(self):
+        '''resolve_alias()'''
+
+        with open(os.path.join(self.directory, 'modules.alias'), 'w') as f:
+            f.write('# Aliases extracted from modules themselves.\n'
+                    'alias fs-ext4 ext4\n'
+                    'alias pci:v000010DEd*sv*sd*bc03sc*i* nouveau\n'
+                    'alias pci:v000010DEd00000DE1sv*sd*bc*sc*i* nvidia\n'
+                    'alias pci:v*d*sv*sd*bc03sc00i00* vga-stub\n'
+                    'alias char-major-10-* misc\n'
+                    'alias usb:v046DpC52Bd*dc*dsc*dp*ic*isc*ip*in* hid-logitech-dj\n')
+        with open(os.path.join(self.directory, 'modules.builtin.alias'), 'w') as f:
+            f.write('alias pci:v*d*sv*sd*bc0Csc03i20* ehci_hcd\n')
+
+        idx = kmod.ModuleIndex(self.kernel, self.workdir, self.config_dirs)
+        self.assertTrue(idx.has_aliases())
+        # file order, first match wins
+        self.assertEqual(idx.resolve_alias('pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'),
+                         ['nouveau', 'nvidia', 'vga_stub'])
+        self.assertEqual(idx.resolve_alias('pci:v00008086d00000046sv00001043sd00008234bc03sc00i00'),
+                         ['vga_stub'])
+        self.assertEqual(idx.resolve_alias('pci:v00008086d00001C26sv00001043sd00008234bc0Csc03i20'),
+                         ['ehci_hcd'])
+        self.assertEqual(idx.resolve_alias('usb:v046DpC52Bd1201dc00dsc00dp00ic03isc01ip01in00'),
+                         ['hid_logitech_dj'])
+        self.assertEqual(idx.resolve_alias('fs-ext4'), ['ext4'])
+        self.assertEqual(idx.resolve_alias('char-major-10-175'), ['misc'])
+        # module names resolve to themselves
+        self.assertEqual(idx.resolve_alias('hid-logitech-dj'), ['hid_logitech_dj'])
+        self.assertEqual(idx.resolve_alias('pci:v00001234d00000001sv00000000sd00000000bc02sc00i00'), [])
+        self.assertEqual(idx.resolve_alias('nonexisting'), [])
+
+        self.assertEqual(idx.resolve_aliases(['fs-ext4', 'nonexisting']),
+                         {'fs-ext4': ['ext4'], 'nonexisting': []})
+
+        self.assertFalse(kmod.ModuleIndex('0.0-none', self.workdir, self.config_dirs).has_aliases())
+
+    def test_config_aliases(self):
+        '''alias directives in the modprobe configuration'''
+
+        with open(os.path.join(self.directory, 'modules.alias'), 'w') as f:
+            f.write('alias pci:v000010DEd*sv*sd*bc03sc*i* nouveau\n')
+        (etc, lib) = self.config_dirs
+        with open(os.path.join(lib, 'nvidia.conf'), 'w') as f:
+            f.write('# packaged default\n'
+                    'alias nvidia nvidia-current\n'
+                    'alias pci:v000010DEd*sv*sd*bc03sc*i* \\\n'
+                    '    nvidia\n'
+                    'blacklist nouveau\n')
+        with open(os.path.join(lib, 'sound.conf'), 'w') as f:
+            f.write('alias snd-card-0 snd-hda-intel\n')
+        # overrides the file in lib
+        with open(os.path.join(etc, 'sound.conf'), 'w') as f:
+            f.write('alias snd-card-0 snd-usb-audio\n\n')
+        with open(os.path.join(etc, 'e1000e.conf.disabled'), 'w') as f:
+            f.write('alias e1000e ptp\n')
+
+        self.assertEqual(kmod.config_aliases(self.config_dirs),
+                         [('nvidia', 'nvidia_current'),
+                          ('pci:v000010DEd*sv*sd*bc03sc*i*', 'nvidia'),
+                          ('snd_card_0', 'snd_usb_audio')])
+
+        idx = kmod.ModuleIndex(self.kernel, self.workdir, self.config_dirs)
+        self.assertEqual(idx.resolve_alias('nvidia'), ['nvidia_current'])
+        self.assertEqual(idx.resolve_alias('snd-card-0'), ['snd_usb_audio'])
+        # configuration aliases take precedence over modules.alias
+        self.assertEqual(idx.resolve_alias('pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'),
+                         ['nvidia'])
+        self.assertEqual(idx.resolve_alias('e1000e'), ['e1000e'])
+
+    def test_missing(self):
+        '''kernel without module directory'''
+
+        idx = kmod.ModuleIndex('0.0-none', self.workdir)
+        self.assertEqual(idx.kernel, '0.0-none')
+        self.assertFalse(idx.available('e1000e'))
+
+    def test_memoized(self):
+        '''index() reads each kernel once until its modules change'''
+
+        orig_dir = kmod.MODULES_DIR
+        kmod.index.indexes.clear()
+        try:
+            kmod.MODULES_DIR = self.workdir
+            idx = kmod.index(self.kernel)
+            self.assertTrue(kmod.index(self.kernel) is idx)
+            self.assertTrue(idx.available('ptp'))
+            self.assertEqual(kmod.index().kernel, os.uname()[2])
+
+            # installing a module reads the index again
+            os.makedirs(os.path.join(self.workdir, self.kernel, 'updates'))
+            with open(os.path.join(self.workdir, self.kernel, 'updates', 'wl.ko'), 'w') as f:
+                f.write('')
+            self.assertFalse(idx.available('wl'))
+            new_idx = kmod.index(self.kernel)
+            self.assertFalse(new_idx is idx)
+            self.assertTrue(new_idx.available('wl'))
+            self.assertTrue(kmod.index(self.kernel) is new_idx)
+        finally:
+            kmod.MODULES_DIR = orig_dir
+            kmod.index.indexes.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import fnmatch
+import random
+import unittest
+
+from Pharlap import modalias
+from Pharlap import modaliasvector
+
+# bus -> modalias -> [package, ...], as built by _yum_cache_modalias_map()
+MODALIAS_MAP = {
+    'pci': {
+        'pci:v00001234d*sv*sd*bc*sc*i*': set(['vanilla']),
+        'pci:v0000BEEFd*sv*sd*bc*sc*i*': set(['vanilla']),
+        'pci:v0000BEEFd*sv*sd*bc*sc*i00': set(['chocolate']),
+        'pci:nvidia': set(['nvidia-current', 'nvidia-old']),
+        'pci:v000010DEd000010C3sv00sd01bc03sc00i00': set(['nvidia-current', 'nvidia-old']),
+        'pci:v000010DEd000010C3sv*sd*bc03sc*i*': set(['kmod-nvidia']),
+        'pci:v000010DEd*sv*sd*bc03sc*i*': set(['kmod-nvidia-304xx']),
+        'pci:v00008086d*sv*sd*bc04sc03i00*': set(['snd']),
+        'pci:v0000100[0-2]d?sv*': set(['classy']),
+        'pci:v0000[!1]*': set(['negated']),
+        'pci:v[0000': set(['unterminated']),
+    },
+    'usb': {
+        'usb:v9876dABCDsv*sd*bc00sc*i*': set(['chocolate']),
+        'usb:v0BDAp8176d*dc*dsc*dp*ic*isc*ip*in*': set(['rtl8192cu']),
+        'usb:v0BDAp*d*dc*dsc*dp*icFFiscFFipFFin*': set(['rtl-vendor']),
+    },
+}
+
+MODALIASES = [
+    'pci:v00001234d00sv00000001sd00bc00sc00i00',
+    'pci:v00001234d00000001sv00sd01bc02sc03i04',
+    'pci:v0000BEEFd0sv00sd00bc00sc00i01',
+    'pci:v0000BEEFd0sv00sd00bc00sc00i00',
+    'pci:nvidia',
+    'pci:nvidiaX',
+    'pci:v000010DEd000010C3sv00sd01bc03sc00i00',
+    'pci:v000010DEd000010C3sv00001043sd00008383bc03sc00i00',
+    'pci:v000010DEd00000FFFsv00001043sd00008383bc03sc02i00',
+    'pci:v00008086d00003B56sv000017AAsd0000215Ebc04sc03i00',
+    'pci:v00001001d5sv',
+    'pci:v00001003d5sv',
+    'pci:v[0000',
+    'pci:vDEADBEEFd00',
+    'usb:v9876dABCDsv01sd02bc00sc01i05',
+    'usb:v0BDAp8176d0200dc00dsc00dp00icFFiscFFipFFin00',
+    'usb:v0BDAp8178d0200dc00dsc00dp00icFFiscFFipFFin00',
+    'usb:v1D6Bp0002d0310dc09dsc00dp00ic09isc00ip00in00',
+    'fake:DEADBEEF',
+]
+
+
+def fnmatch_packages(modalias_map, alias):
+    '''Reference implementation: fnmatch against every pattern'''
+
+    result = set()
+    for pattern, packages in modalias_map.get(alias.split(':', 1)[0], {}).items():
+        if fnmatch.fnmatchcase(alias, pattern):
+            result.update(packages)
+    return result
+
+
+class ModaliasMatcherTestCase(unittest.TestCase):
+
+    def test_matches_fnmatch(self):
+        '''ModaliasMatcher gives the same results as fnmatch'''
+
+        for bus, aliases in MODALIAS_MAP.items():
+            matcher = modalias.ModaliasMatcher(aliases)
+            for alias in MODALIASES:
+                if alias.startswith(bus + ':'):
+                    self.assertEqual(matcher.match(alias),
+                                     fnmatch_packages(MODALIAS_MAP, alias), alias)
+
+    def test_random_globs(self):
+        '''ModaliasMatcher agrees with fnmatch on random globs'''
+
+        rnd = random.Random(42)
+        alphabet = 'ab*?[]!-'
+        patterns = {}
+        for i in range(300):
+            p = ''.join(rnd.choice(alphabet) for j in range(rnd.randint(0, 7)))
+            patterns.setdefault(p, set()).add('pkg%i' % i)
+        matcher = modalias.ModaliasMatcher(patterns)
+
+        for i in range(500):
+            s = ''.join(rnd.choice('ab[]!-') for j in range(rnd.randint(0, 8)))
+            expected = set()
+            for p, pkgs in patterns.items():
+                if fnmatch.fnmatchcase(s, p):
+                    expected.update(pkgs)
+            self.assertEqual(matcher.match(s), expected, s)
+
+    def test_pattern_count(self):
+        '''ModaliasMatcher counts distinct patterns'''
+
+        matcher = modalias.ModaliasMatcher()
+        matcher.add('pci:v*', ['a'])
+        matcher.add('pci:v**', ['b'])
+        matcher.add('pci:v0000', ['c'])
+        self.assertEqual(len(matcher), 2)
+        self.assertEqual(matcher.match('pci:v0000'), set(['a', 'b', 'c']))
+
+
+class ModaliasIndexTestCase(unittest.TestCase):
+
+    def test_matches_fnmatch(self):
+        '''ModaliasIndex gives the same results as fnmatch'''
+
+        index = modalias.ModaliasIndex(MODALIAS_MAP)
+        for alias in MODALIASES:
+            self.assertEqual(index.match(alias),
+                             fnmatch_packages(MODALIAS_MAP, alias), alias)
+
+    def test_buckets(self):
+        '''ModaliasIndex puts literal vendor/device patterns into buckets'''
+
+        index = modalias.ModaliasIndex(MODALIAS_MAP)
+        self.assertEqual(sorted(index.buses()), ['pci', 'usb'])
+        self.assertEqual(len(index._buckets['pci'][('000010DE', '000010C3')]), 2)
+        self.assertEqual(len(index._buckets['pci'][('000010DE', None)]), 1)
+        # pci:nvidia, the character classes and the unterminated class
+        self.assertEqual(len(index._buckets['pci'][None]), 4)
+        self.assertEqual(len(index._buckets['usb'][None]), 0)
+
+        # buckets are compiled on their first lookup
+        self.assertEqual(index._matchers, {})
+        index.match('pci:v000010DEd000010C3sv00001043sd00008234bc03sc00i00')
+        self.assertEqual(set(index._matchers),
+                         set([('pci', None), ('pci', ('000010DE', None)),
+                              ('pci', ('000010DE', '000010C3'))]))
+
+    def test_data(self):
+        '''ModaliasIndex.data() and from_data() round trip through JSON'''
+
+        data = json.loads(json.dumps(modalias.ModaliasIndex(MODALIAS_MAP).data()))
+        index = modalias.ModaliasIndex.from_data(data)
+        self.assertEqual(sorted(index.buses()), ['pci', 'usb'])
+        for alias in MODALIASES:
+            self.assertEqual(index.match(alias),
+                             fnmatch_packages(MODALIAS_MAP, alias), alias)
+
+        self.assertRaises(ValueError, modalias.ModaliasIndex.from_data, {'pci': 1})
+        self.assertRaises(ValueError, modalias.ModaliasIndex.from_data, {'pci': [[None, None, []]]})
+        self.assertRaises(ValueError, modalias.ModaliasIndex.from_data, [])
+
+    def test_modalias_map(self):
+        '''ModaliasIndex.modalias_map() returns the indexed patterns'''
+
+        index = modalias.ModaliasIndex(MODALIAS_MAP)
+        self.assertEqual(index.modalias_map(), MODALIAS_MAP)
+        self.assertEqual(index.modalias_map(['usb', 'acpi']), {'usb': MODALIAS_MAP['usb']})
+
+        # buses are loaded on demand
+        index = modalias.ModaliasIndex(loader=MODALIAS_MAP.get)
+        self.assertEqual(index.buses(), [])
+        self.assertEqual(index.modalias_map(['pci']), {'pci': MODALIAS_MAP['pci']})
+        self.assertEqual(index.buses(), ['pci'])
+
+    def test_parse_modalias(self):
+        '''parse_modalias() splits pci and usb modaliases'''
+
+        self.assertEqual(modalias.parse_modalias(
+            'pci:v00008086d00003B56sv000017AAsd0000215Ebc04sc03i00'),
+            {'vendor': 0x8086, 'device': 0x3B56, 'subvendor': 0x17AA,
+             'subdevice': 0x215E, 'class': 4, 'subclass': 3, 'interface': 0})
+        fields = modalias.parse_modalias(
+            'usb:v0BDAp8176d0200dc00dsc00dp00icFFiscFFipFFin00')
+        self.assertEqual(fields['vendor'], 0x0BDA)
+        self.assertEqual(fields['device'], 0x8176)
+        self.assertEqual(fields['number'], 0)
+        self.assertFalse('number' in modalias.parse_modalias(
+            'usb:v0BDAp8176d0200dc00dsc00dp00icFFiscFFipFF'))
+
+        self.assertEqual(modalias.parse_modalias('pci:nvidia'), None)
+        self.assertEqual(modalias.parse_modalias('pci:v00008086d00003b56'), None)
+        self.assertEqual(modalias.parse_modalias('acpi:PNP0A08:'), None)
+
+
+def random_modalias_map(rnd, count):
+    '''Generate random field-wise pci and usb patterns'''
+
+    result = {}
+    for i in range(count):
+        bus = rnd.choice(['pci', 'usb'])
+        pattern = bus + ':'
+        for (name, marker, width) in modalias.MODALIAS_FIELDS[bus]:
+            if rnd.random() < 0.6:
+                pattern += marker + '*'
+            else:
+                pattern += marker + ''.join(rnd.choice('01AD') for j in range(width))
+        if rnd.random() < 0.2:
+            pattern += '*'
+        elif rnd.random() < 0.1:
+            # not decomposable
+            pattern = pattern.replace('*', '?', 1)
+        result.setdefault(bus, {}).setdefault(pattern, set()).add('pkg%i' % i)
+    return result
+
+def random_modaliases(rnd, count):
+    result = []
+    for i in range(count):
+        bus = rnd.choice(['pci', 'usb'])
+        alias = bus + ':'
+        for (name, marker, width) in modalias.MODALIAS_FIELDS[bus]:
+            if name == 'number' and rnd.random() < 0.1:
+                continue
+            alias += marker + ''.join(rnd.choice('01AD') for j in range(width))
+        result.append(alias)
+    return result
+
+
+@unittest.skipUnless(modaliasvector.numpy, 'NumPy not available')
+class VectorModaliasMatcherTestCase(unittest.TestCase):
+
+    def test_decompose_pattern(self):
+        '''decompose_pattern()'''
+
+        self.assertEqual(modaliasvector.decompose_pattern(
+            'pci:v000010DEd*sv*sd*bc03sc00i00*'),
+            [(0x10DE, 0xFFFFFFFF), (0, 0), (0, 0), (0, 0),
+             (3, 0xFF), (0, 0xFF), (0, 0xFF)])
+        self.assertEqual(modaliasvector.decompose_pattern('pci:nvidia'), None)
+        self.assertEqual(modaliasvector.decompose_pattern(
+            'pci:v000010DEd0000*sv*sd*bc03sc00i00'), None)
+        self.assertEqual(modaliasvector.decompose_pattern(
+            'usb:v0BDAp8176d*dc*dsc*dp*ic*isc*ip*'), None)
+
+    def test_matches_fnmatch(self):
+        '''VectorModaliasMatcher gives the same results as fnmatch'''
+
+        matcher = modaliasvector.VectorModaliasMatcher(MODALIAS_MAP)
+        for alias, result in zip(MODALIASES, matcher.match(MODALIASES)):
+            self.assertEqual(result, fnmatch_packages(MODALIAS_MAP, alias), alias)
+
+    def test_random(self):
+        '''VectorModaliasMatcher agrees with ModaliasIndex on random data'''
+
+        rnd = random.Random(7)
+        modalias_map = random_modalias_map(rnd, 400)
+        aliases = random_modaliases(rnd, 700)
+        index = modalias.ModaliasIndex(modalias_map)
+        matcher = modaliasvector.VectorModaliasMatcher(modalias_map)
+        matched = 0
+        for alias, result in zip(aliases, matcher.match(aliases, chunk_size=50)):
+            expected = fnmatch_packages(modalias_map, alias)
+            self.assertEqual(result, expected, alias)
+            self.assertEqual(index.match(alias), expected, alias)
+            matched += bool(result)
+        self.assertGreater(matched, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import modaliasmap
+from Pharlap.modalias import ModaliasIndex
+
+JSON_MAP = {
+    'kmod-nvidia': {'modaliases': [
+        {'alias': 'pci:v000010DEd*sv*sd*bc03sc00i00*', 'module': 'nvidia'},
+        {'alias': 'pci:v000010DEd*sv*sd*bc03sc02i00*', 'module': 'nvidia'},
+    ]},
+    'kmod-wl': {'modaliases': [
+        {'alias': 'pci:v000014E4d00004311sv*sd*bc02sc80i*', 'module': 'wl'},
+        {'alias': 'usb:v0A5Cp*d*dc*dsc*dp*ic*isc*ip*in*', 'module': 'wl'},
+    ]},
+    'kmod-r8168': {'modaliases': [
+        {'alias': 'pci:v000010ECd00008168sv*sd*bc*sc*i*', 'module': 'r8168'},
+        {'alias': 'pci:v000014E4d00004311sv*sd*bc02sc80i*', 'module': 'r8168'},
+    ]},
+    'kmod-empty': {'modaliases': []},
+}
+
+
+class BinaryModaliasMapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.workdir, 'pharlap-modalias.map')
+        self.path = os.path.join(self.workdir, 'pharlap-modalias.bin')
+        with open(self.json_path, 'w') as f:
+            json.dump(JSON_MAP, f)
+        modaliasmap.convert(self.json_path, self.path)
+        self.map = modaliasmap.BinaryModaliasMap(self.path)
+
+    def tearDown(self):
+        self.map.close()
+        shutil.rmtree(self.workdir)
+
+    def test_packages(self):
+        '''BinaryModaliasMap package records'''
+
+        self.assertEqual(sorted(self.map.packages()),
+                         ['kmod-nvidia', 'kmod-r8168', 'kmod-wl'])
+        self.assertTrue('kmod-wl' in self.map)
+        self.assertFalse('kmod-empty' in self.map)
+        for package in self.map.packages():
+            key = lambda r: (r['alias'], r['module'])
+            self.assertEqual(sorted(self.map.modaliases(package), key=key),
+                             sorted(JSON_MAP[package]['modaliases'], key=key))
+        self.assertRaises(KeyError, self.map.modaliases, 'kmod-empty')
+
+    def test_buses(self):
+        '''BinaryModaliasMap bus sections'''
+
+        self.assertEqual(sorted(self.map.buses()), ['pci', 'usb'])
+        self.assertEqual(self.map.bus_map('usb'),
+                         {'usb:v0A5Cp*d*dc*dsc*dp*ic*isc*ip*in*': set(['kmod-wl'])})
+        self.assertEqual(self.map.bus_map('pci')['pci:v000014E4d00004311sv*sd*bc02sc80i*'],
+                         set(['kmod-wl', 'kmod-r8168']))
+        self.assertEqual(len(self.map.bus_map('pci')), 4)
+        self.assertEqual(self.map.bus_map('acpi'), {})
+
+    def test_checksum(self):
+        '''BinaryModaliasMap records the checksum of the JSON map'''
+
+        import hashlib
+        with open(self.json_path, 'rb') as f:
+            self.assertEqual(self.map.checksum, hashlib.sha1(f.read()).hexdigest())
+
+    def test_lazy_index(self):
+        '''ModaliasIndex only loads the buses which get queried'''
+
+        loaded = []
+
+        def loader(bus):
+            loaded.append(bus)
+            return self.map.bus_map(bus)
+
+        index = ModaliasIndex(loader=loader)
+        self.assertEqual(index.match('pci:v000010DEd00001234sv00sd00bc03sc00i00'),
+                         set(['kmod-nvidia']))
+        self.assertEqual(index.match('pci:v000010ECd00008168sv00sd00bc02sc00i00'),
+                         set(['kmod-r8168']))
+        self.assertEqual(loaded, ['pci'])
+        self.assertEqual(index.match('acpi:PNP0A08:'), set())
+        self.assertEqual(loaded, ['pci', 'acpi'])
+
+    def test_invalid(self):
+        '''BinaryModaliasMap rejects other files'''
+
+        self.assertRaises(ValueError, modaliasmap.BinaryModaliasMap, self.json_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pharlap import hardware
+from Pharlap import indexstore
+from Pharlap import resultcache
+
+import fakesysfs
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.orig_env = os.environ.pop('PHARLAP_RESULT_CACHE', None)
+        self.orig_cache_dir = indexstore.cache_dir
+        indexstore.cache_dir = lambda: os.path.join(self.workdir, 'cache')
+
+        self.sys = fakesysfs.SysFS()
+        self.white = self.sys.add('pci', 'white', {'modalias': 'pci:white'})
+        self.rpmdb = os.path.join(self.workdir, 'Packages')
+        with open(self.rpmdb, 'w') as f:
+            f.write('db')
+
+    def tearDown(self):
+        del self.sys
+        shutil.rmtree(self.workdir)
+        indexstore.cache_dir = self.orig_cache_dir
+        os.environ.pop('PHARLAP_RESULT_CACHE', None)
+        if self.orig_env is not None:
+            os.environ['PHARLAP_RESULT_CACHE'] = self.orig_env
+
+    def _fingerprint(self, extra=()):
+        return resultcache.fingerprint(hardware.HardwareSnapshot(self.sys.sysfs),
+                [self.rpmdb, os.path.join(self.workdir, 'plugins', '*')],
+                ['PHARLAP_TEST_VAR'], extra)
+
+    def test_fingerprint_stable(self):
+        '''fingerprint() does not change without changes'''
+
+        self.assertEqual(self._fingerprint(), self._fingerprint())
+        self.assertNotEqual(self._fingerprint(), self._fingerprint(('other',)))
+
+    def test_fingerprint_hardware(self):
+        '''fingerprint() covers the hardware'''
+
+        before = self._fingerprint()
+        self.sys.add('usb', 'black', {'modalias': 'usb:black'})
+        self.assertNotEqual(self._fingerprint(), before)
+
+        before = self._fingerprint()
+        os.makedirs(os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'white'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'white'),
+                   os.path.join(self.white, 'driver'))
+        self.assertNotEqual(self._fingerprint(), before)
+
+    def test_fingerprint_files(self):
+        '''fingerprint() covers files and environment'''
+
+        before = self._fingerprint()
+        with open(self.rpmdb, 'w') as f:
+            f.write('changed db')
+        self.assertNotEqual(self._fingerprint(), before)
+
+        before = self._fingerprint()
+        os.makedirs(os.path.join(self.workdir, 'plugins'))
+        with open(os.path.join(self.workdir, 'plugins', 'foo.py'), 'w') as f:
+            f.write('pass')
+        self.assertNotEqual(self._fingerprint(), before)
+
+        before = self._fingerprint()
+        os.environ['PHARLAP_TEST_VAR'] = '1'
+        try:
+            self.assertNotEqual(self._fingerprint(), before)
+        finally:
+            del os.environ['PHARLAP_TEST_VAR']
+
+    def test_cache_dir(self):
+        '''cache_dir() is below the index cache directory'''
+
+        self.assertEqual(resultcache.cache_dir(), os.path.join(self.workdir, 'cache', 'results'))
+
+        # root does not follow the environment
+        os.environ['PHARLAP_RESULT_CACHE'] = os.path.join(self.workdir, 'env')
+        if os.geteuid() == 0:
+            self.assertEqual(resultcache.cache_dir(), os.path.join(self.workdir, 'cache', 'results'))
+        else:
+            self.assertEqual(resultcache.cache_dir(), os.path.join(self.workdir, 'env'))
+
+    def test_load_store(self):
+        '''load() and store()'''
+
+        self.assertEqual(resultcache.load('packages', 'key1'), None)
+
+        result = {'nvidia-kmod': {'modalias': 'pci:white', 'syspaths': [self.white],
+                                  'free': False, 'from_distro': True}}
+        self.assertTrue(resultcache.store('packages', 'key1', result))
+        self.assertEqual(resultcache.load('packages', 'key1'), result)
+        self.assertEqual(resultcache.load('packages', 'key2'), None)
+        self.assertEqual(resultcache.load('devices', 'key1'), None)
+
+    def test_corrupt(self):
+        '''load() ignores corrupt cache files'''
+
+        os.makedirs(resultcache.cache_dir())
+        with open(os.path.join(resultcache.cache_dir(), 'packages.json'), 'w') as f:
+            f.write('{"key": "key1", "res')
+        self.assertEqual(resultcache.load('packages', 'key1'), None)
+
+    def test_untrusted(self):
+        '''load() ignores results which others can write to'''
+
+        self.assertTrue(resultcache.store('packages', 'key1', {}))
+        os.chmod(os.path.join(resultcache.cache_dir(), 'packages.json'), 0o666)
+        self.assertEqual(resultcache.load('packages', 'key1'), None)
+
+    def test_unwritable(self):
+        '''store() fails gracefully'''
+
+        indexstore.cache_dir = lambda: os.path.join(self.rpmdb, 'cache')
+        self.assertFalse(resultcache.store('packages', 'key1', {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from Pharlap import hardware
+from Pharlap import sysfsarchive
+
+import fakesysfs
+
+
+class SysfsArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.workdir, 'host.tar.gz')
+
+        self.sys = fakesysfs.SysFS()
+        self.vga = self.sys.add('pci', '0000:01:00.0', {
+            'modalias': 'pci:v000010DEd000003DEsv00001043sd00008234bc03sc00i00',
+            'class': '0x030000', 'vendor': '0x10de', 'device': '0x03de',
+            'boot_vga': '1', 'power_state': 'D0'})
+        self.net = self.sys.add('pci', '0000:02:00.0', {
+            'modalias': 'pci:v00008086d000010D3sv00008086sd0000A01Fbc02sc00i00',
+            'class': '0x020000', 'vendor': '0x8086', 'device': '0x10d3'})
+        self.sys.add('tty', 'ttyS0', {'dev': '4:64'})
+        bus_dir = os.path.join(self.sys.sysfs, 'bus', 'pci', 'devices')
+        os.makedirs(bus_dir)
+        for name in ('0000:01:00.0', '0000:02:00.0'):
+            os.symlink(os.path.join('..', '..', '..', 'devices', name),
+                       os.path.join(bus_dir, name))
+
+        # bound to a module
+        os.makedirs(os.path.join(self.sys.sysfs, 'module', 'e1000e'))
+        drv = os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'e1000e')
+        os.makedirs(drv)
+        os.symlink(os.path.join('..', '..', '..', '..', 'module', 'e1000e'),
+                   os.path.join(drv, 'module'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'e1000e'),
+                   os.path.join(self.net, 'driver'))
+
+        # built into the kernel
+        os.makedirs(os.path.join(self.sys.sysfs, 'bus', 'pci', 'drivers', 'vgabuiltin'))
+        os.symlink(os.path.join('..', '..', 'bus', 'pci', 'drivers', 'vgabuiltin'),
+                   os.path.join(self.vga, 'driver'))
+
+        self.sys.add('dmi', 'id', {'sys_vendor': 'Dell Inc.', 'product_name': 'XPS 13',
+                                   'product_serial': '4CE0460D0G', 'board_serial': '.4CE0460D0G.',
+                                   'chassis_serial': 'CN12963', 'chassis_type': '10',
+                                   'product_uuid': '4c4c4544-0034-4310-8030-b4c04f4e3232'})
+
+    def tearDown(self):
+        del self.sys
+        shutil.rmtree(self.workdir)
+
+    def test_roundtrip(self):
+        '''capture() and Replay give the same hardware information'''
+
+        sysfsarchive.capture(self.archive, self.sys.sysfs)
+        self.assertTrue(sysfsarchive.is_archive(self.archive))
+
+        with sysfsarchive.Replay(self.archive, self.workdir) as replay:
+            def relative(path):
+                return replay.original_path(path, self.sys.sysfs)
+
+            for fn in (hardware.sysfs_modalias_devices, hardware.walk_modalias_devices):
+                replayed = fn(replay.sysfs_dir)
+                self.assertEqual(dict((alias, [relative(p) for p in paths])
+                                      for alias, paths in replayed.items()),
+                                 hardware.sysfs_modalias_devices(self.sys.sysfs))
+
+            orig = hardware.HardwareSnapshot(self.sys.sysfs)
+            snapshot = hardware.HardwareSnapshot(replay.sysfs_dir)
+            self.assertEqual([(relative(d[0]),) + d[1:] for d in snapshot.pci_devices],
+                             orig.pci_devices)
+            self.assertEqual(snapshot.dmi, {'sys_vendor': 'Dell Inc.', 'product_name': 'XPS 13'})
+            self.assertEqual(snapshot.attribute(os.path.join(replay.sysfs_dir,
+                'devices', '0000:01:00.0'), 'boot_vga'), '1')
+            self.assertEqual(snapshot.module(os.path.join(replay.sysfs_dir,
+                'devices', '0000:02:00.0')), 'e1000e')
+
+            # only the attributes which detection needs
+            self.assertFalse(os.path.exists(os.path.join(replay.sysfs_dir,
+                'devices', '0000:01:00.0', 'power_state')))
+            self.assertFalse(os.path.exists(os.path.join(replay.sysfs_dir,
+                'devices', 'ttyS0')))
+
+            # no DMI serial numbers or UUIDs
+            dmi_dir = os.path.join(replay.sysfs_dir, 'class', 'dmi', 'id')
+            for name in ('product_serial', 'board_serial', 'chassis_serial', 'product_uuid'):
+                self.assertFalse(os.path.exists(os.path.join(dmi_dir, name)), name)
+            self.assertTrue(os.path.exists(os.path.join(dmi_dir, 'product_name')))
+
+            sysfs_dir = replay.sysfs_dir
+        self.assertFalse(os.path.exists(sysfs_dir))
+
+    def _tar(self, members):
+        tar = tarfile.open(self.archive, 'w:gz')
+        for name, linkname in members:
+            info = tarfile.TarInfo(name)
+            if linkname:
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+                tar.addfile(info)
+            else:
+                info.size = 1
+                tar.addfile(info, io.BytesIO(b'x'))
+        tar.close()
+
+    def test_invalid(self):
+        '''Replay rejects archives which write outside of the tree'''
+
+        for members in ([('../escape', None)],
+                        [('/etc/escape', None)],
+                        [('devices/foo', '/etc')],
+                        [('devices/foo', '../../../etc')]):
+            self._tar(members)
+            self.assertRaises(ValueError, sysfsarchive.Replay, self.archive, self.workdir)
+        self.assertEqual(os.listdir(self.workdir), ['host.tar.gz'])
+
+        self.assertFalse(sysfsarchive.is_archive(os.path.join(self.workdir, 'nonexisting')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import unittest
+
+import fakesysfs
+import fakeyum
+
+from Pharlap import detect
+from Pharlap import hardware
+from Pharlap import watch
+
+NVIDIA = 'pci:v000010DEd00000DE1sv00001043sd00008234bc03sc00i00'
+BROADCOM = 'pci:v000014E4d00004727sv0000103Csd00001483bc02sc80i00'
+
+
+class FakeMonitor(object):
+    '''UeventMonitor which returns prepared events.'''
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.closed = False
+
+    def receive(self, timeout=None, settle=0.2):
+        return self.events.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sys = fakesysfs.SysFS()
+        self.nvidia = self.sys.add('pci', '0000:01:00.0', {'modalias': NVIDIA})
+        self.sys.add('pci', '0000:00:1f.0', {
+            'modalias': 'pci:v00008086d00001C44sv00001043sd00008234bc06sc01i00'})
+
+        self.yum_cache = fakeyum.YumCache()
+        self.yum_cache.add('nvidia-kmod', ['pci:v000010DEd*sv*sd*bc03sc*i*'], module='nvidia')
+        self.yum_cache.add('wl-kmod', ['pci:v000014E4d*sv*sd*bc02sc80i*'], module='wl')
+
+        # modaliases which drivers get detected for
+        self.detected = []
+        self.orig_system_device_drivers = detect.system_device_drivers
+        def system_device_drivers(yum_cache, snapshot=None, modaliases=None, plugins=True, **kwargs):
+            self.detected.append(sorted(modaliases or snapshot.modalias_devices))
+            return self.orig_system_device_drivers(yum_cache, snapshot, modaliases, plugins, **kwargs)
+        detect.system_device_drivers = system_device_drivers
+
+        self.watcher = watch.DeviceWatcher(self.yum_cache, self.sys.sysfs, plugins=False)
+
+    def tearDown(self):
+        detect.system_device_drivers = self.orig_system_device_drivers
+        detect.invalidate_caches()
+        del self.sys
+
+    def _add_broadcom(self):
+        return self.sys.add('pci', '0000:02:00.0', {'modalias': BROADCOM})
+
+    def test_diff_devices(self):
+        '''diff_devices()'''
+
+        old = {'/sys/a': {'modalias': 'pci:a', 'drivers': {'a-kmod': {}}},
+               '/sys/b': {'modalias': 'pci:b', 'drivers': {'b-kmod': {}}},
+               'sl-modem.py': {'drivers': {'sl-modem-daemon': {}}}}
+        new = {'/sys/a': {'modalias': 'pci:a2', 'drivers': {'a-kmod': {}}},
+               '/sys/c': {'modalias': 'pci:c', 'drivers': {'c-kmod': {}}},
+               'sl-modem.py': {'drivers': {'sl-modem-daemon': {}}}}
+        self.assertEqual(watch.diff_devices(old, new),
+                         [('changed', '/sys/a', new['/sys/a']),
+                          ('removed', '/sys/b', old['/sys/b']),
+                          ('added', '/sys/c', new['/sys/c'])])
+        self.assertEqual(watch.diff_devices(old, old), [])
+        self.assertEqual(watch.diff_devices({}, {}), [])
+
+    def test_initial(self):
+        '''DeviceWatcher detects the current devices'''
+
+        self.assertEqual(sorted(self.watcher.devices), [self.nvidia])
+        self.assertEqual(sorted(self.watcher.devices[self.nvidia]['drivers']), ['nvidia-kmod'])
+        self.assertFalse(self.watcher.live)
+
+    def test_updated_devices(self):
+        '''_updated_devices() only reads the given devices again'''
+
+        broadcom = self._add_broadcom()
+        orig = dict(self.watcher.modalias_devices)
+        # unchanged devices are not read again
+        self.sys.set_attribute(self.nvidia, 'modalias', BROADCOM)
+        result = self.watcher._updated_devices([broadcom])
+        self.assertEqual(result[BROADCOM], [broadcom])
+        self.assertEqual(result[NVIDIA], [self.nvidia])
+        self.assertEqual(self.watcher.modalias_devices, orig)
+
+        result = self.watcher._updated_devices([broadcom, self.nvidia])
+        self.assertEqual(result[BROADCOM], sorted([broadcom, self.nvidia]))
+        self.assertNotIn(NVIDIA, result)
+
+    def test_update_added(self):
+        '''update() with an added device'''
+
+        broadcom = self._add_broadcom()
+        del self.detected[:]
+        changes = self.watcher.update([broadcom])
+        self.assertEqual([(action, name) for (action, name, info) in changes],
+                         [('added', broadcom)])
+        self.assertEqual(sorted(changes[0][2]['drivers']), ['wl-kmod'])
+        self.assertEqual(self.detected, [[BROADCOM]])
+        self.assertEqual(sorted(self.watcher.devices), sorted([self.nvidia, broadcom]))
+
+        # nothing changed
+        self.assertEqual(self.watcher.update([broadcom]), [])
+        self.assertEqual(self.detected, [[BROADCOM]])
+
+    def test_update_removed(self):
+        '''update() with a removed device'''
+
+        shutil.rmtree(self.nvidia)
+        del self.detected[:]
+        changes = self.watcher.update([self.nvidia])
+        self.assertEqual([(action, name) for (action, name, info) in changes],
+                         [('removed', self.nvidia)])
+        self.assertEqual(changes[0][2]['modalias'], NVIDIA)
+        self.assertEqual(self.detected, [])
+        self.assertEqual(self.watcher.devices, {})
+
+    def test_update_changed(self):
+        '''update() with a device whose modalias changed'''
+
+        self.sys.set_attribute(self.nvidia, 'modalias', BROADCOM)
+        del self.detected[:]
+        changes = self.watcher.update([self.nvidia])
+        self.assertEqual([(action, name) for (action, name, info) in changes],
+                         [('changed', self.nvidia)])
+        self.assertEqual(changes[0][2]['modalias'], BROADCOM)
+        self.assertEqual(sorted(changes[0][2]['drivers']), ['wl-kmod'])
+        self.assertEqual(self.detected, [[BROADCOM]])
+
+    def test_update_poll(self):
+        '''update() without syspaths enumerates all devices'''
+
+        broadcom = self._add_broadcom()
+        shutil.rmtree(self.nvidia)
+        changes = self.watcher.update()
+        self.assertEqual([(action, name) for (action, name, info) in changes],
+                         [('removed', self.nvidia), ('added', broadcom)])
+
+    def test_watch_uevents(self):
+        '''watch() re-reads the devices of uevents'''
+
+        broadcom = self._add_broadcom()
+        shutil.rmtree(self.nvidia)
+        monitor = FakeMonitor([
+            [{'ACTION': 'change', 'DEVPATH': '/devices/0000:00:1f.0'}],
+            [{'ACTION': 'add', 'DEVPATH': '/devices/0000:02:00.0'},
+             {'ACTION': 'remove', 'DEVPATH': '/devices/0000:01:00.0'}],
+        ])
+
+        # the uevent paths are relative to the fake sysfs
+        sysfs = self.sys.sysfs
+        class Watcher(watch.DeviceWatcher):
+            live = True
+            def update(self, syspaths=None):
+                syspaths = [os.path.join(sysfs, os.path.relpath(p, '/sys')) for p in syspaths]
+                return watch.DeviceWatcher.update(self, syspaths)
+        watcher = Watcher(self.yum_cache, sysfs, plugins=False)
+        watcher.modalias_devices = self.watcher.modalias_devices
+        watcher.devices = self.watcher.devices
+
+        orig_monitor = hardware.UeventMonitor
+        hardware.UeventMonitor = lambda: monitor
+        try:
+            changes = watch.watch(watcher)
+            # the first event does not change any drivers
+            self.assertEqual([(action, name) for (action, name, info) in next(changes)],
+                             [('removed', self.nvidia), ('added', broadcom)])
+            changes.close()
+        finally:
+            hardware.UeventMonitor = orig_monitor
+        self.assertTrue(monitor.closed)
+        self.assertEqual(monitor.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()